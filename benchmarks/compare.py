@@ -0,0 +1,64 @@
+import argparse
+import json
+
+from typing import List, Optional
+
+
+METRICS = [
+    # (name, path, lower is better)
+    ('cold ms', ('cold', 'latency_ms'), True),
+    ('req/s', ('throughput_rps',), False),
+    ('mean ms', ('latency', 'mean_ms'), True),
+    ('p50 ms', ('latency', 'p50_ms'), True),
+    ('p99 ms', ('latency', 'p99_ms'), True),
+    ('peak RSS', ('peak_rss_bytes',), True),
+    ('bytes', ('transferred_bytes',), True),
+]
+
+
+def _get(result: dict, path: tuple) -> Optional[float]:
+    for part in path:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(part, None)
+    return result
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> List[str]:
+    lines = [f'{"items":>8} {"metric":>10} {"baseline":>14} {"candidate":>14} {"change":>9}']
+    baseline_results = {r['items']: r for r in baseline['results']}
+    for result in candidate['results']:
+        previous = baseline_results.get(result['items'], None)
+        if previous is None:
+            continue
+        for name, path, lower_is_better in METRICS:
+            old, new = _get(previous, path), _get(result, path)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old != 0 else 0.0
+            worse = change > threshold if lower_is_better else change < -threshold
+            better = change < -threshold if lower_is_better else change > threshold
+            mark = ' !' if worse else (' +' if better else '')
+            lines.append(f'{result["items"]:>8} {name:>10} {old:>14.2f} {new:>14.2f} {change:>8.1f}%{mark}')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.compare',
+                                     description='Compare two benchmark results')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('-t', '--threshold', type=float, default=5.0,
+                        help='changes within this percentage are not marked')
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(f'baseline:  {baseline.get("commit")} ({baseline.get("created_at")})')
+    print(f'candidate: {candidate.get("commit")} ({candidate.get("created_at")})')
+    print('\n'.join(compare(baseline, candidate, args.threshold)))
+
+
+if __name__ == '__main__':
+    main()
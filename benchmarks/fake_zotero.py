@@ -0,0 +1,139 @@
+import asyncio
+import collections
+import json
+import os
+import time
+
+from aiohttp import web
+from typing import Dict, List, Optional
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeZotero:
+
+    def __init__(self, items: List[dict], version: int = 1, latency: float = 0.0,
+                 max_page_size: int = 100, rate_limit: float = 0.0,
+                 backoff_every: int = 0, backoff: float = 1.0, file_size: int = 65536):
+        self.items = items
+        self.version = version
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.backoff_every = backoff_every
+        self.backoff = backoff
+        self.deleted = []  # type: List[str]
+        self.counts = collections.Counter()  # type: Dict[str, int]
+        self._served = 0
+        self._by_key = {item['key']: item for item in items}
+        self._bucket = TokenBucket(rate_limit) if rate_limit > 0 else None
+        self._file = os.urandom(file_size)
+        self._runner = None  # type: Optional[web.AppRunner]
+        self.url = None  # type: Optional[str]
+
+    def _headers(self) -> dict:
+        headers = {'Last-Modified-Version': str(self.version)}
+        self._served += 1
+        if self.backoff_every > 0 and self._served % self.backoff_every == 0:
+            headers['Backoff'] = str(self.backoff)
+            self.counts['backoff'] += 1
+        return headers
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.counts[request.match_info.route.name or 'unknown'] += 1
+        if self._bucket is not None and not self._bucket.take():
+            self.counts['status_429'] += 1
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    @staticmethod
+    def _tags_match(item: dict, tags: List[str]) -> bool:
+        item_tags = set(t['tag'] for t in item['data'].get('tags', []))
+        for tag in tags:
+            if not any(t.strip() in item_tags for t in tag.split('||')):
+                return False
+        return True
+
+    async def items_handler(self, request: web.Request) -> web.Response:
+        since = request.headers.get('If-Modified-Since-Version', None)
+        if since is not None and int(since) >= self.version:
+            return web.Response(status=304, headers=self._headers())
+        start = int(request.query.get('start', 0))
+        limit = min(int(request.query.get('limit', 25)), self.max_page_size)
+        items = self.items
+        if 'since' in request.query:
+            items = [i for i in items if i['version'] > int(request.query['since'])]
+        tags = request.query.getall('tag', [])
+        if len(tags) > 0:
+            items = [i for i in items if self._tags_match(i, tags)]
+        headers = self._headers()
+        headers['Total-Results'] = str(len(items))
+        return web.Response(
+            body=json.dumps(items[start:start + limit]),
+            content_type='application/json',
+            headers=headers,
+        )
+
+    async def item_handler(self, request: web.Request) -> web.Response:
+        item = self._by_key.get(request.match_info['key'], None)
+        if item is None:
+            raise web.HTTPNotFound()
+        return web.json_response(item, headers=self._headers())
+
+    async def file_handler(self, request: web.Request) -> web.Response:
+        item = self._by_key.get(request.match_info['key'], None)
+        if item is None or item['data']['itemType'] != 'attachment':
+            raise web.HTTPNotFound()
+        return web.Response(
+            body=self._file,
+            content_type=item['data']['contentType'],
+            headers=self._headers(),
+        )
+
+    async def deleted_handler(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'collections': [], 'searches': [], 'items': self.deleted, 'tags': [], 'settings': [],
+        }, headers=self._headers())
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        prefix = '/{kind:(groups|users)}/{library}'
+        app.router.add_get(f'{prefix}/items', self.items_handler, name='items')
+        app.router.add_get(f'{prefix}/items/{{key}}', self.item_handler, name='item')
+        app.router.add_get(f'{prefix}/items/{{key}}/file', self.file_handler, name='file')
+        app.router.add_get(f'{prefix}/deleted', self.deleted_handler, name='deleted')
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://{host}:{port}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @property
+    def upstream_requests(self) -> Dict[str, int]:
+        return dict(self.counts)
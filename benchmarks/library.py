@@ -0,0 +1,136 @@
+import hashlib
+import random
+
+from typing import List
+
+
+ITEM_TYPES = [
+    ('journalArticle', 50),
+    ('conferencePaper', 25),
+    ('book', 8),
+    ('bookSection', 8),
+    ('report', 5),
+    ('thesis', 4),
+]
+CONTENT_TYPES = [
+    ('application/pdf', 8),
+    ('text/html', 2),
+]
+
+
+def _timestamp(rnd: random.Random) -> str:
+    return f'20{rnd.randint(10, 23)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T' \
+           f'{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}Z'
+
+
+def _links(library: str, key: str) -> dict:
+    return {
+        'self': {'href': f'https://api.zotero.org/{library}/items/{key}', 'type': 'application/json'},
+        'alternate': {'href': f'https://www.zotero.org/{library}/items/{key}', 'type': 'text/html'},
+    }
+
+
+def _envelope(library: str, key: str, version: int, data: dict) -> dict:
+    # the same shape as items returned by Zotero Web API
+    kind, library_id = library.split('/')
+    return {
+        'key': key,
+        'version': version,
+        'library': {
+            'type': kind.rstrip('s'),
+            'id': int(library_id),
+            'name': 'Benchmark Library',
+            'links': {'alternate': {'href': f'https://www.zotero.org/{library}', 'type': 'text/html'}},
+        },
+        'links': _links(library, key),
+        'meta': {
+            'createdByUser': {'id': 1, 'username': 'benchmark', 'name': '', 'links': {}},
+            'numChildren': 0,
+        },
+        'data': data,
+    }
+
+
+def generate(size: int, attachments: float = 0.3, seed: int = 0,
+             library: str = 'groups/1', version: int = 1) -> List[dict]:
+    rnd = random.Random(seed)
+    names = [(f'Firstname{i}', f'Lastname{i}') for i in range(max(size // 5, 10))]
+    tags = [f'topic-{i}' for i in range(max(size // 100, 20))]
+    venues = [f'Journal of Synthetic Research {i}' for i in range(max(size // 50, 10))]
+    publishers = [f'Publisher {i}' for i in range(20)]
+    types = [t for t, _ in ITEM_TYPES]
+    type_weights = [w for _, w in ITEM_TYPES]
+    content_types = [t for t, _ in CONTENT_TYPES]
+    content_weights = [w for _, w in CONTENT_TYPES]
+    items = []
+    for i in range(size):
+        key = f'B{i:07d}'
+        item_type = rnd.choices(types, type_weights)[0]
+        data = {
+            'key': key,
+            'version': version,
+            'itemType': item_type,
+            'title': f'Synthetic {item_type} number {i} about {rnd.choice(tags)} and {rnd.choice(tags)}',
+            'creators': [
+                {'creatorType': 'author', 'firstName': first, 'lastName': last}
+                for first, last in rnd.sample(names, rnd.randint(1, 5))
+            ],
+            'abstractNote': 'Lorem ipsum dolor sit amet. ' * rnd.randint(0, 10),
+            'date': f'{rnd.randint(1990, 2023)}-{rnd.randint(1, 12):02d}',
+            'language': 'en',
+            'DOI': f'10.5555/bench.{i}' if rnd.random() < 0.7 else '',
+            'url': f'https://example.org/papers/{i}' if rnd.random() < 0.5 else '',
+            'accessDate': '',
+            'libraryCatalog': 'Synthetic',
+            'extra': '',
+            'tags': [{'tag': tag} for tag in rnd.sample(tags, rnd.randint(0, 4))],
+            'collections': [],
+            'relations': {},
+            'dateAdded': _timestamp(rnd),
+            'dateModified': _timestamp(rnd),
+        }
+        if item_type == 'journalArticle':
+            data.update({
+                'publicationTitle': rnd.choice(venues),
+                'volume': str(rnd.randint(1, 60)),
+                'issue': str(rnd.randint(1, 12)),
+                'pages': f'{rnd.randint(1, 500)}-{rnd.randint(501, 999)}',
+                'ISSN': f'{rnd.randint(1000, 9999)}-{rnd.randint(1000, 9999)}',
+            })
+        elif item_type in ('conferencePaper', 'bookSection'):
+            data.update({
+                'proceedingsTitle' if item_type == 'conferencePaper' else 'publicationTitle':
+                    f'Proceedings of {rnd.choice(venues)}',
+                'publisher': rnd.choice(publishers),
+                'pages': f'{rnd.randint(1, 500)}-{rnd.randint(501, 999)}',
+            })
+        else:
+            data.update({
+                'publisher': rnd.choice(publishers),
+                'ISBN': f'978-{rnd.randint(0, 9)}-{rnd.randint(10000, 99999)}-{rnd.randint(100, 999)}-0',
+            })
+        items.append(_envelope(library, key, version, data))
+        if rnd.random() < attachments:
+            file_key = f'F{i:07d}'
+            content_type = rnd.choices(content_types, content_weights)[0]
+            items.append(_envelope(library, file_key, version, {
+                'key': file_key,
+                'version': version,
+                'itemType': 'attachment',
+                'parentItem': key,
+                'linkMode': 'imported_file',
+                'title': 'Full Text',
+                'contentType': content_type,
+                'filename': f'{key}.{"pdf" if content_type == "application/pdf" else "html"}',
+                'md5': hashlib.md5(file_key.encode('utf-8')).hexdigest(),
+                'mtime': 1600000000000 + i,
+                'tags': [],
+                'relations': {},
+                'dateAdded': data['dateAdded'],
+                'dateModified': data['dateModified'],
+            }))
+    return items
+
+
+def attachment_keys(items: List[dict]) -> List[str]:
+    return [item['key'] for item in items if item['data']['itemType'] == 'attachment']
@@ -0,0 +1,30 @@
+import json
+import os
+import resource
+import sys
+
+from aiohttp import web
+
+from zoteroxy.app import init_func
+from zoteroxy.consts import ENV_CONFIG
+
+
+def peak_rss() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+async def _report(app: web.Application):
+    print(json.dumps({'peak_rss': peak_rss()}), flush=True)
+
+
+def main(config: str, port: int):
+    os.environ[ENV_CONFIG] = config
+    app = init_func([])
+    app.on_cleanup.append(_report)
+    web.run_app(app, host='127.0.0.1', port=port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import pathlib
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+import aiohttp
+
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.fake_zotero import FakeZotero
+from benchmarks.library import attachment_keys, generate
+from zoteroxy.consts import VERSION
+
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+ENDPOINTS = {
+    'collection': ('/collection', 'application/json'),
+    'collection.json': ('/collection.json', 'application/json'),
+    'collection.bib': ('/collection.bib', 'application/x-bibtex'),
+    'file': ('/file/{key}', '*/*'),
+}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = dict()
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS.keys():
+            raise argparse.ArgumentTypeError(f'Unknown endpoint: {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def latency_stats(values: List[float]) -> dict:
+    return {
+        'count': len(values),
+        'mean_ms': round(1000 * sum(values) / len(values), 3) if len(values) > 0 else None,
+        'p50_ms': round(1000 * percentile(values, 50), 3) if len(values) > 0 else None,
+        'p99_ms': round(1000 * percentile(values, 99), 3) if len(values) > 0 else None,
+        'max_ms': round(1000 * max(values), 3) if len(values) > 0 else None,
+    }
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_config(directory: pathlib.Path, upstream_url: str, args: argparse.Namespace) -> pathlib.Path:
+    config = {
+        'zotero': {
+            'api_key': 'benchmark',
+            'api_url': upstream_url,
+            'page_size': args.page_size,
+        },
+        'library': {
+            'type': 'group',
+            'id': '1',
+            'name': 'Benchmark Library',
+        },
+        'settings': {
+            'base_url': 'http://localhost',
+            'cache': {
+                'state_file': str(directory / 'library.json.gz'),
+                'backend_path': str(directory / 'cache.sqlite'),
+                'file': {
+                    'directory': str(directory / 'files'),
+                },
+            },
+        },
+    }
+    path = directory / 'config.yml'
+    with open(path, 'w') as f:
+        yaml.dump(config, f)
+    return path
+
+
+class Proxy:
+
+    def __init__(self, config: pathlib.Path, log: pathlib.Path):
+        self.config = config
+        self.log = log
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self._process = None  # type: Optional[subprocess.Popen]
+        self._log_file = None
+
+    async def start(self, session: aiohttp.ClientSession, timeout: float = 30):
+        self._log_file = open(self.log, 'w')
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.proxy', str(self.config), str(self.port)],
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=self._log_file, text=True,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f'Proxy exited with {self._process.returncode}, see {self.log}')
+            try:
+                async with session.get(f'{self.url}/', headers={'Accept': 'application/json'}) as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError(f'Proxy did not start in {timeout} seconds')
+
+    def stop(self) -> Optional[int]:
+        if self._process is None:
+            return None
+        self._process.send_signal(signal.SIGTERM)
+        try:
+            output, _ = self._process.communicate(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            output, _ = self._process.communicate()
+        self._log_file.close()
+        for line in reversed(output.splitlines()):
+            try:
+                return json.loads(line)['peak_rss']
+            except (ValueError, KeyError):
+                continue
+        return None
+
+
+async def request(session: aiohttp.ClientSession, url: str, accept: str) -> Tuple[int, int, float]:
+    start = time.perf_counter()
+    async with session.get(url, headers={'Accept': accept, 'Accept-Encoding': 'gzip, br'}) as r:
+        size = 0
+        async for chunk in r.content.iter_any():
+            size += len(chunk)
+        return r.status, size, time.perf_counter() - start
+
+
+async def load(session: aiohttp.ClientSession, base_url: str, mix: Dict[str, float],
+               files: List[str], requests: int, concurrency: int, seed: int) -> dict:
+    rnd = random.Random(seed)
+    names = [n for n in mix.keys() if n != 'file' or len(files) > 0]
+    plan = rnd.choices(names, [mix[n] for n in names], k=requests)
+    latencies = collections.defaultdict(list)  # type: Dict[str, List[float]]
+    statuses = collections.Counter()
+    transferred = 0
+    position = 0
+
+    async def worker():
+        nonlocal position, transferred
+        while position < len(plan):
+            name = plan[position]
+            position += 1
+            path, accept = ENDPOINTS[name]
+            if name == 'file':
+                path = path.format(key=rnd.choice(files))
+            status, size, elapsed = await request(session, f'{base_url}{path}', accept)
+            latencies[name].append(elapsed)
+            statuses[str(status)] += 1
+            transferred += size
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    every = [x for values in latencies.values() for x in values]
+    return {
+        'requests': requests,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2),
+        'transferred_bytes': transferred,
+        'statuses': dict(statuses),
+        'latency': latency_stats(every),
+        'endpoints': {name: latency_stats(values) for name, values in sorted(latencies.items())},
+    }
+
+
+async def scenario(size: int, args: argparse.Namespace) -> dict:
+    items = generate(size, attachments=args.attachments, seed=args.seed)
+    files = attachment_keys(items)
+    fake = FakeZotero(
+        items, latency=args.latency, max_page_size=args.max_page_size, rate_limit=args.rate_limit,
+        backoff_every=args.backoff_every, backoff=args.backoff, file_size=args.file_size,
+    )
+    await fake.start()
+    result = {
+        'items': size,
+        'attachments': len(files),
+    }
+    with tempfile.TemporaryDirectory(prefix='zoteroxy-benchmark-') as tmp:
+        directory = pathlib.Path(tmp)
+        proxy = Proxy(write_config(directory, fake.url, args), directory / 'proxy.log')
+        timeout = aiohttp.ClientTimeout(total=args.timeout)
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector,
+                                         auto_decompress=False) as session:
+            try:
+                await proxy.start(session)
+                status, size_cold, elapsed = await request(session, f'{proxy.url}/collection',
+                                                           'application/json')
+                result['cold'] = {
+                    'status': status,
+                    'bytes': size_cold,
+                    'latency_ms': round(1000 * elapsed, 3),
+                    'upstream_requests': fake.upstream_requests,
+                }
+                result.update(await load(session, proxy.url, args.mix, files, args.requests,
+                                         args.concurrency, args.seed))
+            finally:
+                result['peak_rss_bytes'] = proxy.stop()
+                result['upstream_requests'] = fake.upstream_requests
+                await fake.stop()
+    return result
+
+
+def summary(results: List[dict]) -> str:
+    lines = [f'{"items":>8} {"cold ms":>10} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} '
+             f'{"RSS MB":>8} {"upstream":>9} {"errors":>7}']
+    for r in results:
+        errors = sum(v for k, v in r.get('statuses', {}).items() if not k.startswith(('2', '3')))
+        rss = r['peak_rss_bytes'] / 2 ** 20 if r.get('peak_rss_bytes') else float('nan')
+        upstream = sum(v for k, v in r['upstream_requests'].items() if k not in ('backoff', 'status_429'))
+        lines.append(
+            f'{r["items"]:>8} {r["cold"]["latency_ms"]:>10.1f} {r["throughput_rps"]:>9.1f} '
+            f'{r["latency"]["p50_ms"]:>9.2f} {r["latency"]["p99_ms"]:>9.2f} {rss:>8.1f} '
+            f'{upstream:>9} {errors:>7}'
+        )
+    return '\n'.join(lines)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    results = []
+    for size in args.items:
+        print(f'Running {size} items...', file=sys.stderr)
+        results.append(await scenario(size, args))
+    return {
+        'zoteroxy': VERSION,
+        'commit': git_commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            k: v for k, v in vars(args).items() if k != 'output'
+        },
+        'results': results,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Benchmark Zoteroxy against a fake Zotero API')
+    parser.add_argument('-n', '--items', type=lambda v: [int(x) for x in v.split(',')],
+                        default=[100, 1000, 10000], help='library sizes (comma-separated)')
+    parser.add_argument('-r', '--requests', type=int, default=500)
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-m', '--mix', type=parse_mix,
+                        default=parse_mix('collection=4,collection.json=2,collection.bib=1,file=3'),
+                        help='weights of endpoints, e.g. collection=4,file=1')
+    parser.add_argument('--attachments', type=float, default=0.3,
+                        help='share of items with an attachment')
+    parser.add_argument('--file-size', type=int, default=256 * 1024)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds added to each Zotero API response')
+    parser.add_argument('--page-size', type=int, default=100, help='page size requested by the proxy')
+    parser.add_argument('--max-page-size', type=int, default=100, help='page size limit of the API')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='Zotero API requests per second before responding 429 (0 = unlimited)')
+    parser.add_argument('--backoff-every', type=int, default=0,
+                        help='send Backoff header with every n-th response (0 = never)')
+    parser.add_argument('--backoff', type=float, default=1.0, help='seconds in Backoff header')
+    parser.add_argument('--timeout', type=float, default=300, help='timeout of a request in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None, help='file to store JSON results')
+    args = parser.parse_args(argv)
+    report = asyncio.run(run(args))
+    print(summary(report['results']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
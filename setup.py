@@ -26,9 +26,17 @@ setup(
         'aiohttp-jinja2',
         'aiohttp-swagger',
         'pyhumps',
-        'Pyzotero',
         'PyYAML',
     ],
+    extras_require={
+        'brotli': ['Brotli'],
+        'orjson': ['orjson'],
+    },
+    entry_points={
+        'console_scripts': [
+            'zoteroxy = zoteroxy.server:main',
+        ],
+    },
     classifiers=[
         'Framework :: AsyncIO',
         'License :: OSI Approved :: MIT License',
@@ -0,0 +1,154 @@
+import asyncio
+import copy
+import os
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.fake_zotero import FakeZotero
+from benchmarks.library import generate
+from zoteroxy.app import init_func
+from zoteroxy.consts import ENV_CONFIG
+
+
+CONFIG = """
+zotero:
+  api_key: secret
+  api_url: {url}
+  rate_limit: 0
+library:
+  id: '1'
+  name: Test Library
+settings:
+  base_url: http://localhost
+  cache:
+    state_file:
+    file:
+      directory: {directory}
+"""
+
+
+def run(test, tmp_path, monkeypatch, items=None):
+    async def wrapped():
+        fake = FakeZotero(items or generate(250, attachments=0.2), version=5)
+        await fake.start()
+        config = tmp_path / 'config.yml'
+        config.write_text(CONFIG.format(url=fake.url, directory=tmp_path / 'cache'))
+        monkeypatch.setenv(ENV_CONFIG, str(config))
+        app = init_func([])
+        try:
+            async with TestClient(TestServer(app)) as client:
+                await test(fake, app['api'].zotero, client)
+        finally:
+            await fake.stop()
+    asyncio.run(wrapped())
+
+
+def test_purge_during_sync_is_not_undone(tmp_path, monkeypatch):
+    async def test(fake, zotero, client):
+        fake.latency = 0.2
+        request = asyncio.ensure_future(client.get('/collection?limit=0', headers={'Accept': 'application/json'}))
+        await asyncio.sleep(0.05)
+        purged = zotero._sync
+        r = await client.post('/purge')
+        assert r.status == 204
+        while purged.version is None:
+            await asyncio.sleep(0.01)
+        # changed after the purged sync finished
+        fake.items = generate(50, attachments=0.2, version=6)
+        fake.version = 6
+        r = await request
+        assert r.status == 200
+        assert len(zotero._sync.items) == len(fake.items)
+        assert zotero.version == 6
+
+    run(test, tmp_path, monkeypatch)
+
+
+def test_settings_include_cache_stats(tmp_path, monkeypatch):
+    async def test(fake, zotero, client):
+        r = await client.get('/collection?limit=0', headers={'Accept': 'application/json'})
+        assert r.status == 200
+        r = await client.get('/settings', headers={'Accept': 'application/json'})
+        assert r.status == 200
+        settings = await r.json()
+        assert settings['tags'] == []
+        assert settings['cache']['max_stale'] == 86400
+        stats = settings['cache']['stats']
+        assert stats['metadata']['misses'] == 1
+        assert set(stats['file'].keys()) >= {'hits', 'misses', 'size', 'max_size'}
+
+    run(test, tmp_path, monkeypatch)
+
+
+def test_collection_query(tmp_path, monkeypatch):
+    async def test(fake, zotero, client):
+        json_headers = {'Accept': 'application/json'}
+        r = await client.get('/collection', headers=json_headers)
+        everything = await r.json()
+        r = await client.get('/collection?limit=5&offset=10', headers=json_headers)
+        assert r.status == 200
+        page = await r.json()
+        assert page['total_items'] == everything['total_items']
+        assert (page['offset'], page['limit']) == (10, 5)
+        assert [i['key'] for i in page['items']] == [i['key'] for i in everything['items'][10:15]]
+
+        books = [i for i in everything['items'] if i['type'] == 'book']
+        r = await client.get('/collection?type=book&limit=0', headers=json_headers)
+        assert (await r.json())['total_items'] == len(books)
+
+        for query in ['limit=-1', 'offset=x', 'updated_since=yesterday']:
+            r = await client.get(f'/collection?{query}', headers=json_headers)
+            assert r.status == 400
+        r = await client.get('/collection.bib?fields=key')
+        assert r.status == 400
+
+    run(test, tmp_path, monkeypatch)
+
+
+def test_search_with_filters(tmp_path, monkeypatch):
+    async def test(fake, zotero, client):
+        json_headers = {'Accept': 'application/json'}
+        r = await client.get('/collection', headers=json_headers)
+        everything = (await r.json())['items']
+        tag = everything[0]['tags'][0]
+        tagged = {i['key'] for i in everything if tag in i['tags']}
+        r = await client.get(f'/collection?q=synthetic&tag={tag}', headers=json_headers)
+        assert r.status == 200
+        assert {i['key'] for i in (await r.json())['items']} == tagged
+        r = await client.get(f'/collection?q=nonexistentword&tag={tag}', headers=json_headers)
+        assert (await r.json())['total_items'] == 0
+
+    run(test, tmp_path, monkeypatch)
+
+
+def test_metrics_are_labelled_by_worker(tmp_path, monkeypatch):
+    async def test(fake, zotero, client):
+        r = await client.get('/collection?limit=0', headers={'Accept': 'application/json'})
+        assert r.status == 200
+        r = await client.get('/metrics')
+        assert r.status == 200
+        worker = f'worker="{os.getpid()}"'
+        samples = [line for line in (await r.text()).splitlines() if not line.startswith('#')]
+        assert len(samples) > 0
+        assert all(worker in line for line in samples)
+        assert any(line.startswith('zoteroxy_upstream_request_duration_seconds_count{') for line in samples)
+
+    run(test, tmp_path, monkeypatch)
+
+
+def test_attachment_without_file_is_not_found(tmp_path, monkeypatch):
+    async def test(fake, zotero, client):
+        attachment = next(i for i in fake.items if i['data']['itemType'] == 'attachment')
+        r = await client.get(f'/file/{attachment["key"]}')
+        assert r.status == 200
+        link = copy.deepcopy(attachment)
+        link['key'] = link['data']['key'] = 'LINK0001'
+        link['data']['linkMode'] = 'linked_url'
+        link['data'].pop('md5', None)
+        fake._by_key[link['key']] = link
+        requests = fake.upstream_requests.get('file', 0)
+        r = await client.get('/file/LINK0001')
+        assert r.status == 404
+        assert fake.upstream_requests.get('file', 0) == requests
+
+    run(test, tmp_path, monkeypatch)
@@ -0,0 +1,12 @@
+from zoteroxy.bibliography import _link
+
+
+def test_web_urls_are_linked():
+    assert _link(' https://example.org/?a=1&b=2 ') == \
+        '<a href="https://example.org/?a=1&amp;b=2">https://example.org/?a=1&amp;b=2</a>'
+    assert _link('HTTP://example.org') == '<a href="HTTP://example.org">HTTP://example.org</a>'
+
+
+def test_other_urls_are_not_linked():
+    assert _link('javascript:alert("x")') == 'javascript:alert(&quot;x&quot;)'
+    assert _link('data:text/html,<b>x</b>') == 'data:text/html,&lt;b&gt;x&lt;/b&gt;'
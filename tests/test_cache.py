@@ -0,0 +1,252 @@
+import asyncio
+import datetime
+import json
+
+from zoteroxy.cache import Cache, FileCache, SQLiteBackend
+
+
+def expire(cache: Cache, key: str):
+    cache._values[key].cached_at -= datetime.timedelta(seconds=cache.duration + 1)
+
+
+def test_failed_refresh_backs_off():
+    async def test():
+        cache = Cache(duration=10, max_stale=1000, background_refresh=True)
+        calls = []
+
+        async def failing(key):
+            calls.append(key)
+            raise RuntimeError('Zotero is down')
+
+        cache.set('items', 'old')
+        expire(cache, 'items')
+        assert await cache.get('items', failing) == 'old'
+        await asyncio.sleep(0)
+        assert calls == ['items']
+        for _ in range(5):
+            assert await cache.get('items', failing) == 'old'
+            await asyncio.sleep(0)
+        assert calls == ['items']
+
+        cache._failures['items'] = (1, 0.0)
+        assert await cache.get('items', failing) == 'old'
+        await asyncio.sleep(0)
+        assert calls == ['items', 'items']
+
+    asyncio.run(test())
+
+
+def test_failed_refresh_backs_off_without_background_refresh():
+    async def test():
+        cache = Cache(duration=10, max_stale=1000, background_refresh=False)
+        calls = []
+
+        async def failing(key):
+            calls.append(key)
+            raise RuntimeError('Zotero is down')
+
+        cache.set('items', 'old')
+        expire(cache, 'items')
+        assert await cache.get('items', failing) == 'old'
+        assert await cache.get('items', failing) == 'old'
+        assert calls == ['items']
+
+    asyncio.run(test())
+
+
+def test_failure_without_stale_value_is_not_kept():
+    async def test():
+        cache = Cache(duration=10, max_stale=1000)
+        calls = []
+
+        async def failing(key):
+            calls.append(key)
+            raise RuntimeError('Unknown item')
+
+        for key in ['a', 'b', 'a']:
+            try:
+                await cache.get(key, failing)
+            except RuntimeError:
+                pass
+        assert calls == ['a', 'b', 'a']
+        assert cache._failures == dict()
+
+    asyncio.run(test())
+
+
+def test_clear_detaches_running_loads():
+    async def test():
+        cache = Cache(duration=10)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow(key):
+            started.set()
+            await release.wait()
+            return 'value'
+
+        waiter = asyncio.ensure_future(cache.get('items', slow))
+        await started.wait()
+        cache.clear()
+        release.set()
+        assert await waiter == 'value'
+        assert not await cache.has('items')
+
+    asyncio.run(test())
+
+
+def test_file_index_is_saved_in_batches(tmp_path):
+    async def test():
+        cache = FileCache(duration=3600, directory=tmp_path)
+        index = tmp_path / FileCache.INDEX
+        written = index.stat().st_mtime_ns
+        for key in ['a', 'b', 'c']:
+            cache.set(key, key.encode('utf-8'))
+        assert index.stat().st_mtime_ns == written
+        await cache.close()
+        files = json.loads(index.read_text(encoding='utf-8'))['files']
+        assert list(files.keys()) == ['a', 'b', 'c']
+
+    asyncio.run(test())
+
+
+def test_clear_keeps_other_files(tmp_path):
+    async def test():
+        (tmp_path / 'README').write_text('not cached')
+        (tmp_path / 'other').mkdir()
+        cache = FileCache(duration=3600, directory=tmp_path)
+        cache.set('a', b'data')
+        cache.clear()
+        await cache.close()
+        assert not await cache.has('a')
+        assert not (tmp_path / FileCache.OBJECTS).exists()
+        assert (tmp_path / 'README').exists()
+        assert (tmp_path / 'other').is_dir()
+
+    asyncio.run(test())
+
+
+def test_clear_detaches_running_downloads(tmp_path):
+    async def test():
+        cache = FileCache(duration=3600, directory=tmp_path)
+        release = asyncio.Event()
+
+        async def slow(key, write):
+            write(b'first ')
+            await release.wait()
+            write(b'second')
+
+        download = cache.download('a', slow)
+        reader = asyncio.ensure_future(cache.get('a', slow))
+        await asyncio.sleep(0.01)
+        cache.clear()
+        release.set()
+        assert await reader == b'first second'
+        await download.task
+        assert not await cache.has('a')
+        assert list(tmp_path.glob('.*.part')) == []
+        await cache.close()
+
+    asyncio.run(test())
+
+
+def test_unchanged_value_is_not_written_again(tmp_path):
+    async def test():
+        backend = SQLiteBackend(tmp_path / 'cache.sqlite')
+        cache = Cache(duration=10, backend=backend)
+        state = {'version': 1}
+        cache.set('items', state)
+        await backend.run(lambda: None)
+        cached_at = (await backend.run(backend.get, Cache.PREFIX + 'items')).cached_at
+        state['version'] = 2
+        cache.set('items', state)
+        shared = await backend.run(backend.get, Cache.PREFIX + 'items')
+        assert shared.value == {'version': 1}
+        assert shared.cached_at > cached_at
+        backend.close()
+
+    asyncio.run(test())
+
+
+def test_evicted_file_used_by_other_process_is_kept(tmp_path):
+    async def test():
+        backends = [SQLiteBackend(tmp_path / 'cache.sqlite') for _ in range(2)]
+        evicting = FileCache(duration=3600, directory=tmp_path / 'files', max_entries=1, backend=backends[0])
+        other = FileCache(duration=3600, directory=tmp_path / 'files', backend=backends[1])
+        other.set('b', b'shared')
+        evicting.set('a', b'shared')
+        evicting.set('c', b'other')
+        for backend in backends:
+            await backend.run(lambda: None)
+        assert evicting.stats['evictions'] == 1
+        assert await other.path('b') is not None
+        assert await evicting.path('a') is None
+        for backend in backends:
+            backend.close()
+
+    asyncio.run(test())
+
+
+def test_prefetched_files_are_evicted_first(tmp_path):
+    async def test():
+        cache = FileCache(duration=3600, directory=tmp_path, max_size=40, prefetch_share=0.5)
+
+        def callback(data: bytes):
+            async def download(key, write):
+                write(data)
+            return download
+
+        cache.set('a', b'0' * 10)
+        assert cache.can_prefetch(10)
+        assert not cache.can_prefetch(30)
+        await cache.download('p', callback(b'1' * 10), prefetch=True).task
+        assert cache.stats['prefetched_size'] == 10
+        assert not cache.can_prefetch(15)
+
+        cache.set('b', b'2' * 10)
+        cache.set('c', b'3' * 15)
+        assert not await cache.has('p')
+        assert await cache.has('a')
+        assert cache.stats['prefetched_size'] == 0
+        await cache.close()
+
+    asyncio.run(test())
+
+
+def test_has_does_not_expire_entries(tmp_path):
+    async def test():
+        cache = FileCache(duration=3600, directory=tmp_path)
+        cache.set('a', b'a')
+        cache._files['a'].cached_at -= datetime.timedelta(seconds=cache.duration + 1)
+        assert not await cache.has('a')
+        assert cache.stats['entries'] == 1
+        assert cache.stats['expirations'] == 0
+        await cache.close()
+
+    asyncio.run(test())
+
+
+def test_client_does_not_join_prefetch(tmp_path):
+    async def test():
+        cache = FileCache(duration=3600, directory=tmp_path)
+        started = asyncio.Event()
+
+        async def prefetch(key, write):
+            started.set()
+            await asyncio.sleep(10)
+
+        async def download(key, write):
+            write(b'data')
+
+        prefetched = cache.download('a', prefetch, prefetch=True)
+        await started.wait()
+        assert cache.download('a', download, prefetch=True) is prefetched
+        requested = cache.download('a', download)
+        assert requested is not prefetched
+        await requested.task
+        assert prefetched.task.cancelled()
+        assert requested.path.read_bytes() == b'data'
+        assert cache.stats['prefetched_size'] == 0
+        await cache.close()
+
+    asyncio.run(test())
@@ -0,0 +1,138 @@
+import asyncio
+import io
+import time
+
+from benchmarks.fake_zotero import FakeZotero
+from benchmarks.library import generate
+from zoteroxy.client import ZoteroClient
+from zoteroxy.config import ZoteroxyConfigParser
+from zoteroxy.metrics import UPSTREAM_DURATION
+from zoteroxy.sync import LibrarySync
+
+
+CONFIG = """
+zotero:
+  api_key: secret
+  api_url: {url}
+  page_size: 100
+  rate_limit: 0
+library:
+  id: '1'
+  name: Test Library
+settings:
+  base_url: http://localhost
+"""
+
+
+def run(test):
+    async def wrapped():
+        fake = FakeZotero(generate(250, attachments=0.2), version=5, max_page_size=100)
+        await fake.start()
+        config = ZoteroxyConfigParser().parse_file(io.StringIO(CONFIG.format(url=fake.url)))
+        client = ZoteroClient(config)
+        try:
+            await test(fake, client)
+        finally:
+            await client.close()
+            await fake.stop()
+    asyncio.run(wrapped())
+
+
+def test_items_are_paginated():
+    async def test(fake, client):
+        items, version = await client.items()
+        assert version == 5
+        assert [i['key'] for i in items] == [i['key'] for i in fake.items]
+        pages = (len(fake.items) + 99) // 100
+        assert fake.upstream_requests['items'] == pages
+
+    run(test)
+
+
+def test_page_size_follows_server_limit():
+    async def test(fake, client):
+        fake.max_page_size = 30
+        items, _ = await client.items()
+        assert len(items) == len(fake.items)
+        assert len(set(i['key'] for i in items)) == len(fake.items)
+
+    run(test)
+
+
+def test_unchanged_library_is_not_modified():
+    async def test(fake, client):
+        items, version = await client.items(since=5)
+        assert items is None
+        assert version == 5
+        assert fake.upstream_requests['items'] == 1
+
+    run(test)
+
+
+def test_sync_is_incremental():
+    async def test(fake, client):
+        sync = LibrarySync(client, tags=[], tags_allowed=lambda tags: True)
+        await sync.sync()
+        assert sync.version == 5
+        assert len(sync.items) == len(fake.items)
+        modified_at = sync.modified_at
+
+        changed = dict(fake.items[0], version=6)
+        changed['data'] = dict(changed['data'], title='Changed title')
+        removed = fake.items[1]['key']
+        fake.items = [changed] + fake.items[2:]
+        fake.deleted = [removed]
+        fake.version = 6
+        parent = next(i for i in fake.items if i['data']['itemType'] == 'attachment')['data']['parentItem']
+        requests = fake.upstream_requests['items']
+
+        await sync.sync()
+        assert sync.version == 6
+        assert fake.upstream_requests['items'] == requests + 1
+        assert sync.items[changed['key']]['data']['title'] == 'Changed title'
+        assert removed not in sync.items
+        assert len(sync.items[parent]['children']) > 0
+        assert sync.modified_at > modified_at
+        modified_at = sync.modified_at
+
+        await sync.sync()
+        assert fake.upstream_requests['items'] == requests + 2
+        assert sync.version == 6
+        assert sync.modified_at == modified_at
+
+    run(test)
+
+
+def test_burst_of_throttles_decreases_limit_once():
+    async def test(fake, client):
+        governor = client.governor
+        limit = governor.limit
+        admitted = [await governor.acquire() for _ in range(4)]
+        for number in admitted:
+            governor.feedback(429, {'Retry-After': '0'}, number)
+            governor.release()
+        assert governor.limit == max(governor.min_concurrency, limit / 2)
+        assert governor.throttles == 4
+
+        number = await governor.acquire()
+        governor.feedback(429, {'Retry-After': '0'}, number)
+        governor.release()
+        assert governor.limit == max(governor.min_concurrency, limit / 4)
+
+    run(test)
+
+
+def test_file_duration_is_observed_at_headers():
+    async def test(fake, client):
+        key = next(i['key'] for i in fake.items if i['data']['itemType'] == 'attachment')
+        observed = UPSTREAM_DURATION._values.get(('file',), [None, 0.0])[1]
+
+        def slow(chunk):
+            time.sleep(0.2)
+
+        start = time.perf_counter()
+        await client.file(key, slow)
+        assert time.perf_counter() - start >= 0.2
+        assert UPSTREAM_DURATION._values[('file',)][1] - observed < 0.1
+
+    run(test)
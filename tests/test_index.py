@@ -0,0 +1,123 @@
+import datetime
+
+import pytest
+from multidict import MultiDict
+from typing import Optional
+
+from zoteroxy.index import CollectionIndex, CollectionQuery, SearchIndex
+from zoteroxy.model import LibraryItem
+
+
+def item(key: str, item_type: str = 'journalArticle', date: str = '2020', tags=(), authors=(),
+         modified: str = '2020-01-01T00:00:00Z', title: str = 'Title', doi: Optional[str] = None) -> LibraryItem:
+    return LibraryItem({'data': {
+        'key': key,
+        'DOI': doi,
+        'itemType': item_type,
+        'title': title,
+        'date': date,
+        'dateModified': modified,
+        'tags': [{'tag': tag} for tag in tags],
+        'creators': [{'creatorType': 'author', 'firstName': first, 'lastName': last}
+                     for first, last in authors],
+    }, 'children': []})
+
+
+ITEMS = [
+    item('A', date='2019', tags=['ml', 'nlp'], authors=[('Jan', 'Novak')]),
+    item('B', item_type='book', date='2020', tags=['ml'], authors=[('Eva', 'Svobodova')],
+         modified='2020-03-01T00:00:00Z'),
+    item('C', date='2020-05', tags=['db'], authors=[('Jan', 'Novak'), ('Petr', 'Dvorak')],
+         modified='2020-06-01T00:00:00Z'),
+    item('D', item_type='book', date='2021'),
+]
+
+
+def select(**params) -> list:
+    query = CollectionQuery.from_params(MultiDict(params))
+    return [ITEMS[p].key for p in query.page(CollectionIndex(ITEMS).select(query))]
+
+
+def test_filters_are_combined():
+    assert select() == ['A', 'B', 'C', 'D']
+    assert select(type='book') == ['B', 'D']
+    assert select(year='2020') == ['B', 'C']
+    assert select(tag='ML') == ['A', 'B']
+    assert select(tag='ml,db') == ['A', 'B', 'C']
+    assert select(tag='ml', type='book') == ['B']
+    assert select(author='novak') == ['A', 'C']
+    assert select(author='Jan Novak', year='2020') == ['C']
+    assert select(type='thesis') == []
+
+
+def test_updated_since():
+    assert select(updated_since='2020-02-01T00:00:00Z') == ['B', 'C']
+    assert select(updated_since='2020-03-01') == ['C']
+    assert select(updated_since='2021-01-01T00:00:00+01:00') == []
+
+
+def test_pagination():
+    assert select(limit='2') == ['A', 'B']
+    assert select(limit='2', offset='3') == ['D']
+    assert select(offset='10') == []
+    assert select(limit='0') == []
+    assert select(type='book', limit='1', offset='1') == ['D']
+
+
+def test_canonical_query_ignores_order():
+    first = CollectionQuery.from_params(MultiDict([('tag', 'b,a'), ('year', '2020')]))
+    second = CollectionQuery.from_params(MultiDict([('year', '2020'), ('tag', 'a'), ('tag', 'b')]))
+    assert first.canonical == second.canonical
+    assert CollectionQuery.from_params(MultiDict()).is_empty
+
+
+@pytest.mark.parametrize('params', [
+    {'limit': '-1'}, {'limit': 'all'}, {'offset': '-5'}, {'updated_since': 'yesterday'},
+])
+def test_invalid_parameters(params):
+    with pytest.raises(ValueError):
+        CollectionQuery.from_params(MultiDict(params))
+
+
+def test_updated_since_without_timezone_is_utc():
+    query = CollectionQuery.from_params(MultiDict({'updated_since': '2020-03-01T12:00:00'}))
+    assert query.updated_since == datetime.datetime(2020, 3, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def keys(index: SearchIndex, text: str) -> list:
+    return [key for key, _ in index.search(text)]
+
+
+def test_search_ranks_fields():
+    index = SearchIndex()
+    index.update([
+        item('A', title='Neural networks for parsing', authors=[('Jan', 'Novák')]),
+        item('B', title='Parsing with grammars', tags=['neural'], doi='10.1000/xyz'),
+        item('C', title='Databases'),
+    ])
+    assert keys(index, 'parsing') == ['A', 'B']
+    assert keys(index, 'neural') == ['A', 'B']
+    assert keys(index, 'neural parsing') == ['A', 'B']
+    assert keys(index, 'novak') == ['A']
+    assert keys(index, 'data') == ['C']
+    assert keys(index, '10.1000/XYZ') == ['B']
+    assert keys(index, 'neural databases') == []
+    assert keys(index, '') == []
+
+
+def test_search_index_is_updated_incrementally():
+    index = SearchIndex()
+    a, b = item('A', title='Graph theory'), item('B', title='Graph databases')
+    assert index.update([a, b]) == 2
+    assert index.update([a, item('B', title='Graph databases')]) == 0
+
+    assert index.update([a, item('B', title='Relational algebra'), item('C', title='Graph coloring')]) == 2
+    assert keys(index, 'graph') == ['A', 'C']
+    assert keys(index, 'databases') == []
+    assert keys(index, 'datab') == []
+    assert keys(index, 'relational') == ['B']
+
+    assert index.update([item('C', title='Graph coloring')]) == 2
+    assert len(index) == 1
+    assert keys(index, 'graph') == ['C']
+    assert keys(index, 'rel') == []
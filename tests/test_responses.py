@@ -0,0 +1,115 @@
+import asyncio
+import pathlib
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from zoteroxy.responses import AttachmentResponse, iterate, stream_response
+
+
+DATA = bytes(range(100))
+
+
+def run(test, tmp_path: pathlib.Path):
+    path = tmp_path / 'file.pdf'
+    path.write_bytes(DATA)
+
+    async def handler(request):
+        return AttachmentResponse(path=path, etag='md5', last_modified=None, content_type='application/pdf')
+
+    async def prepared(request):
+        response = AttachmentResponse(path=path, etag='md5', last_modified=None, content_type='application/pdf')
+        await response.prepare(request)
+        return response
+
+    async def wrapped():
+        app = web.Application()
+        app.router.add_get('/file', handler)
+        app.router.add_get('/prepared', prepared)
+        async with TestClient(TestServer(app)) as client:
+            await test(client)
+    asyncio.run(wrapped())
+
+
+def test_single_range(tmp_path):
+    async def test(client):
+        r = await client.get('/file', headers={'Range': 'bytes=10-19'})
+        assert r.status == 206
+        assert r.headers['Content-Range'] == 'bytes 10-19/100'
+        assert await r.read() == DATA[10:20]
+
+        r = await client.get('/file', headers={'Range': 'bytes=-5'})
+        assert r.status == 206
+        assert await r.read() == DATA[-5:]
+
+    run(test, tmp_path)
+
+
+def test_unsupported_range_is_ignored(tmp_path):
+    async def test(client):
+        for value in ['bytes=0-9,20-29', 'items=0-9', 'bytes=50-10']:
+            r = await client.get('/file', headers={'Range': value})
+            assert r.status == 200
+            assert await r.read() == DATA
+
+    run(test, tmp_path)
+
+
+def test_unsatisfiable_range(tmp_path):
+    async def test(client):
+        r = await client.get('/file', headers={'Range': 'bytes=100-'})
+        assert r.status == 416
+        assert r.headers['Content-Range'] == 'bytes */100'
+
+    run(test, tmp_path)
+
+
+def test_range_of_changed_file_is_ignored(tmp_path):
+    async def test(client):
+        r = await client.get('/file', headers={'Range': 'bytes=10-19', 'If-Range': '"other"'})
+        assert r.status == 200
+        assert await r.read() == DATA
+
+    run(test, tmp_path)
+
+
+def test_prepared_response_is_sent_once(tmp_path):
+    async def test(client):
+        for _ in range(2):
+            r = await client.get('/prepared')
+            assert r.status == 200
+            assert await r.read() == DATA
+
+    run(test, tmp_path)
+
+
+def test_stream_is_generated_off_the_loop():
+    def slow_chunks():
+        for _ in range(10):
+            time.sleep(0.05)
+            yield b'chunk'
+
+    async def stream(request):
+        return await stream_response(request, web.StreamResponse(), iterate(slow_chunks()))
+
+    async def ping(request):
+        return web.Response(text='pong')
+
+    async def test():
+        app = web.Application()
+        app.router.add_get('/stream', stream)
+        app.router.add_get('/ping', ping)
+        async with TestClient(TestServer(app)) as client:
+            async def read_stream():
+                r = await client.get('/stream')
+                return await r.read()
+
+            streaming = asyncio.ensure_future(read_stream())
+            await asyncio.sleep(0.1)
+            r = await client.get('/ping')
+            assert await r.text() == 'pong'
+            assert not streaming.done()
+            assert await streaming == b'chunk' * 10
+
+    asyncio.run(test())
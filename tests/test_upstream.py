@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from zoteroxy.config import UpstreamConfig, UpstreamOperationConfig
+from zoteroxy.upstream import Upstream, UpstreamTimeoutError
+
+
+def upstream(timeout: float) -> Upstream:
+    return Upstream(UpstreamConfig({Upstream.FILE: UpstreamOperationConfig(1, timeout)}))
+
+
+def test_transfer_times_out_only_when_idle():
+    async def steady(write):
+        for _ in range(10):
+            await asyncio.sleep(0.02)
+            write(b'x')
+        return 'done'
+
+    async def stalled(write):
+        write(b'x')
+        await asyncio.sleep(1)
+
+    async def test():
+        chunks = []
+        result = await upstream(0.1).transfer(Upstream.FILE, steady, chunks.append)
+        assert result == 'done'
+        assert len(chunks) == 10
+
+        chunks = []
+        with pytest.raises(UpstreamTimeoutError):
+            await upstream(0.1).transfer(Upstream.FILE, stalled, chunks.append)
+        assert chunks == [b'x']
+
+    asyncio.run(test())
+
+
+def test_transfer_times_out_waiting_for_response():
+    async def unresponsive(write):
+        await asyncio.sleep(1)
+
+    async def test():
+        start = asyncio.get_running_loop().time()
+        with pytest.raises(UpstreamTimeoutError):
+            await upstream(0.1).transfer(Upstream.FILE, unresponsive, lambda chunk: None)
+        assert asyncio.get_running_loop().time() - start < 0.5
+
+    asyncio.run(test())
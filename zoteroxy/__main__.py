@@ -0,0 +1,3 @@
+from zoteroxy.server import main
+
+main()
@@ -1,9 +1,24 @@
 import aiohttp_jinja2
+import asyncio
+import contextvars
+import datetime
+import hashlib
+import math
+import os
 
 from aiohttp import web
+from aiohttp.helpers import ETAG_ANY
+from typing import Iterator, Optional
 
+from zoteroxy.bibliography import APAStyle, STYLES
+from zoteroxy.compression import IDENTITY, SUFFIXES
 from zoteroxy.consts import VERSION
-from zoteroxy.serializers import BibJSONSerializer, BibTexSerializer, ZoteroxySerializer
+from zoteroxy.encoders import dumps
+from zoteroxy.index import CollectionQuery
+from zoteroxy.metrics import CONTENT_TYPE, REGISTRY, cache_metrics
+from zoteroxy.model import Attachment
+from zoteroxy.responses import AttachmentResponse, count_bytes, iterate, stream_response
+from zoteroxy.snapshot import CollectionSnapshot
 from zoteroxy.zotero import Zotero
 
 
@@ -26,10 +41,13 @@ class ZoteroxyAPI:
         )
 
     async def view_collection(self, request) -> web.Response:
+        style = request.query.get('style', APAStyle.NAME)
         return aiohttp_jinja2.render_template(
             'collection.html.j2', request, {
                 'current': 'collection',
                 'config': self.config,
+                'styles': STYLES,
+                'style': STYLES.get(style, APAStyle),
             }
         )
 
@@ -41,22 +59,104 @@ class ZoteroxyAPI:
             }
         )
 
+    @staticmethod
+    def _is_not_modified(request: web.Request, etag: Optional[str],
+                         last_modified: Optional[datetime.datetime]) -> bool:
+        if request.if_none_match is not None:
+            return etag is not None and any(
+                e.value == etag or e.value == ETAG_ANY for e in request.if_none_match
+            )
+        if request.if_modified_since is not None and last_modified is not None:
+            # Last-Modified header is rounded up to whole seconds
+            return math.ceil(last_modified.timestamp()) <= request.if_modified_since.timestamp()
+        return False
+
+    @staticmethod
+    def _set_validators(response: web.StreamResponse, etag: Optional[str],
+                        last_modified: Optional[datetime.datetime]):
+        if etag is not None:
+            response.etag = etag
+        if last_modified is not None:
+            response.last_modified = last_modified.astimezone(datetime.timezone.utc)
+
+    def _conditional(self, request: web.Request, etag: Optional[str],
+                     last_modified: Optional[datetime.datetime],
+                     headers: Optional[dict] = None) -> Optional[web.Response]:
+        if last_modified is not None:
+            last_modified = last_modified.astimezone(datetime.timezone.utc)
+        if not self._is_not_modified(request, etag, last_modified):
+            return None
+        response = web.Response(status=304, headers=headers)
+        self._set_validators(response, etag, last_modified)
+        return response
+
+    def _precondition(self, request: web.Request, etag: str,
+                      last_modified: Optional[datetime.datetime]) -> Optional[web.Response]:
+        # checked before the body is encoded, so its size (whether it is compressed) is unknown
+        encoding = self.zotero.compressor.negotiate(request.headers.get('Accept-Encoding', ''))
+        headers = {'Vary': 'Accept-Encoding'}
+        if encoding != IDENTITY:
+            not_modified = self._conditional(request, f'{etag}-{SUFFIXES[encoding]}', last_modified,
+                                             headers=headers)
+            if not_modified is not None:
+                return not_modified
+        return self._conditional(request, etag, last_modified, headers=headers)
+
+    @staticmethod
+    def _file_etag(metadata: Attachment, encoding: str) -> Optional[str]:
+        if metadata.file_hash is None or encoding == IDENTITY:
+            return metadata.file_hash
+        return f'{metadata.file_hash}-{SUFFIXES[encoding]}'
+
     async def retrieve_file(self, request: web.Request) -> web.Response:
         key = request.match_info.get('key', None)
         if key is None:
             raise web.HTTPBadRequest()
         try:
-            metadata = self.zotero.attachment_metadata(key=key)
+            metadata = await self.zotero.attachment_metadata(key=key)
         except RuntimeError:
             raise web.HTTPNotFound()
-        data = self.zotero.attachment_data(metadata=metadata)
-        return web.Response(
-            body=data,
-            content_type=metadata.content_type,
-            headers={
-                'Content-Disposition': f'inline; filename="{metadata.filename}"'
-            }
+        if metadata.file_hash is None:
+            # linked files and URLs have no file stored in Zotero
+            raise web.HTTPNotFound()
+        headers = {
+            'Cache-Control': f'public, max-age={self.config.settings.cache_file_max_age}',
+        }
+        if self.zotero.compressor.files:
+            headers['Vary'] = 'Accept-Encoding'
+        encoding = self.zotero.compressor.negotiate(
+            request.headers.get('Accept-Encoding', ''), await self.zotero.attachment_encodings(metadata)
         )
+        not_modified = self._conditional(request, self._file_etag(metadata, encoding),
+                                         metadata.updated_at, headers=headers)
+        if not_modified is not None:
+            return not_modified
+        filepath = await self.zotero.attachment_path(metadata, encoding)
+        if filepath is None and encoding != IDENTITY:
+            encoding = IDENTITY
+            filepath = await self.zotero.attachment_path(metadata)
+        if encoding != IDENTITY:
+            headers['Content-Encoding'] = encoding
+        headers['Content-Disposition'] = f'inline; filename="{metadata.filename}"'
+        if filepath is not None:
+            response = AttachmentResponse(
+                path=filepath,
+                etag=self._file_etag(metadata, encoding),
+                last_modified=metadata.updated_at,
+                content_type=metadata.content_type,
+                headers=headers,
+            )
+            try:
+                await response.prepare(request)
+                return response
+            except FileNotFoundError:
+                # removed from the cache meanwhile, nothing has been sent yet
+                headers.pop('Content-Encoding', None)
+        download = self.zotero.attachment_download(metadata)
+        response = web.StreamResponse(headers=headers)
+        response.content_type = metadata.content_type
+        self._set_validators(response, self._file_etag(metadata, IDENTITY), metadata.updated_at)
+        return await stream_response(request, response, count_bytes(download.chunks(), 'upstream'))
 
     async def get_info_json(self) -> web.Response:
         return web.json_response({
@@ -74,27 +174,204 @@ class ZoteroxyAPI:
     async def get_settings_json(self) -> web.Response:
         return web.json_response({
             'base_url': self.config.settings.base_url,
-            'tags': self.config.settings.tags,
+            'tags': sorted(self.config.settings.tags),
             'cache': {
                 'duration': self.config.settings.cache_duration,
+                'max_stale': self.config.settings.cache_max_stale,
+                'background_refresh': self.config.settings.cache_background_refresh,
                 'file_duration': self.config.settings.cache_file_duration,
+                'file_max_age': self.config.settings.cache_file_max_age,
+                'file_max_size': self.config.settings.cache_file_max_size,
+                'file_max_entries': self.config.settings.cache_file_max_entries,
+                'stats': self.zotero.cache_stats,
             }
         })
 
-    async def get_collection(self) -> web.Response:
-        return web.json_response(
-            ZoteroxySerializer.serialize_collection(self.zotero.collection)
+    async def _compress(self, body: bytes, encoding: str) -> bytes:
+        # compressed in a thread so other requests are served meanwhile
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, contextvars.copy_context().run, self.zotero.compressor.compress, body, encoding
         )
 
-    async def get_collection_bib(self) -> web.Response:
-        return web.json_response(
-            BibTexSerializer.serialize_collection(self.zotero.collection)
+    async def _body_response(self, request: web.Request, body: bytes, etag: str,
+                             last_modified: Optional[datetime.datetime],
+                             content_type: str = 'application/json',
+                             conditional: bool = True) -> web.Response:
+        encoding = IDENTITY
+        if self.zotero.compressor.should_compress(body):
+            encoding = self.zotero.compressor.negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding != IDENTITY:
+            etag = f'{etag}-{SUFFIXES[encoding]}'
+        headers = {'Vary': 'Accept-Encoding'}
+        if conditional:
+            not_modified = self._conditional(request, etag, last_modified, headers=headers)
+            if not_modified is not None:
+                return not_modified
+        if encoding != IDENTITY:
+            headers['Content-Encoding'] = encoding
+            body = await self._compress(body, encoding)
+        response = web.Response(
+            body=body,
+            content_type=content_type,
+            charset='utf-8',
+            headers=headers,
         )
+        self._set_validators(response, etag, last_modified)
+        return response
+
+    async def _stream_response(self, request: web.Request, chunks: Iterator[bytes], etag: str,
+                               last_modified: Optional[datetime.datetime],
+                               content_type: str) -> web.StreamResponse:
+        encoding = self.zotero.compressor.negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding != IDENTITY:
+            etag = f'{etag}-{SUFFIXES[encoding]}'
+        headers = {'Vary': 'Accept-Encoding'}
+        not_modified = self._conditional(request, etag, last_modified, headers=headers)
+        if not_modified is not None:
+            return not_modified
+        if encoding != IDENTITY:
+            headers['Content-Encoding'] = encoding
+        response = web.StreamResponse(headers=headers)
+        response.content_type = content_type
+        response.charset = 'utf-8'
+        response.enable_chunked_encoding()
+        self._set_validators(response, etag, last_modified)
+        chunks = self.zotero.compressor.stream(chunks, encoding)
+        return await stream_response(request, response, iterate(chunks))
+
+    async def _query_response(self, request: web.Request, fmt: str,
+                              query: CollectionQuery) -> web.StreamResponse:
+        snapshot = await self.zotero.snapshot()
+        content_type = CollectionSnapshot.CONTENT_TYPES[fmt]
+        etag = snapshot.query_etag(fmt, query)
+        not_modified = self._precondition(request, etag, snapshot.last_modified)
+        if not_modified is not None:
+            return not_modified
+        streams = snapshot.streams(query)
+        try:
+            if streams:
+                chunks = snapshot.chunks(fmt, query)
+            else:
+                body = snapshot.encode(fmt, query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        if streams:
+            return await self._stream_response(request, chunks, etag, snapshot.last_modified, content_type)
+        return await self._body_response(request, body, etag, snapshot.last_modified, content_type,
+                                         conditional=False)
+
+    async def get_item(self, request: web.Request, fmt: str) -> web.Response:
+        snapshot = await self.zotero.snapshot()
+        item = snapshot.items.get(request.match_info['key'], None)
+        if item is None:
+            raise web.HTTPNotFound()
+        return await self._body_response(request, item.body(fmt), item.etag(fmt), item.last_modified,
+                                         CollectionSnapshot.CONTENT_TYPES[fmt])
 
-    async def get_collection_json(self) -> web.Response:
-        return web.json_response(
-            BibJSONSerializer.serialize_collection(self.zotero.collection)
+    @staticmethod
+    def _lookup_format(value: str) -> str:
+        formats = [CollectionSnapshot.ZOTEROXY, CollectionSnapshot.BIBJSON, CollectionSnapshot.BIBTEX]
+        if value not in formats:
+            raise web.HTTPBadRequest(text=f'Unknown format: {value}')
+        return value
+
+    async def lookup_items(self, request: web.Request) -> web.Response:
+        if request.method == 'POST':
+            try:
+                data = await request.json()
+            except ValueError:
+                raise web.HTTPBadRequest(text='Invalid JSON')
+            if isinstance(data, list):
+                data = {'keys': data}
+            if not isinstance(data, dict) or not isinstance(data.get('keys', None), list) \
+                    or not all(isinstance(k, str) for k in data['keys']):
+                raise web.HTTPBadRequest(text='Expected list of item keys')
+            keys = data['keys']
+            fmt = self._lookup_format(data.get('format', CollectionSnapshot.ZOTEROXY))
+        else:
+            keys = [k for k in request.query.get('keys', '').split(',') if k != '']
+            if len(keys) == 0:
+                raise web.HTTPBadRequest(text='Missing keys')
+            fmt = self._lookup_format(request.query.get('format', CollectionSnapshot.ZOTEROXY))
+        snapshot = await self.zotero.snapshot()
+        body = dumps(snapshot.lookup(fmt, keys))
+        etag = f'{fmt}-{hashlib.md5(body).hexdigest()}'
+        return await self._body_response(request, body, etag, snapshot.last_modified,
+                                         conditional=request.method != 'POST')
+
+    async def _snapshot_response(self, request: web.Request, fmt: str) -> web.StreamResponse:
+        try:
+            query = CollectionQuery.from_params(request.query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        if not query.is_empty:
+            return await self._query_response(request, fmt, query)
+        snapshot = await self.zotero.snapshot()
+        if snapshot.streams():
+            return await self._stream_response(
+                request, snapshot.chunks(fmt), snapshot.etag(fmt), snapshot.last_modified,
+                CollectionSnapshot.CONTENT_TYPES[fmt],
+            )
+        await snapshot.encoded(fmt)
+        encoding = snapshot.encoding(fmt, request.headers.get('Accept-Encoding', ''))
+        etag = snapshot.etag(fmt, encoding)
+        headers = {'Vary': 'Accept-Encoding'}
+        not_modified = self._conditional(request, etag, snapshot.last_modified, headers=headers)
+        if not_modified is not None:
+            return not_modified
+        if encoding != IDENTITY:
+            headers['Content-Encoding'] = encoding
+        response = web.Response(
+            body=await snapshot.encoded(fmt, encoding),
+            content_type=CollectionSnapshot.CONTENT_TYPES[fmt],
+            charset='utf-8',
+            headers=headers,
         )
+        self._set_validators(response, etag, snapshot.last_modified)
+        return response
+
+    async def search(self, request: web.Request) -> web.Response:
+        try:
+            query = CollectionQuery.from_params(request.query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        if query.search is None:
+            raise web.HTTPBadRequest(text='Missing search query')
+        return await self._query_response(request, CollectionSnapshot.ZOTEROXY, query)
+
+    async def get_bibliography(self, request: web.Request) -> web.Response:
+        try:
+            query = CollectionQuery.from_params(request.query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        snapshot = await self.zotero.snapshot()
+        style = request.query.get('style', APAStyle.NAME)
+        etag = snapshot.bibliography_etag(style, query)
+        not_modified = self._precondition(request, etag, snapshot.last_modified)
+        if not_modified is not None:
+            return not_modified
+        try:
+            result = snapshot.bibliography(style, query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return await self._body_response(request, dumps(result), etag, snapshot.last_modified,
+                                         conditional=False)
+
+    async def get_collection(self, request: web.Request) -> web.Response:
+        return await self._snapshot_response(request, CollectionSnapshot.ZOTEROXY)
+
+    async def get_collection_bib(self, request: web.Request) -> web.Response:
+        return await self._snapshot_response(request, CollectionSnapshot.BIBTEX)
+
+    async def get_collection_json(self, request: web.Request) -> web.Response:
+        return await self._snapshot_response(request, CollectionSnapshot.BIBJSON)
+
+    async def get_metrics(self) -> web.Response:
+        # workers have their own metrics
+        labels = [('worker', str(os.getpid()))]
+        body = REGISTRY.render(cache_metrics(self.zotero.cache_stats), labels=labels)
+        return web.Response(body=body.encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
 
     async def purge_cache(self) -> web.Response:
         self.zotero.clear_cache()
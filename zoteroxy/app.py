@@ -6,18 +6,61 @@ import humps
 import jinja2
 import os
 import pathlib
+import string
+import textwrap
+import time
 
 from aiohttp import web
 
 from zoteroxy.api import ZoteroxyAPI
 from zoteroxy.config import ZoteroxyConfigParser
+from zoteroxy.snapshot import CollectionSnapshot
 from zoteroxy.consts import APPNAME, DESCRIPTION, VERSION, ENV_CONFIG
+from zoteroxy.metrics import REQUEST_DURATION, REQUESTS_IN_FLIGHT
+from zoteroxy.profiling import Profiler, server_timing
+from zoteroxy.upstream import UpstreamError, UpstreamTimeoutError
 from zoteroxy.zotero import Zotero
 
 
 filters = dict()
 routes = list()
 
+COLLECTION_QUERY = """\
+- name: limit
+  in: query
+  type: integer
+  description: maximal number of returned items
+- name: offset
+  in: query
+  type: integer
+  description: number of matching items to skip
+- name: q
+  in: query
+  type: string
+  description: search query, matching items are ordered by relevance
+- name: type
+  in: query
+  type: string
+  description: item types (comma-separated)
+- name: year
+  in: query
+  type: string
+  description: publication years (comma-separated)
+- name: tag
+  in: query
+  type: string
+  description: tags (comma-separated)
+- name: author
+  in: query
+  type: string
+  description: author last names or full names (comma-separated)
+- name: updated_since
+  in: query
+  type: string
+  format: date-time
+  description: only items modified after given time
+"""
+
 
 def zoteroxy_jinja_filter(name: str):
     def wrapper(func):
@@ -29,12 +72,41 @@ def zoteroxy_jinja_filter(name: str):
     return wrapper
 
 
+def swagger_parameters(**parameters: str):
+    # shared parameters are substituted into the swagger docstrings
+    def wrapper(func):
+        indented = {k: textwrap.indent(v, '    ').strip() for k, v in parameters.items()}
+        func.__doc__ = string.Template(func.__doc__).substitute(indented)
+        return func
+    return wrapper
+
+
 def zoteroxy_endpoint(method: str, route: str, *, name: str, cors: bool = True):
     def wrapper(func):
         @functools.wraps(func)
         async def wrapped(request):
             api = request.app['api']
-            return await func(request=request, api=api)
+            status = 500
+            start = time.perf_counter()
+            REQUESTS_IN_FLIGHT.inc(route=name)
+            try:
+                with request.app['profiler'].profile(request, name):
+                    response = await func(request=request, api=api)
+                status = response.status
+                return response
+            except web.HTTPException as e:
+                status = e.status
+                raise
+            except UpstreamTimeoutError:
+                status = web.HTTPGatewayTimeout.status_code
+                raise web.HTTPGatewayTimeout()
+            except UpstreamError:
+                status = web.HTTPBadGateway.status_code
+                raise web.HTTPBadGateway()
+            finally:
+                REQUESTS_IN_FLIGHT.dec(route=name)
+                REQUEST_DURATION.observe(time.perf_counter() - start,
+                                         route=name, method=method, status=status)
         routes.append(
             (method, route, wrapped, name, cors)
         )
@@ -66,6 +138,7 @@ async def index_handler(request, api: ZoteroxyAPI):
 
 
 @zoteroxy_endpoint('GET', '/collection', name='collection')
+@swagger_parameters(collection_query=COLLECTION_QUERY)
 async def items_handler(request, api: ZoteroxyAPI):
     """
     ---
@@ -74,44 +147,283 @@ async def items_handler(request, api: ZoteroxyAPI):
     - application/json
     - application/x-bibtex
     - text/html
+    parameters:
+    $collection_query
+    - name: fields
+      in: query
+      type: string
+      description: item fields to be returned (comma-separated)
     responses:
         "200":
             description: library items
+        "304":
+            description: library items not modified
+        "400":
+            description: invalid query
     """
     if request.headers['Accept'] == 'application/json':
-        return await api.get_collection()
+        return await api.get_collection(request)
     elif request.headers['Accept'] == 'application/x-bibtex':
-        return await api.get_collection_bib()
+        return await api.get_collection_bib(request)
     else:
         return await api.view_collection(request)
 
 
 @zoteroxy_endpoint('GET', '/collection.json', name='collection_json')
+@swagger_parameters(collection_query=COLLECTION_QUERY)
 async def items_json_handler(request, api: ZoteroxyAPI):
     """
     ---
     description: Library items in BibJSON format.
     produces:
     - application/json
+    parameters:
+    $collection_query
     responses:
         "200":
             description: library items
+        "304":
+            description: library items not modified
+        "400":
+            description: invalid query
     """
-    return await api.get_collection_json()
+    return await api.get_collection_json(request)
 
 
 @zoteroxy_endpoint('GET', '/collection.bib', name='collection_bib')
+@swagger_parameters(collection_query=COLLECTION_QUERY)
 async def items_bib_handler(request, api: ZoteroxyAPI):
     """
     ---
     description: Library items in BibTeX format.
     produces:
     - application/x-bibtex
+    parameters:
+    $collection_query
     responses:
         "200":
             description: library items
+        "304":
+            description: library items not modified
+        "400":
+            description: invalid query
+    """
+    return await api.get_collection_bib(request)
+
+
+@zoteroxy_endpoint('GET', '/bibliography', name='bibliography')
+async def bibliography_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Bibliography of library items rendered as HTML in a citation style.
+    produces:
+    - application/json
+    parameters:
+    - name: style
+      in: query
+      type: string
+      enum: [apa]
+      description: citation style (default apa)
+    - name: limit
+      in: query
+      type: integer
+      description: maximal number of returned entries
+    - name: offset
+      in: query
+      type: integer
+      description: number of matching entries to skip
+    - name: q
+      in: query
+      type: string
+      description: search query
+    - name: type
+      in: query
+      type: string
+      description: item types (comma-separated)
+    - name: year
+      in: query
+      type: string
+      description: publication years (comma-separated)
+    - name: tag
+      in: query
+      type: string
+      description: tags (comma-separated)
+    - name: author
+      in: query
+      type: string
+      description: author last names or full names (comma-separated)
+    - name: updated_since
+      in: query
+      type: string
+      format: date-time
+      description: only items modified after given date and time
+    responses:
+        "200":
+            description: rendered bibliography with keys of its items
+        "304":
+            description: bibliography not modified
+        "400":
+            description: unknown style or invalid query
+    """
+    return await api.get_bibliography(request)
+
+
+@zoteroxy_endpoint('GET', '/item/{key:[A-Za-z0-9]+}', name='item')
+async def item_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Single library item.
+    produces:
+    - application/json
+    parameters:
+    - name: key
+      in: path
+      type: string
+      required: true
+      description: key of the item
+    responses:
+        "200":
+            description: library item
+        "304":
+            description: library item not modified
+        "404":
+            description: unknown item
+    """
+    if request.headers.get('Accept', None) == 'application/x-bibtex':
+        return await api.get_item(request, CollectionSnapshot.BIBTEX)
+    return await api.get_item(request, CollectionSnapshot.ZOTEROXY)
+
+
+@zoteroxy_endpoint('GET', '/item/{key:[A-Za-z0-9]+}.json', name='item_json')
+async def item_json_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Single library item in BibJSON format.
+    produces:
+    - application/json
+    parameters:
+    - name: key
+      in: path
+      type: string
+      required: true
+      description: key of the item
+    responses:
+        "200":
+            description: library item
+        "304":
+            description: library item not modified
+        "404":
+            description: unknown item
     """
-    return await api.get_collection_bib()
+    return await api.get_item(request, CollectionSnapshot.BIBJSON)
+
+
+@zoteroxy_endpoint('GET', '/item/{key:[A-Za-z0-9]+}.bib', name='item_bib')
+async def item_bib_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Single library item in BibTeX format.
+    produces:
+    - application/x-bibtex
+    parameters:
+    - name: key
+      in: path
+      type: string
+      required: true
+      description: key of the item
+    responses:
+        "200":
+            description: library item
+        "304":
+            description: library item not modified
+        "404":
+            description: unknown item
+    """
+    return await api.get_item(request, CollectionSnapshot.BIBTEX)
+
+
+@zoteroxy_endpoint('GET', '/items', name='items')
+async def items_lookup_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Library items with given keys.
+    produces:
+    - application/json
+    parameters:
+    - name: keys
+      in: query
+      type: string
+      required: true
+      description: keys of the items (comma-separated)
+    - name: format
+      in: query
+      type: string
+      enum: [zoteroxy, bibjson, bibtex]
+      description: format of the items (default zoteroxy)
+    responses:
+        "200":
+            description: found library items and keys of missing ones
+        "304":
+            description: library items not modified
+        "400":
+            description: missing keys or invalid format
+    """
+    return await api.lookup_items(request)
+
+
+@zoteroxy_endpoint('POST', '/items', name='items')
+async def items_lookup_post_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Library items with keys given in the body (list of keys or
+        object with keys and format).
+    consumes:
+    - application/json
+    produces:
+    - application/json
+    responses:
+        "200":
+            description: found library items and keys of missing ones
+        "400":
+            description: invalid request body
+    """
+    return await api.lookup_items(request)
+
+
+@zoteroxy_endpoint('GET', '/search', name='search')
+async def search_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Library items matching the search query, the most relevant first.
+    produces:
+    - application/json
+    parameters:
+    - name: q
+      in: query
+      type: string
+      required: true
+      description: words (or their prefixes) in titles, authors, publications, DOIs and tags
+    - name: limit
+      in: query
+      type: integer
+      description: maximal number of returned items
+    - name: offset
+      in: query
+      type: integer
+      description: number of matching items to skip
+    - name: fields
+      in: query
+      type: string
+      description: item fields to be returned (comma-separated)
+    responses:
+        "200":
+            description: matching library items
+        "304":
+            description: matching library items not modified
+        "400":
+            description: invalid query
+    """
+    return await api.search(request)
 
 
 @zoteroxy_endpoint('GET', '/settings', name='settings')
@@ -140,6 +452,10 @@ async def file_retrieve_handler(request, api: ZoteroxyAPI):
     responses:
         "200":
             description: file content
+        "206":
+            description: requested range of file content
+        "304":
+            description: file content not modified
         "400":
             description: invalid key
         "404":
@@ -148,6 +464,20 @@ async def file_retrieve_handler(request, api: ZoteroxyAPI):
     return await api.retrieve_file(request)
 
 
+@zoteroxy_endpoint('GET', '/metrics', name='metrics', cors=False)
+async def metrics_handler(request, api: ZoteroxyAPI):
+    """
+    ---
+    description: Metrics of the proxy in Prometheus text format.
+    produces:
+    - text/plain
+    responses:
+        "200":
+            description: metrics
+    """
+    return await api.get_metrics()
+
+
 @zoteroxy_endpoint('POST', '/purge', name='purge_cache', cors=False)
 async def purge_cache_handler(request, api: ZoteroxyAPI):
     """
@@ -175,6 +505,11 @@ def init_func(argv):
     else:
         print('Missing configuration file!')
     app['api'] = ZoteroxyAPI(Zotero(app['cfg']))
+    app['profiler'] = Profiler(app['cfg'].settings.profiling)
+    if app['profiler'].is_active:
+        app.on_response_prepare.append(server_timing)
+    app.on_startup.append(lambda a: a['api'].zotero.start())
+    app.on_cleanup.append(lambda a: a['api'].zotero.close())
 
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
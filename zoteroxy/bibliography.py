@@ -0,0 +1,217 @@
+import html
+import re
+
+from typing import Dict, List, Optional
+
+from zoteroxy.index import tokenize
+from zoteroxy.model import Author, LibraryItem
+
+
+def _text(value: Optional[str]) -> Optional[str]:
+    if value is None or value.strip() == '':
+        return None
+    return html.escape(value.strip())
+
+
+def _italic(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    return f'<i>{value}</i>'
+
+
+def _sentence(value: str) -> str:
+    if value.endswith(('.', '?', '!')):
+        return value
+    return f'{value}.'
+
+
+def _pages(value: Optional[str]) -> Optional[str]:
+    pages = _text(value)
+    if pages is None:
+        return None
+    return re.sub(r'\s*-+\s*', '–', pages)
+
+
+def _link(url: str) -> str:
+    url = url.strip()
+    text = html.escape(url)
+    # other schemes (e.g. javascript:) are not linked
+    if not url.lower().startswith(('http://', 'https://')):
+        return text
+    return f'<a href="{text}">{text}</a>'
+
+
+class BaseStyle:
+
+    NAME = ''
+    LABEL = ''
+
+    @classmethod
+    def sort_key(cls, item: LibraryItem) -> tuple:
+        return ()
+
+    @classmethod
+    def render(cls, item: LibraryItem) -> str:
+        raise NotImplementedError()
+
+
+class APAStyle(BaseStyle):
+
+    NAME = 'apa'
+    LABEL = 'APA (7th edition)'
+
+    MAX_AUTHORS = 20
+
+    _ARTICLES = frozenset(['journalArticle', 'magazineArticle', 'newspaperArticle'])
+    _CHAPTERS = frozenset(['bookSection', 'conferencePaper', 'encyclopediaArticle', 'dictionaryEntry'])
+
+    @staticmethod
+    def _initials(firstname: Optional[str]) -> Optional[str]:
+        if firstname is None:
+            return None
+        initials = []
+        for name in firstname.split():
+            parts = [p.strip('.') for p in name.split('-')]
+            initials.append('-'.join(f'{p[0]}.' for p in parts if p != ''))
+        result = ' '.join(i for i in initials if i != '')
+        return result if result != '' else None
+
+    @classmethod
+    def _inverted_name(cls, author: Author) -> Optional[str]:
+        initials = cls._initials(author.firstname)
+        if author.lastname is None:
+            return initials
+        if initials is None:
+            return author.lastname
+        return f'{author.lastname}, {initials}'
+
+    @classmethod
+    def _name(cls, author: Author) -> Optional[str]:
+        names = [n for n in (cls._initials(author.firstname), author.lastname) if n is not None]
+        return ' '.join(names) if len(names) > 0 else None
+
+    @classmethod
+    def _names(cls, names: List[str]) -> str:
+        if len(names) == 1:
+            return names[0]
+        if len(names) > cls.MAX_AUTHORS:
+            return f'{", ".join(names[:cls.MAX_AUTHORS - 1])}, . . . {names[-1]}'
+        return f'{", ".join(names[:-1])}, & {names[-1]}'
+
+    @classmethod
+    def _creators(cls, item: LibraryItem) -> Optional[str]:
+        authors = [cls._inverted_name(a) for a in item.authors if a.is_author]
+        authors = [html.escape(a) for a in authors if a is not None]
+        if len(authors) > 0:
+            return _sentence(cls._names(authors))
+        editors = [cls._inverted_name(a) for a in item.authors if a.is_editor]
+        editors = [html.escape(e) for e in editors if e is not None]
+        if len(editors) > 0:
+            return f'{cls._names(editors)} ({"Ed." if len(editors) == 1 else "Eds."}).'
+        return None
+
+    @classmethod
+    def _editors(cls, item: LibraryItem) -> Optional[str]:
+        editors = [cls._name(a) for a in item.authors if a.is_editor]
+        editors = [html.escape(e) for e in editors if e is not None]
+        if len(editors) == 0:
+            return None
+        if len(editors) == 2:
+            names = ' & '.join(editors)
+        else:
+            names = cls._names(editors)
+        return f'{names} ({"Ed." if len(editors) == 1 else "Eds."})'
+
+    @classmethod
+    def _source(cls, item: LibraryItem) -> Optional[str]:
+        if item.type in cls._ARTICLES:
+            journal = _text(item.publication_title or item.journal_abbreviation)
+            if journal is None:
+                return None
+            source = _italic(journal)
+            volume = _text(item.volume)
+            if volume is not None:
+                source += f', {_italic(volume)}'
+            issue = _text(item.issue)
+            if issue is not None:
+                source += f'({issue})'
+            pages = _pages(item.pages)
+            if pages is not None:
+                source += f', {pages}'
+            return _sentence(source)
+        container = _text(item.publication_title or item.proceedings_title or item.conference_name)
+        if item.type in cls._CHAPTERS and container is not None:
+            editors = cls._editors(item)
+            source = f'In {editors}, ' if editors is not None else 'In '
+            source += _italic(container)
+            pages = _pages(item.pages)
+            if pages is not None:
+                source += f' (pp. {pages})'
+            source = _sentence(source)
+            publisher = _text(item.publisher)
+            if publisher is not None:
+                source += f' {_sentence(publisher)}'
+            return source
+        publisher = _text(item.publisher)
+        return _sentence(publisher) if publisher is not None else None
+
+    @classmethod
+    def _is_standalone(cls, item: LibraryItem) -> bool:
+        if item.type in cls._ARTICLES:
+            return False
+        if item.type in cls._CHAPTERS:
+            return (item.publication_title or item.proceedings_title or item.conference_name) is None
+        return True
+
+    @classmethod
+    def sort_key(cls, item: LibraryItem) -> tuple:
+        first = next((a for a in item.authors if a.is_author), None)
+        if first is None:
+            first = next((a for a in item.authors if a.is_editor), None)
+        name = item.title if first is None else f'{first.lastname or ""} {first.firstname or ""}'
+        return ' '.join(tokenize(name)), item.year or '', ' '.join(tokenize(item.title))
+
+    @classmethod
+    def render(cls, item: LibraryItem) -> str:
+        title = _sentence(_text(item.title) or '[Untitled]')
+        if cls._is_standalone(item):
+            title = _italic(title[:-1]) + title[-1]
+        date = f'({item.year or "n.d."}).'
+        creators = cls._creators(item)
+        parts = [creators, date, title] if creators is not None else [title, date]
+        source = cls._source(item)
+        if source is not None:
+            parts.append(source)
+        if item.doi is not None and item.doi.strip() != '':
+            parts.append(_link(f'https://doi.org/{item.doi.strip()}'))
+        elif item.url is not None and item.url.strip() != '':
+            parts.append(_link(item.url))
+        return ' '.join(parts)
+
+
+STYLES = {
+    APAStyle.NAME: APAStyle,
+}
+
+
+class Bibliography:
+
+    def __init__(self, style, items: List[LibraryItem]):
+        self.style = style
+        self._items = items
+        # positions of items in the collection ordered by the style
+        self.order = sorted(range(len(items)), key=lambda p: style.sort_key(items[p]))  # type: List[int]
+        self._entries = dict()  # type: Dict[int, str]
+
+    def entry(self, position: int) -> str:
+        # entries are rendered once, when they are first requested
+        if position not in self._entries.keys():
+            item = self._items[position]
+            content = self.style.render(item)
+            self._entries[position] = \
+                f'<div class="csl-entry" data-key="{html.escape(item.key)}">{content}</div>'
+        return self._entries[position]
+
+    def render(self, positions: List[int]) -> str:
+        entries = ''.join(self.entry(position) for position in positions)
+        return f'<div class="csl-bib-body">{entries}</div>'
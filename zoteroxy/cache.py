@@ -1,13 +1,39 @@
+import asyncio
+import collections
+import concurrent.futures
 import datetime
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import os
 import pathlib
+import shutil
+import sqlite3
+import time
+import uuid
 
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from zoteroxy.compression import Compressor, IDENTITY, SUFFIXES, is_compressible
+from zoteroxy.consts import CHUNK_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path: pathlib.Path, data: bytes):
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp, mode='wb') as f:
+        f.write(data)
+    tmp.replace(path)
 
 
 class CachedValue:
 
-    def __init__(self, value: Any):
-        self.cached_at = datetime.datetime.now()
+    def __init__(self, value: Any, cached_at: Optional[datetime.datetime] = None):
+        self.cached_at = cached_at or datetime.datetime.now()
         self.value = value
 
     @property
@@ -16,78 +42,979 @@ class CachedValue:
         return (now - self.cached_at).total_seconds()
 
 
+class CacheBackend:
+    # shared storage of cached values and leases for processes of the proxy,
+    # called in its own thread as it may wait for the other processes
+
+    def __init__(self):
+        self._executor = None  # type: Optional[concurrent.futures.ThreadPoolExecutor]
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='zoteroxy-backend'
+            )
+        return self._executor
+
+    async def run(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    @staticmethod
+    def _log_failure(future: concurrent.futures.Future):
+        if future.exception() is not None:
+            logger.warning('Cache backend call failed: %s', future.exception())
+
+    def submit(self, func: Callable, *args):
+        # calls are run in order, so later calls see the changes
+        self.executor.submit(func, *args).add_done_callback(self._log_failure)
+
+    def get(self, key: str, newer_than: Optional[datetime.datetime] = None) -> Optional[CachedValue]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: CachedValue):
+        raise NotImplementedError
+
+    def touch(self, key: str, cached_at: datetime.datetime, previous: datetime.datetime):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def scan(self, prefix: str) -> Dict[str, CachedValue]:
+        raise NotImplementedError
+
+    def find(self, prefix: str, value: Any) -> List[str]:
+        raise NotImplementedError
+
+    def clear(self, prefix: str = ''):
+        raise NotImplementedError
+
+    def acquire(self, name: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def release(self, name: str):
+        raise NotImplementedError
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class SQLiteBackend(CacheBackend):
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS entries '
+        '(key TEXT PRIMARY KEY, value TEXT NOT NULL, cached_at REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS leases '
+        '(name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)',
+    ]
+
+    def __init__(self, path: pathlib.Path, timeout: float = 30):
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self.owner = uuid.uuid4().hex
+        self._db = None  # type: Optional[sqlite3.Connection]
+        self._pid = None  # type: Optional[int]
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # connections must not be shared with forked processes
+        if self._db is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), timeout=self.timeout,
+                                       isolation_level=None, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                self._db.execute(statement)
+            self._pid = os.getpid()
+            self.owner = uuid.uuid4().hex
+        return self._db
+
+    @staticmethod
+    def _value(row) -> CachedValue:
+        return CachedValue(json.loads(row[0]), datetime.datetime.fromtimestamp(row[1]))
+
+    def get(self, key: str, newer_than: Optional[datetime.datetime] = None) -> Optional[CachedValue]:
+        since = newer_than.timestamp() if newer_than is not None else 0
+        row = self.db.execute(
+            'SELECT value, cached_at FROM entries WHERE key = ? AND cached_at > ?', (key, since)
+        ).fetchone()
+        return None if row is None else self._value(row)
+
+    def set(self, key: str, value: CachedValue):
+        self.db.execute(
+            'INSERT OR REPLACE INTO entries (key, value, cached_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value.value), value.cached_at.timestamp())
+        )
+
+    def touch(self, key: str, cached_at: datetime.datetime, previous: datetime.datetime):
+        self.db.execute(
+            'UPDATE entries SET cached_at = ? WHERE key = ? AND cached_at = ?',
+            (cached_at.timestamp(), key, previous.timestamp())
+        )
+
+    def delete(self, key: str):
+        self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def scan(self, prefix: str) -> Dict[str, CachedValue]:
+        rows = self.db.execute(
+            'SELECT key, value, cached_at FROM entries WHERE substr(key, 1, ?) = ? ORDER BY cached_at',
+            (len(prefix), prefix)
+        )
+        return {row[0]: self._value(row[1:]) for row in rows}
+
+    def find(self, prefix: str, value: Any) -> List[str]:
+        rows = self.db.execute(
+            'SELECT key FROM entries WHERE substr(key, 1, ?) = ? AND value = ?',
+            (len(prefix), prefix, json.dumps(value))
+        )
+        return [row[0] for row in rows]
+
+    def clear(self, prefix: str = ''):
+        self.db.execute('DELETE FROM entries WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+
+    def acquire(self, name: str, ttl: float) -> bool:
+        now = time.time()
+        cursor = self.db.execute(
+            'INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+            'WHERE leases.owner = excluded.owner OR leases.expires < ?',
+            (name, self.owner, now + ttl, now)
+        )
+        return cursor.rowcount > 0
+
+    def release(self, name: str):
+        self.db.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, self.owner))
+
+    def close(self):
+        super().close()
+        if self._db is not None and self._pid == os.getpid():
+            self._db.close()
+        self._db = None
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+}
+
+
+def create_backend(name: str, path: pathlib.Path) -> Optional[CacheBackend]:
+    if name == 'memory':
+        return None
+    if name not in BACKENDS.keys():
+        raise RuntimeError(f'Unknown cache backend: {name}')
+    return BACKENDS[name](path)
+
+
+class Lease:
+    # only one process holds the lease, it is renewed until released
+
+    POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 1.0
+
+    def __init__(self, backend: CacheBackend, name: str, ttl: float):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self._renewal = None  # type: Optional[asyncio.Future]
+
+    async def acquire(self, done: Callable[[], Awaitable[bool]]) -> bool:
+        # False when the work was done by the holder while waiting
+        delay = self.POLL_INTERVAL
+        while not await self.backend.run(self.backend.acquire, self.name, self.ttl):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_POLL_INTERVAL)
+            if await done():
+                return False
+        self._renewal = asyncio.ensure_future(self._renew())
+        return True
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if not await self.backend.run(self.backend.acquire, self.name, self.ttl):
+                logger.warning('Lease %s was taken over', self.name)
+                return
+
+    def release(self):
+        if self._renewal is not None:
+            self._renewal.cancel()
+            self._renewal = None
+        self.backend.submit(self.backend.release, self.name)
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._tasks = {}  # type: Dict[str, asyncio.Future]
+        self.calls = 0
+        self.coalesced = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._tasks.keys()
+
+    def _done(self, key: str, task: asyncio.Future):
+        if self._tasks.get(key, None) is task:
+            self._tasks.pop(key)
+
+    def do(self, key: str, func: Callable[[], Awaitable]) -> asyncio.Future:
+        task = self._tasks.get(key, None)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        self.calls += 1
+        task = asyncio.ensure_future(func())
+        self._tasks[key] = task
+        task.add_done_callback(functools.partial(self._done, key))
+        return task
+
+    def detach(self):
+        # running calls finish for their waiters, new ones start afresh
+        self._tasks.clear()
+
+
 class Cache:
 
-    def __init__(self, duration: int):
+    PREFIX = 'cache:'
+    RETRY_DELAY = 5.0
+    MAX_RETRY_DELAY = 300.0
+
+    def __init__(self, duration: int, max_stale: int = 0, background_refresh: bool = False,
+                 backend: Optional[CacheBackend] = None, lease_ttl: float = 30):
         self._values = {}  # type: Dict[str, CachedValue]
+        self._flight = SingleFlight()
+        self._failures = {}  # type: Dict[str, Tuple[int, float]]
+        self._generation = 0
         self.duration = duration
+        self.max_stale = max_stale
+        self.background_refresh = background_refresh
+        self.backend = backend
+        self.lease_ttl = lease_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.expirations = 0
+        self.shared_hits = 0
 
     def set(self, key: str, value: Any):
-        self._values[key] = CachedValue(value=value)
+        previous = self._values.get(key, None)
+        self._values[key] = v = CachedValue(value=value)
+        if self.backend is None:
+            return
+        if previous is not None and previous.value is value:
+            # unchanged values are not serialized again
+            self.backend.submit(self.backend.touch, self.PREFIX + key, v.cached_at, previous.cached_at)
+        else:
+            self.backend.submit(self.backend.set, self.PREFIX + key, v)
 
-    def has(self, key: str) -> bool:
-        return key in self._values.keys()
+    def __len__(self) -> int:
+        return len(self._values)
 
-    def is_valid(self, key: str) -> bool:
-        return self.has(key) and self._values[key].age < self.duration
+    async def _current(self, key: str) -> Optional[CachedValue]:
+        # values refreshed by other processes replace older local ones
+        v = self._values.get(key, None)
+        if self.backend is not None and (v is None or v.age >= self.duration):
+            if v is not None:
+                newer_than = v.cached_at
+            else:
+                newer_than = datetime.datetime.now() - \
+                    datetime.timedelta(seconds=self.duration + self.max_stale)
+            shared = await self.backend.run(self.backend.get, self.PREFIX + key, newer_than)
+            if shared is not None:
+                self.shared_hits += 1
+                self._values[key] = v = shared
+        return v
 
-    def get_value(self, key: str) -> Optional[Any]:
-        if key in self._values.keys():
-            return self._values[key].value
-        return None
+    async def has(self, key: str) -> bool:
+        return await self._current(key) is not None
+
+    async def is_valid(self, key: str) -> bool:
+        v = await self._current(key)
+        return v is not None and v.age < self.duration
+
+    async def get_value(self, key: str) -> Optional[Any]:
+        v = await self._current(key)
+        return None if v is None else v.value
+
+    def _is_usable_stale(self, value: CachedValue) -> bool:
+        return value.age < self.duration + self.max_stale
+
+    async def _is_refreshed(self, key: str, previous: Optional[CachedValue]) -> bool:
+        v = await self._current(key)
+        return v is not None and v is not previous and v.age < self.duration
+
+    def _store(self, key: str, value: Any, generation: int):
+        # values loaded before the cache was cleared are not cached
+        if generation == self._generation:
+            self.set(key, value)
+
+    async def _fetch(self, key: str, callback) -> Any:
+        generation = self._generation
+        if self.backend is not None:
+            previous = self._values.get(key, None)
+            lease = Lease(self.backend, self.PREFIX + key, self.lease_ttl)
+            if not await lease.acquire(functools.partial(self._is_refreshed, key, previous)):
+                return self._values[key].value
+            try:
+                if await self._is_refreshed(key, previous):
+                    return self._values[key].value
+                v = await callback(key)
+                self._store(key, v, generation)
+                return v
+            finally:
+                lease.release()
+        v = await callback(key)
+        self._store(key, v, generation)
+        return v
+
+    def _loaded(self, key: str, task: asyncio.Future):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            # backoff only matters for stale values, others would accumulate forever
+            if key not in self._values.keys():
+                self._failures.pop(key, None)
+                return
+            failures, _ = self._failures.get(key, (0, 0.0))
+            self._failures[key] = (failures + 1, time.monotonic())
+        else:
+            self._failures.pop(key, None)
+
+    def _backs_off(self, key: str) -> bool:
+        # stale value is served without retrying a failed refresh for a while
+        failure = self._failures.get(key, None)
+        if failure is None:
+            return False
+        failures, failed_at = failure
+        delay = min(self.RETRY_DELAY * 2 ** (failures - 1), self.MAX_RETRY_DELAY)
+        return time.monotonic() < failed_at + delay
+
+    def _load(self, key: str, callback) -> asyncio.Future:
+        # concurrent misses of the same key share one upstream call
+        started = key not in self._flight
+        task = self._flight.do(key, functools.partial(self._fetch, key, callback))
+        if started:
+            task.add_done_callback(functools.partial(self._loaded, key))
+        return task
+
+    @staticmethod
+    def _log_failure(key: str, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning('Background refresh of %s failed: %s', key, task.exception())
+
+    def _revalidate(self, key: str, callback):
+        if key not in self._flight and not self._backs_off(key):
+            self._load(key, callback).add_done_callback(functools.partial(self._log_failure, key))
 
-    def get(self, key: str, callback=None) -> Optional[Any]:
-        if key in self._values.keys():
-            v = self._values[key]
+    def refresh(self, key: str, callback):
+        self._revalidate(key, callback)
+
+    async def get(self, key: str, callback=None) -> Optional[Any]:
+        stale = None  # type: Optional[CachedValue]
+        v = await self._current(key)
+        if v is not None:
             if v.age < self.duration:
+                self.hits += 1
                 return v.value
+            elif callable(callback) and self._is_usable_stale(v):
+                if self._backs_off(key):
+                    self.stale_hits += 1
+                    return v.value
+                if self.background_refresh:
+                    self._revalidate(key, callback)
+                    self.stale_hits += 1
+                    return v.value
+                stale = v
             else:
                 self._values.pop(key)
+                self.expirations += 1
+        self.misses += 1
         if callable(callback):
-            v = callback(key)
-            self.set(key, v)
-            return v
+            try:
+                return await asyncio.shield(self._load(key, callback))
+            except Exception:
+                if stale is None or not self._is_usable_stale(stale):
+                    raise
+                logger.warning('Serving stale %s after failed refresh', key)
+                self.stale_hits += 1
+                return stale.value
         return None
 
+    @property
+    def stats(self) -> dict:
+        return {
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'expirations': self.expirations,
+            'upstream_calls': self._flight.calls,
+            'coalesced': self._flight.coalesced,
+            'shared_hits': self.shared_hits,
+        }
+
     def clear(self):
+        self._flight.detach()
+        self._generation += 1
+        self._failures.clear()
         self._values.clear()
+        if self.backend is not None:
+            self.backend.submit(self.backend.clear, self.PREFIX)
+
+
+class Download:
+
+    def __init__(self, key: str, path: pathlib.Path):
+        self.key = key
+        self.path = path
+        self.written = 0
+        self.finished = False
+        self.prefetch = False
+        self.generation = 0
+        self.error = None  # type: Optional[BaseException]
+        self.task = None  # type: Optional[asyncio.Future]
+        self._file = open(path, mode='wb')
+        self._hash = hashlib.md5()
+        self._progress = asyncio.Event()
+
+    def _notify(self):
+        self._progress.set()
+        self._progress = asyncio.Event()
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self._file.flush()
+        self._hash.update(chunk)
+        self.written += len(chunk)
+        self._notify()
+
+    def close(self):
+        self._file.close()
+
+    def finish(self, path: pathlib.Path):
+        self.path = path
+        self.finished = True
+        self._notify()
+
+    def fail(self, error: BaseException):
+        self._file.close()
+        self.error = error
+        self._notify()
+
+    async def chunks(self, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        # readers follow the file on disk while it is being downloaded
+        if self.error is not None:
+            raise self.error
+        offset = 0
+        with open(self.path, mode='rb') as f:
+            while True:
+                if offset < self.written:
+                    f.seek(offset)
+                    chunk = f.read(min(chunk_size, self.written - offset))
+                    offset += len(chunk)
+                    yield chunk
+                elif self.error is not None:
+                    raise self.error
+                elif self.finished:
+                    return
+                else:
+                    await self._progress.wait()
+
+
+class CachedFile(CachedValue):
+
+    def __init__(self, path: pathlib.Path, digest: str,
+                 cached_at: Optional[datetime.datetime] = None):
+        super().__init__(value=path)
+        if cached_at is not None:
+            self.cached_at = cached_at
+        self.digest = digest
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self.value
 
 
 class FileCache:
 
-    def __init__(self, duration: int, directory: pathlib.Path):
-        self._cache = Cache(duration=duration)
+    INDEX = 'index.json'
+    OBJECTS = 'objects'
+    PREFIX = 'file:'
+    SAVE_DELAY = 1.0
+
+    def __init__(self, duration: int, directory: pathlib.Path,
+                 compressor: Optional[Compressor] = None,
+                 max_size: int = 0, max_entries: int = 0,
+                 backend: Optional[CacheBackend] = None, lease_ttl: float = 30,
+                 prefetch_share: float = 1.0):
+        self._files = collections.OrderedDict()  # type: Dict[str, CachedFile]
+        self._prefetched = collections.OrderedDict()  # type: Dict[str, int]
+        self._blobs = dict()  # type: Dict[str, int]
+        self._refs = collections.Counter()  # type: Dict[str, int]
+        self._downloads = dict()  # type: Dict[str, Download]
+        self._parts = itertools.count()
+        self._generation = 0
+        self.duration = duration
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.prefetch_share = prefetch_share
+        self.size = 0
+        self.prefetched_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.shared_hits = 0
         self.directory = directory
-        self._clear_directory()
+        self.compressor = compressor
+        self.backend = backend
+        self.lease_ttl = lease_ttl
+        self._changed = False
+        self._saving = None  # type: Optional[asyncio.TimerHandle]
+        self._writing = None  # type: Optional[asyncio.Future]
+        self._load()
+
+    def _blob_path(self, digest: str, encoding: str = IDENTITY) -> pathlib.Path:
+        name = digest if encoding == IDENTITY else f'{digest}.{SUFFIXES[encoding]}'
+        return self.directory / self.OBJECTS / digest[:2] / name
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.backend is not None:
+            # files of other processes are neither indexed nor removed locally
+            for key, entry in self.backend.scan(self.PREFIX).items():
+                self._link(key[len(self.PREFIX):], entry.value['digest'], cached_at=entry.cached_at)
+            self._evict()
+            return
+        index_path = self.directory / self.INDEX
+        files = dict()
+        if index_path.exists():
+            try:
+                files = json.loads(index_path.read_text(encoding='utf-8')).get('files', dict())
+            except ValueError as e:
+                logger.warning('Ignoring corrupted file cache index: %s', e)
+        # index keeps the least recently used entries first
+        for key, entry in files.items():
+            if self._blob_path(entry['digest']).exists():
+                cached_at = datetime.datetime.fromtimestamp(entry['cached_at'])
+                self._link(key, entry['digest'], cached_at=cached_at)
+        self._remove_unreferenced()
+        self._evict()
+        self._write_index(self._index())
+
+    def _index(self) -> List[Tuple[str, str, float]]:
+        return [(key, entry.digest, entry.cached_at.timestamp()) for key, entry in self._files.items()]
+
+    def _write_index(self, index: List[Tuple[str, str, float]]):
+        files = {key: {'digest': digest, 'cached_at': cached_at} for key, digest, cached_at in index}
+        write_atomic(self.directory / self.INDEX,
+                     json.dumps({'files': files}).encode('utf-8'))
+
+    def _save(self):
+        if self.backend is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_index(self._index())
+            return
+        # changes are batched and written in a thread
+        self._changed = True
+        if self._saving is None and self._writing is None:
+            self._saving = loop.call_later(self.SAVE_DELAY, self._flush)
+
+    def _flush(self):
+        self._saving = None
+        self._changed = False
+        loop = asyncio.get_running_loop()
+        self._writing = loop.run_in_executor(None, self._write_index, self._index())
+        self._writing.add_done_callback(self._written)
+
+    def _written(self, task: asyncio.Future):
+        self._writing = None
+        if task.exception() is not None:
+            logger.warning('Saving file cache index failed: %s', task.exception())
+        if self._changed:
+            self._saving = asyncio.get_running_loop().call_later(self.SAVE_DELAY, self._flush)
+
+    async def close(self):
+        # pending changes of the index are written right away
+        if self._writing is not None:
+            await asyncio.wait([self._writing])
+        if self._saving is not None:
+            self._saving.cancel()
+            self._saving = None
+        if self._changed:
+            self._changed = False
+            self._write_index(self._index())
+
+    def _remove_unreferenced(self):
+        for part in self.directory.glob('.*.part'):
+            part.unlink(missing_ok=True)
+        for blob in (self.directory / self.OBJECTS).glob('*/*'):
+            if blob.name.split('.')[0] not in self._blobs.keys():
+                blob.unlink()
 
-    def _clear_directory(self):
-        if self.directory.exists():
-            for child in self.directory.glob('*'):
-                if child.is_file():
-                    child.unlink()
+    def _clear_directory(self, keep: Set[pathlib.Path]):
+        # other files in the directory are not ours
+        shutil.rmtree(self.directory / self.OBJECTS, ignore_errors=True)
+        for part in self.directory.glob('.*.part'):
+            if part not in keep:
+                part.unlink(missing_ok=True)
+        (self.directory / self.INDEX).unlink(missing_ok=True)
+
+    def _link(self, key: str, digest: str, cached_at: Optional[datetime.datetime] = None,
+              prefetched: bool = False):
+        self._unmark(key)
+        existing = self._files.pop(key, None)
+        if existing is not None:
+            if existing.digest == digest:
+                self._refs[digest] -= 1
+            else:
+                self._files[key] = existing
+                self._remove(key)
+        if digest not in self._blobs.keys():
+            size = 0
+            for encoding in [IDENTITY] + list(SUFFIXES.keys()):
+                blob = self._blob_path(digest, encoding)
+                if blob.exists():
+                    size += blob.stat().st_size
+            self._blobs[digest] = size
+            self.size += size
+        self._refs[digest] += 1
+        self._files[key] = CachedFile(self._blob_path(digest), digest, cached_at=cached_at)
+        if prefetched:
+            self._prefetched[key] = self._blobs[digest]
+            self.prefetched_size += self._blobs[digest]
+
+    def _unmark(self, key: str):
+        # prefetched file is kept as any other once requested
+        self.prefetched_size -= self._prefetched.pop(key, 0)
+
+    def _remove(self, key: str):
+        entry = self._files.pop(key, None)
+        if entry is None:
+            return
+        self._unmark(key)
+        digest = entry.digest
+        self._refs[digest] -= 1
+        if self._refs[digest] <= 0:
+            # blob is not shared by any other attachment anymore
+            del self._refs[digest]
+            self.size -= self._blobs.pop(digest)
+        if self.backend is not None:
+            # blobs may be used by other processes, the shared index decides
+            self.backend.submit(self._unshare, key, digest, entry.cached_at)
+        elif digest not in self._refs.keys():
+            self._unlink(digest)
+
+    def _unlink(self, digest: str):
+        for encoding in [IDENTITY] + list(SUFFIXES.keys()):
+            self._blob_path(digest, encoding).unlink(missing_ok=True)
+
+    def _unshare(self, key: str, digest: str, cached_at: datetime.datetime):
+        # called in the thread of the backend
+        # the file may have been downloaded again by another process meanwhile
+        if self.backend.get(self.PREFIX + key, newer_than=cached_at) is None:
+            self.backend.delete(self.PREFIX + key)
+        if digest in self._blobs.keys() or len(self.backend.find(self.PREFIX, {'digest': digest})) > 0:
+            return
+        self._unlink(digest)
+
+    def _is_over_budget(self) -> bool:
+        return (self.max_size > 0 and self.size > self.max_size) or \
+               (self.max_entries > 0 and len(self._files) > self.max_entries)
+
+    def _evict(self):
+        # the most recently used entry is kept even if it does not fit alone,
+        # prefetched files not requested yet are evicted first
+        while self._is_over_budget() and len(self._files) > 1:
+            key = next(iter(self._prefetched.keys()), None)
+            if key is None:
+                key = next(iter(self._files.keys()))
+            self._remove(key)
+            self.evictions += 1
+
+    def can_prefetch(self, size: Optional[int]) -> bool:
+        # prefetched files only take free space up to a share of the size limit
+        size = size or 0
+        if self.max_size > 0 and (self.size + size > self.max_size or
+                                  self.prefetched_size + size > self.max_size * self.prefetch_share):
+            return False
+        return self.max_entries <= 0 or len(self._files) < self.max_entries
+
+    def _compress(self, source: pathlib.Path, digest: str, content_type: Optional[str]) -> int:
+        compressor = self.compressor
+        if compressor is None or not compressor.files or not is_compressible(content_type):
+            return 0
+        encoding = compressor.file_encoding
+        if self._blob_path(digest, encoding).exists():
+            return 0
+        data = source.read_bytes()
+        if not compressor.should_compress(data, content_type):
+            return 0
+        compressed = compressor.compress(data, encoding)
+        self._blob_path(digest, encoding).parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(self._blob_path(digest, encoding), compressed)
+        return len(compressed)
+
+    async def _compressed(self, source: pathlib.Path, digest: str, content_type: Optional[str]) -> int:
+        # compressed in a thread so other requests are served meanwhile
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._compress, source, digest, content_type)
+
+    def _store(self, key: str, tmp: pathlib.Path, digest: str, added: int,
+               prefetched: bool = False) -> pathlib.Path:
+        blob = self._blob_path(digest)
+        if blob.exists():
+            tmp.unlink()
         else:
-            self.directory.mkdir(parents=True)
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp.replace(blob)
+        if digest in self._blobs.keys():
+            self._blobs[digest] += added
+            self.size += added
+        self._link(key, digest, prefetched=prefetched)
+        if self.backend is not None:
+            self.backend.submit(self.backend.set, self.PREFIX + key,
+                                CachedValue({'digest': digest}, self._files[key].cached_at))
+        self._evict()
+        self._save()
+        return blob
 
-    def set(self, key: str, data: bytes):
-        filepath = self.directory / key
-        with open(filepath, mode='wb') as f:
+    def set(self, key: str, data: bytes, content_type: Optional[str] = None):
+        tmp = self.directory / f'.{key}.{os.getpid()}.part'
+        with open(tmp, mode='wb') as f:
             f.write(data)
-        self._cache.set(key, filepath)
-
-    def get(self, key: str, callback=None) -> Optional[bytes]:
-        if self._cache.has(key):
-            filepath = self._cache.get_value(key)
-            if self._cache.is_valid(key):
-                data = filepath.read_bytes()
-                return data
-            else:
-                filepath.unlink(missing_ok=True)
+        digest = hashlib.md5(data).hexdigest()
+        self._store(key, tmp, digest, self._compress(tmp, digest, content_type))
+
+    async def _shared(self, key: str) -> Optional[CachedValue]:
+        entry = await self.backend.run(self.backend.get, self.PREFIX + key)
+        if entry is None or entry.age >= self.duration \
+                or not self._blob_path(entry.value['digest']).exists():
+            return None
+        return entry
+
+    async def _is_shared(self, key: str) -> bool:
+        return await self._shared(key) is not None
+
+    async def _adopt(self, key: str) -> Optional[CachedFile]:
+        # file downloaded by another process
+        entry = await self._shared(key)
+        if entry is None:
+            return None
+        self.shared_hits += 1
+        self._link(key, entry.value['digest'], cached_at=entry.cached_at)
+        self._evict()
+        return self._files.get(key, None)
+
+    async def _lookup(self, key: str, encoding: str = IDENTITY) -> Optional[pathlib.Path]:
+        entry = self._files.get(key, None)
+        if entry is None and self.backend is not None:
+            entry = await self._adopt(key)
+        if entry is None:
+            return None
+        if entry.age >= self.duration:
+            self._remove(key)
+            self._save()
+            self.expirations += 1
+            return None
+        if not entry.path.exists():
+            # evicted by another process
+            self._remove(key)
+            self._save()
+            return None
+        filepath = self._blob_path(entry.digest, encoding)
+        return filepath if filepath.exists() else None
+
+    async def has(self, key: str) -> bool:
+        # only peeks at the index, entries are expired or adopted by lookups of clients
+        entry = self._files.get(key, None)
+        if entry is not None:
+            return entry.age < self.duration
+        return self.backend is not None and await self._is_shared(key)
+
+    async def path(self, key: str, encoding: str = IDENTITY) -> Optional[pathlib.Path]:
+        filepath = await self._lookup(key, encoding)
+        if filepath is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._files.move_to_end(key)
+            self._unmark(key)
+        return filepath
+
+    async def variants(self, key: str) -> List[str]:
+        return [e for e in SUFFIXES.keys() if await self._lookup(key, e) is not None]
+
+    def expire(self) -> int:
+        expired = [key for key, entry in self._files.items() if entry.age >= self.duration]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+        self._save()
+        return len(expired)
+
+    async def sweep(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.expire()
+            except Exception as e:
+                logger.warning('Sweeping file cache failed: %s', e)
+
+    async def _copy(self, source: pathlib.Path, write: Callable[[bytes], None]):
+        with open(source, mode='rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                write(chunk)
+                await asyncio.sleep(0)
+
+    async def _fetch(self, download: Download, callback,
+                     content_type: Optional[str]) -> Optional[pathlib.Path]:
+        key = download.key
+        if self.backend is None:
+            await callback(key, download.write)
+            return None
+        lease = Lease(self.backend, self.PREFIX + key, self.lease_ttl)
+        if await lease.acquire(functools.partial(self._is_shared, key)):
+            try:
+                entry = await self._shared(key)
+                if entry is None:
+                    await callback(key, download.write)
+                    # stored while holding the lease so others do not download it again
+                    download.close()
+                    return await self._stored(download, content_type)
+            finally:
+                lease.release()
+        else:
+            entry = await self._shared(key)
+            if entry is None:
+                raise RuntimeError(f'File {key} disappeared from the shared cache')
+        self.shared_hits += 1
+        digest = entry.value['digest']
+        await self._copy(self._blob_path(digest), download.write)
+        download.close()
+        if self._is_detached(download):
+            return download.path
+        download.path.unlink()
+        self._link(key, digest, cached_at=entry.cached_at, prefetched=download.prefetch)
+        self._evict()
+        return self._blob_path(digest)
+
+    def _is_detached(self, download: Download) -> bool:
+        # downloads running when the cache was cleared finish only for their readers
+        return download.generation != self._generation
+
+    async def _stored(self, download: Download, content_type: Optional[str]) -> pathlib.Path:
+        if not self._is_detached(download):
+            added = await self._compressed(download.path, download.digest, content_type)
+            if not self._is_detached(download):
+                return self._store(download.key, download.path, download.digest, added, download.prefetch)
+        return download.path
+
+    async def _download(self, download: Download, callback, content_type: Optional[str]):
+        key = download.key
+        part = download.path
+        try:
+            filepath = await self._fetch(download, callback, content_type)
+            if filepath is None:
+                download.close()
+                filepath = await self._stored(download, content_type)
+        except BaseException as e:
+            download.fail(e)
+            download.path.unlink(missing_ok=True)
+            raise
+        finally:
+            if self._downloads.get(key, None) is download:
+                self._downloads.pop(key)
+        download.finish(filepath)
+        if filepath == part:
+            # readers have the file open already
+            part.unlink(missing_ok=True)
+
+    @staticmethod
+    def _retrieve_exception(task: asyncio.Future):
+        if not task.cancelled():
+            task.exception()
+
+    def download(self, key: str, callback, content_type: Optional[str] = None,
+                 prefetch: bool = False) -> Download:
+        download = self._downloads.get(key, None)
+        if download is not None and (prefetch or not download.prefetch):
+            self.coalesced += 1
+            return download
+        if download is not None:
+            # prefetch is limited in size and waits for other requests, clients download on their own
+            download.task.cancel()
+        self.upstream_calls += 1
+        download = Download(key, self.directory / f'.{key}.{os.getpid()}.{next(self._parts)}.part')
+        download.prefetch = prefetch
+        download.generation = self._generation
+        self._downloads[key] = download
+        download.task = asyncio.ensure_future(self._download(download, callback, content_type))
+        download.task.add_done_callback(self._retrieve_exception)
+        return download
+
+    async def get(self, key: str, callback=None, content_type: Optional[str] = None) -> Optional[bytes]:
+        filepath = await self.path(key)
+        if filepath is not None:
+            return filepath.read_bytes()
         if callable(callback):
-            v = callback(key)
-            self.set(key, v)
-            return v
+            download = self.download(key, callback, content_type)
+            return b''.join([chunk async for chunk in download.chunks()])
         return None
 
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._files),
+            'blobs': len(self._blobs),
+            'size': self.size,
+            'max_size': self.max_size,
+            'prefetched_size': self.prefetched_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups > 0 else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'upstream_calls': self.upstream_calls,
+            'coalesced': self.coalesced,
+            'shared_hits': self.shared_hits,
+        }
+
     def clear(self):
-        self._clear_directory()
-        self._cache.clear()
+        if self.backend is not None:
+            self.backend.submit(self.backend.clear, self.PREFIX)
+        # downloads of clients are detached, nobody waits for prefetched ones
+        self._generation += 1
+        keep = set()
+        for download in self._downloads.values():
+            if download.prefetch:
+                download.task.cancel()
+            else:
+                keep.add(download.path)
+        self._downloads.clear()
+        self._files.clear()
+        self._prefetched.clear()
+        self._blobs.clear()
+        self._refs.clear()
+        self.size = 0
+        self.prefetched_size = 0
+        self._clear_directory(keep)
+        self._save()
@@ -0,0 +1,179 @@
+import aiohttp
+import asyncio
+import contextlib
+import time
+
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Tuple
+
+from zoteroxy.config import ZoteroxyConfig
+from zoteroxy.consts import CHUNK_SIZE
+from zoteroxy.governor import UpstreamGovernor
+from zoteroxy.metrics import UPSTREAM_DURATION, UPSTREAM_RESPONSES, UPSTREAM_RETRIES
+from zoteroxy.upstream import UpstreamError
+
+
+class ZoteroAPIError(UpstreamError):
+
+    def __init__(self, status: int, url: str):
+        super().__init__('request', f'{url} responded with {status}')
+        self.status = status
+        self.url = url
+
+
+class ZoteroClient:
+
+    API_VERSION = '3'
+
+    def __init__(self, config: ZoteroxyConfig):
+        self.api_url = config.zotero.api_url.rstrip('/')
+        self.api_key = config.zotero.api_key
+        self.page_size = config.zotero.page_size
+        self.fanout = config.zotero.fanout
+        self.connections = config.zotero.connections
+        self.prefix = f'/{config.library.type}s/{config.library.id}'
+        self.governor = UpstreamGovernor(
+            rate_limit=config.zotero.rate_limit,
+            burst=config.zotero.burst,
+            max_concurrency=config.zotero.connections,
+            retries=config.zotero.retries,
+            retry_delay=config.zotero.retry_delay,
+        )
+        self._session = None  # type: Optional[aiohttp.ClientSession]
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # created lazily to bind to the running loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                headers={
+                    'Zotero-API-Key': self.api_key,
+                    'Zotero-API-Version': self.API_VERSION,
+                },
+            )
+        return self._session
+
+    def _url(self, path: str) -> str:
+        return f'{self.api_url}{self.prefix}{path}'
+
+    @staticmethod
+    def _check(response: aiohttp.ClientResponse):
+        if response.status >= 400:
+            raise ZoteroAPIError(response.status, str(response.url))
+
+    @staticmethod
+    def _version(headers) -> Optional[int]:
+        version = headers.get('Last-Modified-Version', None)
+        return int(version) if version is not None else None
+
+    @contextlib.asynccontextmanager
+    async def _get(self, endpoint: str, path: str, params=None, headers=None,
+                   priority: int = UpstreamGovernor.BACKGROUND) -> AsyncIterator[aiohttp.ClientResponse]:
+        # only responses without consumed body are retried
+        attempt = 0
+        while True:
+            admitted = await self.governor.acquire(priority)
+            status = 'error'
+            start = time.perf_counter()
+            elapsed = None  # type: Optional[float]
+            try:
+                try:
+                    response = await self.session.get(self._url(path), params=params, headers=headers)
+                except aiohttp.ClientConnectionError:
+                    if attempt >= self.governor.retries:
+                        raise
+                    delay = 0.0
+                else:
+                    elapsed = time.perf_counter() - start
+                    status = str(response.status)
+                    delay = self.governor.feedback(response.status, response.headers, admitted)
+                    if delay is None or attempt >= self.governor.retries:
+                        try:
+                            yield response
+                        finally:
+                            response.release()
+                        return
+                    response.release()
+            finally:
+                self.governor.release()
+                # until response headers, bodies of files may be streamed for long
+                if elapsed is None:
+                    elapsed = time.perf_counter() - start
+                UPSTREAM_DURATION.observe(elapsed, endpoint=endpoint)
+                UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=status)
+            UPSTREAM_RETRIES.inc(endpoint=endpoint)
+            await asyncio.sleep(self.governor.retry_wait(attempt, delay))
+            attempt += 1
+
+    async def _get_json(self, endpoint: str, path: str, params=None, headers=None,
+                        priority: int = UpstreamGovernor.BACKGROUND):
+        async with self._get(endpoint, path, params=params, headers=headers,
+                             priority=priority) as response:
+            if response.status == 304:
+                return None, response.headers
+            self._check(response)
+            return await response.json(), response.headers
+
+    def _items_params(self, tags: Iterable[str], start: int, since: Optional[int]) -> list:
+        params = [
+            ('format', 'json'),
+            ('limit', str(self.page_size)),
+            ('start', str(start)),
+        ]
+        if since is not None:
+            params.append(('since', str(since)))
+        params.extend(('tag', tag) for tag in tags)
+        return params
+
+    async def items(self, tags: Iterable[str] = (),
+                    since: Optional[int] = None) -> Tuple[Optional[List[dict]], Optional[int]]:
+        tags = list(tags)
+        headers = None
+        if since is not None:
+            headers = {'If-Modified-Since-Version': str(since)}
+        first, first_headers = await self._get_json(
+            'items', '/items', self._items_params(tags, 0, since), headers
+        )
+        if first is None:
+            return None, since
+        total = int(first_headers.get('Total-Results', len(first)))
+        semaphore = asyncio.Semaphore(self.fanout)
+
+        async def fetch_page(start: int) -> List[dict]:
+            async with semaphore:
+                page, _ = await self._get_json('items', '/items',
+                                               self._items_params(tags, start, since))
+                return page
+
+        step = len(first) or self.page_size
+        pages = await asyncio.gather(*(
+            fetch_page(start) for start in range(step, total, step)
+        ))
+        result = list(first)
+        for page in pages:
+            result.extend(page)
+        return result, self._version(first_headers)
+
+    async def deleted(self, since: int) -> Tuple[List[str], Optional[int]]:
+        data, headers = await self._get_json('deleted', '/deleted', [('since', str(since))])
+        return data.get('items', []), self._version(headers)
+
+    async def item(self, key: str) -> dict:
+        item, _ = await self._get_json('item', f'/items/{key}', [('format', 'json')],
+                                       priority=UpstreamGovernor.INTERACTIVE)
+        return item
+
+    async def file(self, key: str, write: Optional[Callable[[bytes], None]] = None,
+                   priority: int = UpstreamGovernor.INTERACTIVE) -> Optional[bytes]:
+        async with self._get('file', f'/items/{key}/file', priority=priority) as response:
+            self._check(response)
+            if write is None:
+                return await response.read()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                write(chunk)
+        return None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,124 @@
+import gzip
+import zlib
+
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from zoteroxy.config import CompressionConfig
+from zoteroxy.profiling import phase
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+BROTLI = 'br'
+
+SUFFIXES = {
+    GZIP: 'gz',
+    BROTLI: 'br',
+}
+
+_COMPRESSIBLE_TYPES = frozenset([
+    'application/javascript',
+    'application/json',
+    'application/rtf',
+    'application/x-bibtex',
+    'application/xhtml+xml',
+    'application/xml',
+    'image/svg+xml',
+])
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    result = dict()
+    for part in header.split(','):
+        params = part.strip().split(';')
+        coding = params[0].strip().lower()
+        if coding == '':
+            continue
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[coding] = q
+    return result
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if content_type is None:
+        return False
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith('text/') or content_type in _COMPRESSIBLE_TYPES
+
+
+class Compressor:
+
+    def __init__(self, config: CompressionConfig):
+        self.enabled = config.enabled
+        self.min_size = config.min_size
+        self.gzip_level = config.gzip_level
+        self.brotli_quality = config.brotli_quality
+        self.files = config.enabled and config.files
+        self.encodings = [GZIP]  # type: List[str]
+        if brotli is not None:
+            self.encodings.insert(0, BROTLI)
+
+    @property
+    def file_encoding(self) -> str:
+        return self.encodings[0]
+
+    def negotiate(self, accept_encoding: str, available: Optional[Iterable[str]] = None) -> str:
+        if not self.enabled:
+            return IDENTITY
+        if available is None:
+            available = self.encodings
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get('*', 0.0)
+        best, best_q = IDENTITY, 0.0
+        for encoding in available:
+            q = accepted.get(encoding, wildcard)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def should_compress(self, data: bytes, content_type: Optional[str] = None) -> bool:
+        if not self.enabled or len(data) < self.min_size:
+            return False
+        return content_type is None or is_compressible(content_type)
+
+    def compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == IDENTITY:
+            return data
+        with phase('compress'):
+            if encoding == GZIP:
+                return gzip.compress(data, compresslevel=self.gzip_level)
+            elif encoding == BROTLI and brotli is not None:
+                return brotli.compress(data, quality=self.brotli_quality)
+        raise ValueError(f'Unsupported encoding: {encoding}')
+
+    def stream(self, chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+        if encoding == IDENTITY:
+            yield from chunks
+        elif encoding == GZIP:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                data = compressor.compress(chunk)
+                if len(data) > 0:
+                    yield data
+            yield compressor.flush()
+        elif encoding == BROTLI and brotli is not None:
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            for chunk in chunks:
+                data = compressor.process(chunk)
+                if len(data) > 0:
+                    yield data
+            yield compressor.finish()
+        else:
+            raise ValueError(f'Unsupported encoding: {encoding}')
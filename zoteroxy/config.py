@@ -1,7 +1,7 @@
 import pathlib
 import yaml
 
-from typing import List
+from typing import Dict, List, Optional
 
 
 class MissingConfigurationError(Exception):
@@ -10,15 +10,83 @@ class MissingConfigurationError(Exception):
         self.missing = missing
 
 
+class UpstreamOperationConfig:
+
+    def __init__(self, concurrency: int, timeout: float):
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+
+class UpstreamConfig:
+
+    def __init__(self, operations: Dict[str, UpstreamOperationConfig]):
+        self.operations = operations
+
+
+class CompressionConfig:
+
+    def __init__(self, enabled: bool, min_size: int, gzip_level: int,
+                 brotli_quality: int, files: bool):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.files = files
+
+
+class PrefetchConfig:
+
+    def __init__(self, enabled: bool, concurrency: int, max_size: int,
+                 bandwidth: int, cache_share: float, content_types: frozenset):
+        self.enabled = enabled
+        self.concurrency = concurrency
+        self.max_size = max_size
+        self.bandwidth = bandwidth
+        self.cache_share = cache_share
+        self.content_types = content_types
+
+
+class ProfilingConfig:
+
+    def __init__(self, enabled: bool, token: str, sample_rate: float, directory: pathlib.Path):
+        self.enabled = enabled
+        self.token = token
+        self.sample_rate = sample_rate
+        self.directory = directory
+
+
 class SettingsConfig:
 
     def __init__(self, base_url: str, tags: frozenset, cache_duration: int,
-                 cache_file_duration: int, cache_directory: pathlib.Path):
+                 cache_max_stale: int, cache_background_refresh: bool,
+                 cache_state_file: Optional[pathlib.Path],
+                 cache_backend: str, cache_backend_path: pathlib.Path, cache_lease_ttl: int,
+                 cache_file_duration: int, cache_file_max_age: int,
+                 cache_file_max_size: int, cache_file_max_entries: int,
+                 cache_file_sweep_interval: int,
+                 cache_directory: pathlib.Path, upstream: UpstreamConfig,
+                 compression: CompressionConfig, streaming_min_items: int,
+                 prefetch: PrefetchConfig, profiling: ProfilingConfig):
         self.base_url = base_url.rstrip('/')
         self.tags = tags
         self.cache_duration = cache_duration
+        self.cache_max_stale = cache_max_stale
+        self.cache_background_refresh = cache_background_refresh
+        self.cache_state_file = cache_state_file
+        self.cache_backend = cache_backend
+        self.cache_backend_path = cache_backend_path
+        self.cache_lease_ttl = cache_lease_ttl
         self.cache_file_duration = cache_file_duration
+        self.cache_file_max_age = cache_file_max_age
+        self.cache_file_max_size = cache_file_max_size
+        self.cache_file_max_entries = cache_file_max_entries
+        self.cache_file_sweep_interval = cache_file_sweep_interval
         self.cache_directory = cache_directory
+        self.upstream = upstream
+        self.compression = compression
+        self.streaming_min_items = streaming_min_items
+        self.prefetch = prefetch
+        self.profiling = profiling
 
 
 class LibraryConfig:
@@ -34,8 +102,18 @@ class LibraryConfig:
 
 class ZoteroConfig:
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, api_url: str, page_size: int,
+                 fanout: int, connections: int, rate_limit: float, burst: int,
+                 retries: int, retry_delay: float):
         self.api_key = api_key
+        self.api_url = api_url
+        self.page_size = page_size
+        self.fanout = fanout
+        self.connections = connections
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.retries = retries
+        self.retry_delay = retry_delay
 
 
 class ZoteroxyConfig:
@@ -49,7 +127,16 @@ class ZoteroxyConfig:
 class ZoteroxyConfigParser:
 
     DEFAULTS = {
-        'zotero': {},
+        'zotero': {
+            'api_url': 'https://api.zotero.org',
+            'page_size': 100,
+            'fanout': 4,
+            'connections': 16,
+            'rate_limit': 10,
+            'burst': 20,
+            'retries': 3,
+            'retry_delay': 1,
+        },
         'library': {
             'type': 'group',
             'owner': '',
@@ -59,14 +146,64 @@ class ZoteroxyConfigParser:
             'tags': frozenset(),
             'cache': {
                 'duration': 3600,
+                'max_stale': 86400,
+                'background_refresh': True,
+                'state_file': 'library.json.gz',
+                'backend': 'memory',
+                'backend_path': 'cache.sqlite',
+                'lease_ttl': 30,
                 'file': {
                     'duration': 3600,
+                    'max_age': 604800,
+                    'max_size': 1073741824,
+                    'max_entries': 0,
+                    'sweep_interval': 300,
                     'directory': 'cache',
                 },
             },
+            'upstream': {
+                'metadata': {
+                    'concurrency': 4,
+                    'timeout': 30,
+                },
+                'sync': {
+                    'concurrency': 1,
+                    'timeout': 600,
+                },
+                'file': {
+                    'concurrency': 3,
+                    'timeout': 300,
+                },
+            },
+            'compression': {
+                'enabled': True,
+                'min_size': 1024,
+                'gzip_level': 6,
+                'brotli_quality': 9,
+                'files': False,
+            },
+            'streaming': {
+                'min_items': 10000,
+            },
+            'prefetch': {
+                'enabled': False,
+                'concurrency': 1,
+                'max_size': 52428800,
+                'bandwidth': 0,
+                'cache_share': 0.5,
+                'content_types': frozenset(['application/pdf']),
+            },
+            'profiling': {
+                'enabled': False,
+                'token': '',
+                'sample_rate': 0.01,
+                'directory': 'profiles',
+            },
         },
     }
 
+    UPSTREAM_OPERATIONS = ['metadata', 'sync', 'file']
+
     REQUIRED = [
         ['zotero', 'api_key'],
         ['library', 'id'],
@@ -99,6 +236,12 @@ class ZoteroxyConfigParser:
             x = x[p]
         return x
 
+    def _optional_path(self, *path) -> Optional[pathlib.Path]:
+        value = self.get_or_default(*path)
+        if value is None or value == '':
+            return None
+        return pathlib.Path(value)
+
     def validate(self):
         missing = []
         for path in self.REQUIRED:
@@ -123,14 +266,79 @@ class ZoteroxyConfigParser:
             base_url=self.get_or_default('settings', 'base_url'),
             tags=frozenset(self.get_or_default('settings', 'tags')),
             cache_duration=self.get_or_default('settings', 'cache', 'duration'),
+            cache_max_stale=self.get_or_default('settings', 'cache', 'max_stale'),
+            cache_background_refresh=self.get_or_default('settings', 'cache', 'background_refresh'),
+            cache_state_file=self._optional_path('settings', 'cache', 'state_file'),
+            cache_backend=self.get_or_default('settings', 'cache', 'backend'),
+            cache_backend_path=pathlib.Path(self.get_or_default('settings', 'cache', 'backend_path')),
+            cache_lease_ttl=self.get_or_default('settings', 'cache', 'lease_ttl'),
             cache_file_duration=self.get_or_default('settings', 'cache', 'file', 'duration'),
+            cache_file_max_age=self.get_or_default('settings', 'cache', 'file', 'max_age'),
+            cache_file_max_size=self.get_or_default('settings', 'cache', 'file', 'max_size'),
+            cache_file_max_entries=self.get_or_default('settings', 'cache', 'file', 'max_entries'),
+            cache_file_sweep_interval=self.get_or_default('settings', 'cache', 'file', 'sweep_interval'),
             cache_directory=pathlib.Path(self.get_or_default('settings', 'cache', 'file', 'directory')),
+            upstream=self.upstream,
+            compression=self.compression,
+            streaming_min_items=self.get_or_default('settings', 'streaming', 'min_items'),
+            prefetch=self.prefetch,
+            profiling=self.profiling,
+        )
+
+    @property
+    def prefetch(self):
+        return PrefetchConfig(
+            enabled=self.get_or_default('settings', 'prefetch', 'enabled'),
+            concurrency=self.get_or_default('settings', 'prefetch', 'concurrency'),
+            max_size=self.get_or_default('settings', 'prefetch', 'max_size'),
+            bandwidth=self.get_or_default('settings', 'prefetch', 'bandwidth'),
+            cache_share=self.get_or_default('settings', 'prefetch', 'cache_share'),
+            content_types=frozenset(self.get_or_default('settings', 'prefetch', 'content_types') or []),
+        )
+
+    @property
+    def profiling(self):
+        return ProfilingConfig(
+            enabled=self.get_or_default('settings', 'profiling', 'enabled'),
+            token=self.get_or_default('settings', 'profiling', 'token') or '',
+            sample_rate=self.get_or_default('settings', 'profiling', 'sample_rate'),
+            directory=pathlib.Path(self.get_or_default('settings', 'profiling', 'directory')),
+        )
+
+    @property
+    def compression(self):
+        return CompressionConfig(
+            enabled=self.get_or_default('settings', 'compression', 'enabled'),
+            min_size=self.get_or_default('settings', 'compression', 'min_size'),
+            gzip_level=self.get_or_default('settings', 'compression', 'gzip_level'),
+            brotli_quality=self.get_or_default('settings', 'compression', 'brotli_quality'),
+            files=self.get_or_default('settings', 'compression', 'files'),
+        )
+
+    @property
+    def upstream(self):
+        return UpstreamConfig(
+            operations={
+                operation: UpstreamOperationConfig(
+                    concurrency=self.get_or_default('settings', 'upstream', operation, 'concurrency'),
+                    timeout=self.get_or_default('settings', 'upstream', operation, 'timeout'),
+                )
+                for operation in self.UPSTREAM_OPERATIONS
+            },
         )
 
     @property
     def zotero(self):
         return ZoteroConfig(
             api_key=self.get_or_default('zotero', 'api_key'),
+            api_url=self.get_or_default('zotero', 'api_url'),
+            page_size=self.get_or_default('zotero', 'page_size'),
+            fanout=self.get_or_default('zotero', 'fanout'),
+            connections=self.get_or_default('zotero', 'connections'),
+            rate_limit=self.get_or_default('zotero', 'rate_limit'),
+            burst=self.get_or_default('zotero', 'burst'),
+            retries=self.get_or_default('zotero', 'retries'),
+            retry_delay=self.get_or_default('zotero', 'retry_delay'),
         )
 
     def parse_file(self, fp):
@@ -2,3 +2,4 @@ APPNAME = 'Zoteroxy'
 DESCRIPTION = 'Proxy service providing data from Zotero in a convenient way'
 VERSION = '1.0.0'
 ENV_CONFIG = 'ZOTEROXY_CONFIG'
+CHUNK_SIZE = 256 * 1024
@@ -0,0 +1,55 @@
+import json
+
+from typing import Iterable, Iterator
+
+from zoteroxy.consts import CHUNK_SIZE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode('utf-8')
+
+
+def batch(parts: Iterable[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    buffer = bytearray()
+    for part in parts:
+        buffer += part
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if len(buffer) > 0:
+        yield bytes(buffer)
+
+
+def _json_parts(value: dict) -> Iterator[bytes]:
+    # lists are encoded item by item, so the whole document is never in memory
+    yield b'{'
+    for i, (key, item) in enumerate(value.items()):
+        if i > 0:
+            yield b','
+        yield dumps(key)
+        yield b':'
+        if isinstance(item, list):
+            yield b'['
+            for j, element in enumerate(item):
+                if j > 0:
+                    yield b','
+                yield dumps(element)
+            yield b']'
+        else:
+            yield dumps(item)
+    yield b'}'
+
+
+def iter_json(value: dict, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    return batch(_json_parts(value), chunk_size)
+
+
+def iter_bibtex(bibs: Iterable[str], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    return batch((f'{bib}\n\n'.encode('utf-8') for bib in bibs), chunk_size)
@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import email.utils
+import heapq
+import itertools
+import random
+import time
+
+from typing import List, Optional, Tuple
+
+from zoteroxy.metrics import UPSTREAM_CONCURRENCY, UPSTREAM_QUEUED, UPSTREAM_THROTTLES
+
+
+def parse_delay(value: Optional[str]) -> Optional[float]:
+    # seconds or HTTP date (Retry-After), seconds (Backoff)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class UpstreamGovernor:
+    # admission of all requests to Zotero API: rate, server hints and adaptive concurrency
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    PREFETCH = 2
+
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+    THROTTLE_STATUSES = frozenset([429, 503])
+
+    def __init__(self, rate_limit: float, burst: int, max_concurrency: int,
+                 retries: int, retry_delay: float, min_concurrency: int = 1):
+        self.rate_limit = rate_limit
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.limit = float(self.max_concurrency)
+        self.active = 0
+        self.paused_until = 0.0
+        self.throttles = 0
+        self._admitted = 0
+        self._decreased_at = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiters = []  # type: List[Tuple[int, int, asyncio.Future]]
+        self._order = itertools.count()
+        self._timer = None  # type: Optional[asyncio.TimerHandle]
+        UPSTREAM_CONCURRENCY.set(self.limit)
+
+    def _refill(self, now: float):
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate_limit)
+        self._updated = now
+
+    def _wait_time(self, now: float) -> float:
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.rate_limit <= 0:
+            return 0.0
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate_limit
+
+    def _schedule(self, delay: float):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._wakeup)
+
+    def _wakeup(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        # waiters are admitted by priority, then in order of arrival
+        while len(self._waiters) > 0 and self.active < int(self.limit):
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._wait_time(time.monotonic())
+            if delay > 0:
+                self._schedule(delay)
+                break
+            _, _, future = heapq.heappop(self._waiters)
+            if self.rate_limit > 0:
+                self._tokens -= 1
+            self.active += 1
+            self._admitted += 1
+            future.set_result(self._admitted)
+        UPSTREAM_QUEUED.set(len(self._waiters))
+
+    async def acquire(self, priority: int = BACKGROUND) -> int:
+        # returns the admission number of the request, passed to the feedback of its response
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._dispatch()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def throttle(self, delay: float, reason: str, admitted: Optional[int] = None):
+        # multiplicative decrease, new requests wait for the server
+        self.throttles += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        # requests admitted before the last decrease were sent with the old limit
+        if admitted is None or admitted > self._decreased_at:
+            self.limit = max(float(self.min_concurrency), self.limit / 2)
+            self._decreased_at = self._admitted
+            UPSTREAM_CONCURRENCY.set(self.limit)
+        UPSTREAM_THROTTLES.inc(reason=reason)
+
+    def succeed(self):
+        # additive increase by one request per window of the current limit
+        if self.limit < self.max_concurrency:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            UPSTREAM_CONCURRENCY.set(self.limit)
+            self._dispatch()
+
+    def feedback(self, status: int, headers, admitted: Optional[int] = None) -> Optional[float]:
+        # returns the delay before retrying, None when the response is final
+        backoff = parse_delay(headers.get('Backoff', None))
+        retry_after = parse_delay(headers.get('Retry-After', None))
+        if status in self.THROTTLE_STATUSES:
+            delay = retry_after if retry_after is not None else backoff
+            self.throttle(delay if delay is not None else self.retry_delay,
+                          'retry_after' if retry_after is not None else f'status_{status}', admitted)
+            return delay or 0.0
+        if backoff is not None:
+            self.throttle(backoff, 'backoff', admitted)
+        elif status < 400:
+            self.succeed()
+        if status in self.RETRY_STATUSES:
+            return retry_after or 0.0
+        return None
+
+    def retry_wait(self, attempt: int, delay: float = 0.0) -> float:
+        # full jitter on top of the delay requested by the server
+        return delay + random.uniform(0, self.retry_delay * 2 ** attempt)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'concurrency_limit': self.limit,
+            'active': self.active,
+            'queued': len(self._waiters),
+            'paused_for': max(0.0, self.paused_until - time.monotonic()),
+            'throttles': self.throttles,
+        }
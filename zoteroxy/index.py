@@ -0,0 +1,345 @@
+import bisect
+import collections
+import datetime
+import math
+import re
+import sys
+import threading
+import unicodedata
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from zoteroxy.model import LibraryItem
+
+
+class CollectionQuery:
+
+    FILTERS = ['type', 'year', 'tag', 'author']
+
+    def __init__(self, limit: Optional[int] = None, offset: int = 0,
+                 fields: Optional[List[str]] = None,
+                 filters: Optional[Dict[str, List[str]]] = None,
+                 updated_since: Optional[datetime.datetime] = None,
+                 search: Optional[str] = None):
+        self.limit = limit
+        self.offset = offset
+        self.fields = fields
+        self.filters = filters or dict()  # type: Dict[str, List[str]]
+        self.updated_since = updated_since
+        self.search = search
+
+    @staticmethod
+    def _values(params, name: str) -> List[str]:
+        values = []
+        for value in params.getall(name, []):
+            values.extend(v.strip() for v in value.split(',') if v.strip() != '')
+        return values
+
+    @staticmethod
+    def _int(value: Optional[str], name: str, minimum: int) -> Optional[int]:
+        if value is None:
+            return None
+        try:
+            number = int(value)
+        except ValueError:
+            raise ValueError(f'Invalid {name}: {value}')
+        if number < minimum:
+            raise ValueError(f'Invalid {name}: {value}')
+        return number
+
+    @staticmethod
+    def _datetime(value: Optional[str]) -> Optional[datetime.datetime]:
+        if value is None:
+            return None
+        try:
+            result = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f'Invalid updated_since: {value}')
+        if result.tzinfo is None:
+            result = result.replace(tzinfo=datetime.timezone.utc)
+        return result
+
+    @classmethod
+    def from_params(cls, params) -> 'CollectionQuery':
+        filters = dict()
+        for name in cls.FILTERS:
+            values = cls._values(params, name)
+            if len(values) > 0:
+                filters[name] = values
+        fields = cls._values(params, 'fields')
+        search = params.get('q', '').strip()
+        return cls(
+            limit=cls._int(params.get('limit', None), 'limit', 0),
+            offset=cls._int(params.get('offset', None), 'offset', 0) or 0,
+            fields=fields if len(fields) > 0 else None,
+            filters=filters,
+            updated_since=cls._datetime(params.get('updated_since', None)),
+            search=search if search != '' else None,
+        )
+
+    @property
+    def is_filtered(self) -> bool:
+        return len(self.filters) > 0 or self.updated_since is not None or self.search is not None
+
+    @property
+    def is_empty(self) -> bool:
+        return self.limit is None and self.offset == 0 and self.fields is None \
+            and not self.is_filtered
+
+    @property
+    def canonical(self) -> str:
+        parts = [f'{name}={",".join(sorted(values))}' for name, values in sorted(self.filters.items())]
+        if self.search is not None:
+            parts.append(f'q={self.search}')
+        if self.updated_since is not None:
+            parts.append(f'updated_since={self.updated_since.timestamp()}')
+        if self.fields is not None:
+            parts.append(f'fields={",".join(self.fields)}')
+        parts.append(f'offset={self.offset}')
+        parts.append(f'limit={self.limit}')
+        return '&'.join(parts)
+
+    def page(self, positions: List[int]) -> List[int]:
+        if self.limit is None:
+            return positions[self.offset:]
+        return positions[self.offset:self.offset + self.limit]
+
+
+def _normalize(value: str) -> str:
+    return value.strip().casefold()
+
+
+class CollectionIndex:
+
+    def __init__(self, items: Iterable[LibraryItem]):
+        self.size = 0
+        self._values = {
+            name: collections.defaultdict(list) for name in CollectionQuery.FILTERS
+        }  # type: Dict[str, Dict[str, List[int]]]
+        updated = []
+        for position, item in enumerate(items):
+            self._add('type', item.type, position)
+            self._add('year', item.year, position)
+            for tag in set(item.tags):
+                self._add('tag', tag, position)
+            names = set()
+            for author in item.authors:
+                names.add(author.lastname)
+                if author.firstname is not None and author.lastname is not None:
+                    names.add(f'{author.firstname} {author.lastname}')
+            for name in names:
+                self._add('author', name, position)
+            updated.append((item.updated_at.timestamp(), position))
+            self.size += 1
+        updated.sort()
+        self._updated = [position for _, position in updated]
+        self._updated_at = [timestamp for timestamp, _ in updated]
+
+    def _add(self, name: str, value: Optional[str], position: int):
+        if value is not None:
+            self._values[name][_normalize(value)].append(position)
+
+    def _matching(self, name: str, values: List[str]) -> Set[int]:
+        index = self._values[name]
+        result = set()
+        for value in values:
+            result.update(index.get(_normalize(value), ()))
+        return result
+
+    def _updated_since(self, since: datetime.datetime) -> Set[int]:
+        start = bisect.bisect_right(self._updated_at, since.timestamp())
+        return set(self._updated[start:])
+
+    def filter(self, query: CollectionQuery) -> Optional[Set[int]]:
+        candidates = [self._matching(name, values) for name, values in query.filters.items()]
+        if query.updated_since is not None:
+            candidates.append(self._updated_since(query.updated_since))
+        if len(candidates) == 0:
+            return None
+        candidates.sort(key=len)
+        return candidates[0].intersection(*candidates[1:])
+
+    def select(self, query: CollectionQuery) -> List[int]:
+        selected = self.filter(query)
+        if selected is None:
+            return list(range(self.size))
+        return sorted(selected)
+
+
+_WORD = re.compile(r'\w+')
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if text is None:
+        return []
+    return _WORD.findall(_fold(text))
+
+
+def _is_doi(text: str) -> bool:
+    return text.startswith('10.') and '/' in text
+
+
+class SearchIndex:
+
+    WEIGHTS = {
+        'title': 3.0,
+        'doi': 3.0,
+        'authors': 2.0,
+        'tags': 2.0,
+        'publication': 1.0,
+    }
+    PREFIX_FACTOR = 0.5
+    MIN_PREFIX = 2
+    RESORT_THRESHOLD = 100
+
+    def __init__(self):
+        self._documents = dict()  # type: Dict[str, Tuple[LibraryItem, Tuple[str, ...]]]
+        self._postings = dict()  # type: Dict[str, Dict[str, float]]
+        self._terms = []  # type: List[str]
+        # updated in a thread while searches are served
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    @staticmethod
+    def _fields(item: LibraryItem) -> tuple:
+        return (
+            item.title,
+            tuple((a.firstname, a.lastname) for a in item.authors),
+            (item.publication_title, item.proceedings_title, item.conference_name),
+            item.doi,
+            tuple(item.tags),
+        )
+
+    def _document_terms(self, fields: tuple) -> Dict[str, float]:
+        title, authors, publications, doi, tags = fields
+        terms = dict()  # type: Dict[str, float]
+
+        def add(tokens: Iterable[str], weight: float):
+            for token in tokens:
+                # postings and documents share one copy of each term
+                token = sys.intern(token)
+                terms[token] = max(terms.get(token, 0.0), weight)
+
+        add(tokenize(title), self.WEIGHTS['title'])
+        for firstname, lastname in authors:
+            add(tokenize(firstname), self.WEIGHTS['authors'])
+            add(tokenize(lastname), self.WEIGHTS['authors'])
+        for publication in publications:
+            add(tokenize(publication), self.WEIGHTS['publication'])
+        if doi is not None and doi.strip() != '':
+            add([_fold(doi.strip())], self.WEIGHTS['doi'])
+        for tag in tags:
+            add(tokenize(tag), self.WEIGHTS['tags'])
+        return terms
+
+    def _add(self, item: LibraryItem, terms: Dict[str, float]) -> List[str]:
+        key = item.key
+        self._documents[key] = (item, tuple(terms.keys()))
+        new_terms = []
+        for term, weight in terms.items():
+            if term not in self._postings.keys():
+                self._postings[term] = dict()
+                new_terms.append(term)
+            self._postings[term][key] = weight
+        return new_terms
+
+    def _remove(self, key: str) -> List[str]:
+        _, terms = self._documents.pop(key)
+        removed_terms = []
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(key, None)
+            if len(postings) == 0:
+                del self._postings[term]
+                removed_terms.append(term)
+        return removed_terms
+
+    def update(self, items: Iterable[LibraryItem]) -> int:
+        # only new, changed and removed items are (re)indexed, their terms are
+        # extracted before the index is locked
+        seen = set()
+        unchanged = []  # type: List[LibraryItem]
+        changed = []  # type: List[Tuple[LibraryItem, Dict[str, float]]]
+        for item in items:
+            seen.add(item.key)
+            document = self._documents.get(item.key, None)
+            if document is not None and (document[0] is item or
+                                         self._fields(document[0]) == self._fields(item)):
+                unchanged.append(item)
+                continue
+            changed.append((item, self._document_terms(self._fields(item))))
+        removed = [k for k in self._documents.keys() if k not in seen]
+        with self._lock:
+            self._apply(unchanged, changed, removed)
+        return len(changed) + len(removed)
+
+    def _apply(self, unchanged: List[LibraryItem], changed: List[Tuple[LibraryItem, Dict[str, float]]],
+               removed: List[str]):
+        new_terms, removed_terms = [], []
+        for item in unchanged:
+            self._documents[item.key] = (item, self._documents[item.key][1])
+        for item, terms in changed:
+            if item.key in self._documents.keys():
+                removed_terms.extend(self._remove(item.key))
+            new_terms.extend(self._add(item, terms))
+        for key in removed:
+            removed_terms.extend(self._remove(key))
+        if len(new_terms) + len(removed_terms) > self.RESORT_THRESHOLD:
+            self._terms = sorted(self._postings.keys())
+        else:
+            for term in removed_terms:
+                if term not in self._postings.keys():
+                    position = bisect.bisect_left(self._terms, term)
+                    if position < len(self._terms) and self._terms[position] == term:
+                        del self._terms[position]
+            for term in new_terms:
+                if term in self._postings.keys():
+                    position = bisect.bisect_left(self._terms, term)
+                    if position == len(self._terms) or self._terms[position] != term:
+                        self._terms.insert(position, term)
+
+    def _idf(self, term: str) -> float:
+        return math.log(1 + len(self._documents) / len(self._postings[term]))
+
+    def _match(self, token: str) -> Dict[str, float]:
+        scores = dict()  # type: Dict[str, float]
+        if token in self._postings.keys():
+            idf = self._idf(token)
+            for key, weight in self._postings[token].items():
+                scores[key] = weight * idf
+        if len(token) < self.MIN_PREFIX:
+            return scores
+        position = bisect.bisect_right(self._terms, token)
+        while position < len(self._terms) and self._terms[position].startswith(token):
+            term = self._terms[position]
+            idf = self._idf(term) * self.PREFIX_FACTOR
+            for key, weight in self._postings[term].items():
+                score = weight * idf
+                if score > scores.get(key, 0.0):
+                    scores[key] = score
+            position += 1
+        return scores
+
+    def search(self, text: str) -> List[Tuple[str, float]]:
+        folded = _fold(text.strip())
+        tokens = [folded] if _is_doi(folded) else tokenize(text)
+        result = None  # type: Optional[Dict[str, float]]
+        for token in dict.fromkeys(tokens):
+            with self._lock:
+                scores = self._match(token)
+            if result is None:
+                result = scores
+            else:
+                result = {key: score + scores[key] for key, score in result.items() if key in scores}
+            if len(result) == 0:
+                break
+        if result is None:
+            return []
+        return sorted(result.items(), key=lambda x: (-x[1], x[0]))
@@ -0,0 +1,245 @@
+import bisect
+import contextlib
+import math
+import time
+
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = dict()  # type: Dict[Tuple[str, ...], object]
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels.keys()) != set(self.labels):
+            raise ValueError(f'Metric {self.name} expects labels: {", ".join(self.labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        for key, value in sorted(self._values.items()):
+            yield '', list(zip(self.labels, key)), value
+
+    def render(self, labels: Sequence[Tuple[str, str]] = ()) -> List[str]:
+        lines = [
+            f'# HELP {self.name} {_escape(self.documentation)}',
+            f'# TYPE {self.name} {self.TYPE}',
+        ]
+        for suffix, sample_labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(list(labels) + sample_labels)} '
+                         f'{_format_value(value)}')
+        return lines
+
+    def clear(self):
+        self._values.clear()
+
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        # for counters maintained elsewhere (e.g. cache statistics)
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key, None)
+        if state is None:
+            # counts per bucket (the last one is +Inf), sum
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        for key, (counts, total) in sorted(self._values.items()):
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', labels + [('le', _format_value(bound))], cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = dict()  # type: Dict[str, Metric]
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics.keys():
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self, extra: Optional[Iterable[Metric]] = None,
+               labels: Sequence[Tuple[str, str]] = ()) -> str:
+        # labels (e.g. of the worker process) are added to all samples
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(labels))
+        for metric in extra or ():
+            lines.extend(metric.render(labels))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'zoteroxy_http_request_duration_seconds', 'Duration of HTTP request handlers',
+    labels=('route', 'method', 'status'),
+))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'zoteroxy_http_requests_in_flight', 'HTTP requests being handled', labels=('route',),
+))
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    'zoteroxy_upstream_request_duration_seconds', 'Duration of Zotero API requests until response headers',
+    labels=('endpoint',),
+))
+UPSTREAM_RESPONSES = REGISTRY.register(Counter(
+    'zoteroxy_upstream_responses_total', 'Zotero API responses by status (error if none received)',
+    labels=('endpoint', 'status'),
+))
+UPSTREAM_TIMEOUTS = REGISTRY.register(Counter(
+    'zoteroxy_upstream_timeouts_total', 'Upstream operations that timed out', labels=('operation',),
+))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    'zoteroxy_upstream_retries_total', 'Retried Zotero API requests', labels=('endpoint',),
+))
+UPSTREAM_THROTTLES = REGISTRY.register(Counter(
+    'zoteroxy_upstream_throttles_total', 'Slowdowns of Zotero API requests requested by the server',
+    labels=('reason',),
+))
+UPSTREAM_CONCURRENCY = REGISTRY.register(Gauge(
+    'zoteroxy_upstream_concurrency_limit', 'Current adaptive limit of concurrent Zotero API requests',
+))
+UPSTREAM_QUEUED = REGISTRY.register(Gauge(
+    'zoteroxy_upstream_queued_requests', 'Zotero API requests waiting for admission',
+))
+SYNC_DURATION = REGISTRY.register(Histogram(
+    'zoteroxy_sync_duration_seconds', 'Duration of library synchronizations with Zotero',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+))
+SNAPSHOT_DURATION = REGISTRY.register(Histogram(
+    'zoteroxy_snapshot_build_duration_seconds', 'Duration of building collection snapshots',
+))
+ITEMS_SERIALIZED = REGISTRY.register(Counter(
+    'zoteroxy_items_serialized_total', 'Library items serialized (unchanged items are reused)',
+))
+ENCODE_DURATION = REGISTRY.register(Histogram(
+    'zoteroxy_encode_duration_seconds', 'Duration of encoding collection responses',
+    labels=('format',),
+))
+FILE_BYTES = REGISTRY.register(Counter(
+    'zoteroxy_file_bytes_served_total', 'Bytes of attachments served from disk or upstream',
+    labels=('source',),
+))
+PREFETCHED_FILES = REGISTRY.register(Counter(
+    'zoteroxy_prefetched_files_total', 'Attachments prefetched to the file cache by result',
+    labels=('result',),
+))
+PREFETCHED_BYTES = REGISTRY.register(Counter(
+    'zoteroxy_prefetched_bytes_total', 'Bytes of attachments prefetched to the file cache',
+))
+LIBRARY_ITEMS = REGISTRY.register(Gauge(
+    'zoteroxy_library_items', 'Library items in the current collection snapshot',
+))
+LIBRARY_VERSION = REGISTRY.register(Gauge(
+    'zoteroxy_library_version', 'Zotero library version of the current collection snapshot',
+))
+
+
+def cache_metrics(stats: Dict[str, dict]) -> List[Metric]:
+    # built from cache statistics when scraped
+    lookups = Counter('zoteroxy_cache_lookups_total', 'Cache lookups by result',
+                      labels=('cache', 'result'))
+    evictions = Counter('zoteroxy_cache_evictions_total', 'Cache entries removed by reason',
+                        labels=('cache', 'reason'))
+    upstream = Counter('zoteroxy_cache_upstream_calls_total', 'Upstream calls made on cache misses',
+                       labels=('cache',))
+    coalesced = Counter('zoteroxy_cache_coalesced_total', 'Cache misses joining a running upstream call',
+                        labels=('cache',))
+    shared = Counter('zoteroxy_cache_shared_hits_total', 'Entries taken from the shared cache backend',
+                     labels=('cache',))
+    entries = Gauge('zoteroxy_cache_entries', 'Entries in the cache', labels=('cache',))
+    size = Gauge('zoteroxy_cache_size_bytes', 'Size of cached files', labels=('cache',))
+    for cache, s in stats.items():
+        for result, field in (('hit', 'hits'), ('miss', 'misses'), ('stale', 'stale_hits')):
+            if field in s.keys():
+                lookups.set(s[field], cache=cache, result=result)
+        for reason, field in (('size', 'evictions'), ('expired', 'expirations')):
+            if field in s.keys():
+                evictions.set(s[field], cache=cache, reason=reason)
+        upstream.set(s['upstream_calls'], cache=cache)
+        coalesced.set(s['coalesced'], cache=cache)
+        shared.set(s['shared_hits'], cache=cache)
+        entries.set(s['entries'], cache=cache)
+        if 'size' in s.keys():
+            size.set(s['size'], cache=cache)
+    return [lookups, evictions, upstream, coalesced, shared, entries, size]
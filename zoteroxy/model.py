@@ -1,14 +1,63 @@
 import datetime
+import sys
 
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from zoteroxy.config import ZoteroxyConfig
 
 
+# values of these fields repeat across the library (shared by interning)
+REPEATED_FIELDS = frozenset([
+    'itemType', 'publicationTitle', 'proceedingsTitle', 'conferenceName', 'journalAbbreviation',
+    'publisher', 'place', 'series', 'language', 'libraryCatalog', 'date', 'contentType',
+    'linkMode', 'charset',
+])
+# only these parts of item payloads from Zotero are used
+PAYLOAD_KEYS = ('key', 'version', 'data')
+
+
+def intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def _share(value: dict, shared: Dict[tuple, dict]) -> dict:
+    key = tuple((k, intern(v)) for k, v in value.items())
+    try:
+        return shared.setdefault(key, dict(key))
+    except TypeError:
+        return value
+
+
+def _enclosure_length(item: dict) -> Optional[int]:
+    enclosure = item.get('links', dict()).get('enclosure', dict())
+    return enclosure.get('length', None)
+
+
+def compact(item: dict, shared: Dict[tuple, dict]) -> dict:
+    # equal creators and tags of different items become the same (read-only) dict
+    data = dict(item.get('data', dict()))
+    for field in REPEATED_FIELDS:
+        if field in data.keys():
+            data[field] = intern(data[field])
+    if 'creators' in data.keys():
+        data['creators'] = [_share(c, shared) for c in data['creators']]
+    if 'tags' in data.keys():
+        data['tags'] = [_share(t, shared) for t in data['tags']]
+    result = {k: item[k] for k in PAYLOAD_KEYS if k in item.keys()}
+    result['data'] = data
+    length = _enclosure_length(item)
+    if length is not None:
+        # file size of attachments
+        result['links'] = {'enclosure': {'length': length}}
+    return result
+
+
 def extract_year(datestr: str) -> Optional[str]:
     for i in range(len(datestr)-3):
         if datestr[i:i+4].isdigit():
-            return datestr[i:i+4]
+            return sys.intern(datestr[i:i+4])
     return None
 
 
@@ -16,20 +65,23 @@ def from_timestamp(timestamp: Optional[str]) -> datetime.datetime:
     try:
         return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S%z')
     except Exception:
-        return datetime.datetime.now()
+        return datetime.datetime.now(datetime.timezone.utc)
 
 
 class Author:
 
+    __slots__ = ('type', 'firstname', 'lastname')
+
     _AUTHOR_TYPES = frozenset(['author', 'presenter'])
     _EDITOR_TYPES = frozenset(['editor'])
 
     def __init__(self, data: dict):
-        self.type = data.get('creatorType', 'author')
-        self.firstname = data.get('firstName', None)
-        self.lastname = data.get('lastName', None)
+        self.type = intern(data.get('creatorType', 'author'))  # type: str
+        self.firstname = intern(data.get('firstName', None))  # type: Optional[str]
+        self.lastname = intern(data.get('lastName', None))  # type: Optional[str]
         if self.firstname is None and self.lastname is None and ' ' in data.get('name', ''):
-            self.firstname, self.lastname = data['name'].split(' ', maxsplit=1)
+            firstname, lastname = data['name'].split(' ', maxsplit=1)
+            self.firstname, self.lastname = intern(firstname), intern(lastname)
 
     def serialize(self):
         return {
@@ -50,20 +102,24 @@ class Author:
 
 class Attachment:
 
+    __slots__ = ('key', 'parent', 'file_hash', 'content_type', 'filename', 'title', 'mtime',
+                 'size', 'created_at', 'updated_at', 'tags')
+
     def __init__(self, item: dict):
         data = item['data']
-        self.key = data.get('key', 'unknown')
+        self.key = data.get('key', 'unknown')  # type: str
         self.parent = data.get('parent', None)  # type: Optional[str]
         if 'parentItem' in data.keys():
             self.parent = data.get('parentItem', None)  # type: Optional[str]
         self.file_hash = data.get('md5', None)  # type: Optional[str]
-        self.content_type = data.get('contentType', 'application/octet-stream')  # type: Optional[str]
+        self.content_type = intern(data.get('contentType', 'application/octet-stream'))  # type: Optional[str]
         self.filename = data.get('filename', self.key)  # type: Optional[str]
         self.title = data.get('title', None)  # type: Optional[str]
         self.mtime = data.get('mtime', None)  # type: Optional[int]
+        self.size = _enclosure_length(item)  # type: Optional[int]
         self.created_at = from_timestamp(data.get('dateAdded', None))  # type: datetime.datetime
         self.updated_at = from_timestamp(data.get('dateModified', None))  # type: datetime.datetime
-        self.tags = [tag['tag'] for tag in data.get('tags', [])]  # type: List[str]
+        self.tags = tuple(intern(tag['tag']) for tag in data.get('tags', []))  # type: Tuple[str, ...]
 
     @staticmethod
     def from_items(items: list):
@@ -73,7 +129,7 @@ class Attachment:
             item_type = data.get('itemType', '')
             if item_type == 'attachment':
                 result.append(Attachment(item))
-        return result
+        return tuple(result)
 
     def serialize(self):
         return {
@@ -86,48 +142,53 @@ class Attachment:
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'content_type': self.content_type,
-            'tags': self.tags,
+            'tags': list(self.tags),
         }
 
 
 class LibraryItem:
 
+    __slots__ = ('key', 'title', 'type', 'date', 'year', 'doi', 'isbn', 'issn', 'publisher', 'pages',
+                 'conference_name', 'proceedings_title', 'publication_title', 'journal_abbreviation',
+                 'url', 'volume', 'series', 'issue', 'created_at', 'updated_at',
+                 'authors', 'attachments', 'tags')
+
     def __init__(self, item: dict):
-        data = self.data = item['data']
+        data = item['data']
         self.key = data.get('key', 'unknown')  # type: str
         self.title = data.get('title', '(no title given)')  # type: str
-        self.type = data.get('itemType', 'unknown')  # type: str
-        self.date = data.get('date', None)  # type: Optional[str]
-        self.year = None
+        self.type = intern(data.get('itemType', 'unknown'))  # type: str
+        self.date = intern(data.get('date', None))  # type: Optional[str]
+        self.year = None  # type: Optional[str]
         if self.date is not None:
             self.year = extract_year(self.date)
         self.doi = data.get('DOI', None)  # type: Optional[str]
         self.isbn = data.get('ISBN', None)  # type: Optional[str]
-        self.issn = data.get('ISSN', None)  # type: Optional[str]
-        self.publisher = data.get('publisher', None)  # type: Optional[str]
+        self.issn = intern(data.get('ISSN', None))  # type: Optional[str]
+        self.publisher = intern(data.get('publisher', None))  # type: Optional[str]
         self.pages = data.get('pages', None)  # type: Optional[str]
-        self.conference_name = data.get('conferenceName', None)  # type: Optional[str]
-        self.proceedings_title = data.get('proceedingsTitle', None)  # type: Optional[str]
-        self.publication_title = data.get('publicationTitle', None)  # type: Optional[str]
-        self.journal_abbreviation = data.get('journalAbbreviation', None)  # type: Optional[str]
+        self.conference_name = intern(data.get('conferenceName', None))  # type: Optional[str]
+        self.proceedings_title = intern(data.get('proceedingsTitle', None))  # type: Optional[str]
+        self.publication_title = intern(data.get('publicationTitle', None))  # type: Optional[str]
+        self.journal_abbreviation = intern(data.get('journalAbbreviation', None))  # type: Optional[str]
         self.url = data.get('url', None)  # type: Optional[str]
         self.volume = data.get('volume', None)  # type: Optional[str]
-        self.series = data.get('series', None)  # type: Optional[str]
+        self.series = intern(data.get('series', None))  # type: Optional[str]
         self.issue = data.get('issue', None)  # type: Optional[str]
         self.created_at = from_timestamp(data.get('dateAdded', None))  # type: datetime.datetime
         self.updated_at = from_timestamp(data.get('dateModified', None))  # type: datetime.datetime
 
-        self.authors = [Author(x) for x in data.get('creators', [])]  # type: List[Author]
-        self.attachments = Attachment.from_items(item.get('children', []))  # type: List[Attachment]
-        self.tags = [tag['tag'] for tag in data.get('tags', [])]  # type: List[str]
+        self.authors = tuple(Author(x) for x in data.get('creators', []))  # type: Tuple[Author, ...]
+        self.attachments = Attachment.from_items(item.get('children', []))  # type: Tuple[Attachment, ...]
+        self.tags = tuple(intern(tag['tag']) for tag in data.get('tags', []))  # type: Tuple[str, ...]
 
 
 class Collection:
 
     def __init__(self, items: List[LibraryItem], config: ZoteroxyConfig):
         self.items = items
-        self.created_at = datetime.datetime.now()
-        self.updated_at = datetime.datetime.now()
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.updated_at = datetime.datetime.now(datetime.timezone.utc)
         if len(items) > 0:
             self.created_at = min(map(lambda x: x.created_at, self.items))
             self.updated_at = max(map(lambda x: x.updated_at, self.items))
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from zoteroxy.cache import Download
+from zoteroxy.config import PrefetchConfig
+from zoteroxy.metrics import PREFETCHED_BYTES, PREFETCHED_FILES
+from zoteroxy.model import Attachment
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileTooLargeError(RuntimeError):
+
+    def __init__(self, max_size: int):
+        super().__init__(f'File is larger than {max_size} bytes')
+        self.max_size = max_size
+
+
+def limit_size(write: Callable[[bytes], None], max_size: int) -> Callable[[bytes], None]:
+    written = 0
+
+    def limited(chunk: bytes):
+        nonlocal written
+        written += len(chunk)
+        if written > max_size:
+            raise FileTooLargeError(max_size)
+        write(chunk)
+    return limited
+
+
+class AttachmentPrefetcher:
+
+    def __init__(self, config: PrefetchConfig, is_cached: Callable[[Attachment], Awaitable[bool]],
+                 has_room: Callable[[Attachment], bool],
+                 download: Callable[[Attachment, int], Download]):
+        self.enabled = config.enabled
+        self.concurrency = max(1, config.concurrency)
+        self.max_size = config.max_size
+        self.bandwidth = config.bandwidth
+        self.content_types = config.content_types
+        self.is_cached = is_cached
+        self.has_room = has_room
+        self.download = download
+        self._pending = None  # type: Optional[List[Attachment]]
+        self._task = None  # type: Optional[asyncio.Future]
+        self._paced_until = 0.0
+
+    def is_allowed(self, attachment: Attachment) -> bool:
+        if attachment.file_hash is None:
+            return False
+        if len(self.content_types) > 0 and attachment.content_type not in self.content_types:
+            return False
+        return self.max_size <= 0 or attachment.size is None or attachment.size <= self.max_size
+
+    def schedule(self, attachments: Iterable[Attachment]):
+        # attachments of a newer library version replace the remaining ones
+        self._pending = [a for a in attachments if self.is_allowed(a)]
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self._pending is not None:
+            attachments, self._pending = self._pending, None
+            queue = iter(attachments)
+
+            async def worker():
+                for attachment in queue:
+                    if self._pending is not None:
+                        return
+                    await self._pace()
+                    if not await self.is_cached(attachment):
+                        if self.has_room(attachment):
+                            await self._fetch(attachment)
+                        else:
+                            PREFETCHED_FILES.inc(result='no_room')
+                    # checks of cached files do not yield to other requests otherwise
+                    await asyncio.sleep(0)
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    async def _pace(self):
+        # one bandwidth budget for all parallel downloads
+        delay = self._paced_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _fetch(self, attachment: Attachment):
+        start = time.monotonic()
+        download = self.download(attachment, self.max_size)
+        try:
+            await asyncio.shield(download.task)
+        except asyncio.CancelledError:
+            if not download.task.cancelled() or asyncio.current_task().cancelling() > 0:
+                raise
+            # downloaded by a client requesting the file meanwhile
+            PREFETCHED_FILES.inc(result='requested')
+            return
+        except FileTooLargeError:
+            PREFETCHED_FILES.inc(result='too_large')
+            return
+        except Exception as e:
+            logger.warning('Prefetching attachment %s failed: %s', attachment.key, e)
+            PREFETCHED_FILES.inc(result='failed')
+            return
+        finally:
+            if self.bandwidth > 0:
+                self._paced_until = max(self._paced_until, start) + download.written / self.bandwidth
+        PREFETCHED_FILES.inc(result='downloaded')
+        PREFETCHED_BYTES.inc(download.written)
+
+    def cancel(self):
+        self._pending = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
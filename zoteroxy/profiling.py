@@ -0,0 +1,129 @@
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import hmac
+import logging
+import os
+import random
+import time
+
+from aiohttp import web
+from typing import Dict, List, Optional
+
+from zoteroxy.config import ProfilingConfig
+
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Zoteroxy-Profile'
+REQUEST_KEY = 'zoteroxy_profile'
+
+_NOT_PROFILED = contextlib.nullcontext()
+_current = contextvars.ContextVar('zoteroxy_profile', default=None)
+
+
+class Phase:
+
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile: 'Profile', name: str):
+        self.profile = profile
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profile.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profile:
+
+    def __init__(self, route: str):
+        self.route = route
+        self.start = time.perf_counter()
+        self.timings = dict()  # type: Dict[str, List[float]]
+
+    def add(self, name: str, duration: float):
+        timing = self.timings.setdefault(name, [0.0, 0])
+        timing[0] += duration
+        timing[1] += 1
+
+    def server_timing(self) -> str:
+        # phases run in order of their first occurrence, repeated ones are summed up
+        entries = [f'{name};dur={1000 * total:.2f}' for name, (total, _) in self.timings.items()]
+        entries.append(f'total;dur={1000 * (time.perf_counter() - self.start):.2f}')
+        return ', '.join(entries)
+
+
+def phase(name: str):
+    profile = _current.get()
+    if profile is None:
+        return _NOT_PROFILED
+    return Phase(profile, name)
+
+
+class Profiler:
+
+    def __init__(self, config: ProfilingConfig):
+        self.enabled = config.enabled
+        self.token = config.token
+        self.sample_rate = config.sample_rate
+        self.directory = config.directory
+        self._sampling = False
+
+    @property
+    def is_active(self) -> bool:
+        return self.enabled or bool(self.token)
+
+    def _requested(self, request: web.Request) -> bool:
+        value = request.headers.get(HEADER, None)
+        return bool(self.token) and value is not None and hmac.compare_digest(value, self.token)
+
+    def _dump(self, profiler: cProfile.Profile, route: str):
+        timestamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        path = self.directory / f'{timestamp}-{route}-{os.getpid()}.prof'
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(path))
+        except OSError as e:
+            logger.warning('Writing profile failed: %s', e)
+
+    @contextlib.contextmanager
+    def _profile(self, request: web.Request, route: str, sample: bool):
+        profile = Profile(route)
+        request[REQUEST_KEY] = profile
+        token = _current.set(profile)
+        profiler = None  # type: Optional[cProfile.Profile]
+        # only one profiler can be active, it also records concurrently handled requests
+        if sample and not self._sampling:
+            self._sampling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield profile
+        finally:
+            _current.reset(token)
+            if profiler is not None:
+                profiler.disable()
+                self._sampling = False
+                self._dump(profiler, route)
+
+    def profile(self, request: web.Request, route: str):
+        if not self.is_active:
+            return _NOT_PROFILED
+        if self._requested(request):
+            return self._profile(request, route, sample=True)
+        if self.enabled:
+            return self._profile(request, route, sample=random.random() < self.sample_rate)
+        return _NOT_PROFILED
+
+
+async def server_timing(request: web.Request, response: web.StreamResponse):
+    profile = request.get(REQUEST_KEY, None)
+    if profile is not None:
+        response.headers['Server-Timing'] = profile.server_timing()
@@ -0,0 +1,131 @@
+import asyncio
+import contextvars
+import datetime
+import math
+import os
+import pathlib
+
+from aiohttp import web
+from typing import AsyncIterator, Iterable, Optional, Tuple
+
+from zoteroxy.consts import CHUNK_SIZE
+from zoteroxy.metrics import FILE_BYTES
+
+
+class AttachmentResponse(web.StreamResponse):
+
+    def __init__(self, path: pathlib.Path, etag: Optional[str],
+                 last_modified: Optional[datetime.datetime],
+                 content_type: str, headers: Optional[dict] = None):
+        super().__init__(headers=headers)
+        self._path = path
+        self._etag = etag
+        self._last_modified = last_modified
+        self.content_type = content_type
+
+    def _range_allowed(self, request: web.BaseRequest) -> bool:
+        if_range = request.headers.get('If-Range', None)
+        if if_range is None:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            # weak validators never match (RFC 7233, section 3.2)
+            return self._etag is not None and if_range == f'"{self._etag}"'
+        since = request.if_range
+        return since is not None and self._last_modified is not None \
+            and math.ceil(self._last_modified.timestamp()) <= since.timestamp()
+
+    def _byte_range(self, request: web.BaseRequest, size: int) -> Optional[Tuple[int, int]]:
+        if not self._range_allowed(request):
+            return None
+        rng = request.http_range
+        start, end = rng.start, rng.stop
+        if start is None:
+            return None
+        if start < 0 and end is None:
+            start = max(start + size, 0)
+            end = size
+        else:
+            end = size if end is None else min(end, size)
+        return start, end - start
+
+    async def _sendfile(self, request: web.BaseRequest, fobj, offset: int, count: int):
+        loop = asyncio.get_running_loop()
+        transport = request.transport
+        if transport is None:
+            raise ConnectionResetError('Connection lost')
+        try:
+            await loop.sendfile(transport, fobj, offset, count)
+        except NotImplementedError:
+            fobj.seek(offset)
+            while count > 0:
+                chunk = await loop.run_in_executor(None, fobj.read, min(CHUNK_SIZE, count))
+                if not chunk:
+                    break
+                await self.write(chunk)
+                count -= len(chunk)
+
+    async def prepare(self, request: web.BaseRequest):
+        if self.prepared:
+            # prepared by the handler already, aiohttp prepares returned responses again
+            return await super().prepare(request)
+        with open(self._path, mode='rb') as fobj:
+            size = os.fstat(fobj.fileno()).st_size
+            self.headers['Accept-Ranges'] = 'bytes'
+            if self._etag is not None:
+                self.etag = self._etag
+            if self._last_modified is not None:
+                self.last_modified = self._last_modified.astimezone(datetime.timezone.utc)
+            offset, count = 0, size
+            try:
+                byte_range = self._byte_range(request, size)
+            except ValueError:
+                # multiple ranges, other units and invalid ranges are ignored (RFC 7233, section 3.1)
+                byte_range = None
+            if byte_range is not None:
+                offset, count = byte_range
+                if offset >= size:
+                    self.set_status(416)
+                    self.headers['Content-Range'] = f'bytes */{size}'
+                    self.content_length = 0
+                    return await super().prepare(request)
+                self.set_status(206)
+                self.headers['Content-Range'] = f'bytes {offset}-{offset + count - 1}/{size}'
+            self.content_length = count
+            writer = await super().prepare(request)
+            if count > 0 and request.method != 'HEAD':
+                await self._sendfile(request, fobj, offset, count)
+                FILE_BYTES.inc(count, source='disk')
+            await self.write_eof()
+            return writer
+
+
+async def stream_response(request: web.Request, response: web.StreamResponse,
+                          chunks: AsyncIterator[bytes]) -> web.StreamResponse:
+    # first chunk is awaited before sending headers so upstream errors map to HTTP errors
+    first = b''
+    async for first in chunks:
+        break
+    await response.prepare(request)
+    await response.write(first)
+    async for chunk in chunks:
+        await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+async def iterate(chunks: Iterable[bytes]) -> AsyncIterator[bytes]:
+    # chunks are encoded (and compressed) in a thread so other requests are served meanwhile
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    chunks = iter(chunks)
+    while True:
+        chunk = await loop.run_in_executor(None, context.run, next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def count_bytes(chunks: AsyncIterator[bytes], source: str) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        FILE_BYTES.inc(len(chunk), source=source)
+        yield chunk
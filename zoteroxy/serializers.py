@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from zoteroxy.model import Collection, LibraryItem
 
@@ -95,8 +95,9 @@ class BibTexSerializer(BaseSerializer):
         return cls._TYPES.get(item.type, cls._DEFAULT_TYPE)
 
     @classmethod
-    def create_bib_str(cls, item: LibraryItem) -> str:
-        pairs = cls.build_pairs(item)
+    def create_bib_str(cls, item: LibraryItem, pairs: Optional[dict] = None) -> str:
+        if pairs is None:
+            pairs = cls.build_pairs(item)
         bibtype = cls.guess_bib_type(item)
         key = item.key
         lines = '\n'.join((f'{key} = "{value}"' for key, value in pairs.items()))
@@ -107,8 +108,9 @@ class BibTexSerializer(BaseSerializer):
         return {'bib': cls.create_bib_str(item)}
 
     @classmethod
-    def serialize_collection(cls, collection: Collection) -> dict:
-        bibs = [cls.serialize_item(item)['bib'] for item in collection.items]
+    def serialize_collection(cls, collection: Collection, bibs: Optional[List[str]] = None) -> dict:
+        if bibs is None:
+            bibs = [cls.serialize_item(item)['bib'] for item in collection.items]
         collection = ',\n'.join(bibs)
         return {
             'total_items': len(bibs),
@@ -125,13 +127,16 @@ class BibJSONSerializer(BaseSerializer):
     ])
 
     @classmethod
-    def serialize_item(cls, item: LibraryItem, collection: Optional[str] = None) -> dict:
+    def serialize_item(cls, item: LibraryItem, collection: Optional[str] = None,
+                       pairs: Optional[dict] = None) -> dict:
+        if pairs is None:
+            pairs = BibTexSerializer.build_pairs(item)
         record = {
             'type': BibTexSerializer.guess_bib_type(item),
             'id': item.key,
-            '_bib': BibTexSerializer.create_bib_str(item),
+            '_bib': BibTexSerializer.create_bib_str(item, pairs=pairs),
         }
-        for k, v in BibTexSerializer.build_pairs(item).items():
+        for k, v in pairs.items():
             if k not in cls.CUSTOM_FIELDS:
                 record[k] = v
         record['author'] = []
@@ -174,9 +179,10 @@ class BibJSONSerializer(BaseSerializer):
         return {k: v for k, v in record.items() if v is not None}
 
     @classmethod
-    def serialize_collection(cls, collection: Collection) -> dict:
-        records = [cls.serialize_item(item, collection=collection.identifier)
-                   for item in collection.items]
+    def serialize_collection(cls, collection: Collection, records: Optional[List[dict]] = None) -> dict:
+        if records is None:
+            records = [cls.serialize_item(item, collection=collection.identifier)
+                       for item in collection.items]
         return {
             'metadata': {
                 'collection': collection.identifier,
@@ -194,10 +200,17 @@ class BibJSONSerializer(BaseSerializer):
 
 class ZoteroxySerializer(BaseSerializer):
 
+    FIELDS = frozenset([
+        'key', 'title', 'type', 'date', 'year', 'doi', 'isbn', 'issn', 'publisher', 'pages',
+        'conferenceName', 'proceedingsTitle', 'publicationTitle', 'journalAbbreviation',
+        'url', 'volume', 'series', 'issue', 'authors', 'attachments', 'tags', 'bibtex', 'bibjson',
+    ])
+
     @classmethod
-    def serialize_item(cls, item: LibraryItem) -> dict:
+    def serialize_item(cls, item: LibraryItem, bibjson: Optional[dict] = None) -> dict:
+        if bibjson is None:
+            bibjson = BibJSONSerializer.serialize_item(item)
         return {
-            # 'data': item.data,
             'key': item.key,
             'title': item.title,
             'type': item.type,
@@ -218,14 +231,16 @@ class ZoteroxySerializer(BaseSerializer):
             'issue': item.issue,
             'authors': [a.serialize() for a in item.authors],
             'attachments': [a.serialize() for a in item.attachments],
-            'tags': item.tags,
-            'bibtex': BibTexSerializer.create_bib_str(item),
-            'bibjson': BibJSONSerializer.serialize_item(item)
+            'tags': list(item.tags),
+            'bibtex': bibjson['_bib'],
+            'bibjson': bibjson
         }
 
     @classmethod
-    def serialize_collection(cls, collection: Collection) -> dict:
+    def serialize_collection(cls, collection: Collection, items: Optional[List[dict]] = None) -> dict:
+        if items is None:
+            items = [cls.serialize_item(item) for item in collection.items]
         return {
             'total_items': len(collection.items),
-            'items': [cls.serialize_item(item) for item in collection.items]
+            'items': items
         }
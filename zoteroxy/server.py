@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from aiohttp import web
+from typing import Dict, List, Optional
+
+from zoteroxy.app import init_func
+from zoteroxy.config import ZoteroxyConfigParser
+from zoteroxy.consts import APPNAME, DESCRIPTION, ENV_CONFIG, VERSION
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # new server can bind the port while the old one is still draining
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+async def _watch_supervisor(app: web.Application):
+    supervisor = os.getppid()
+
+    async def watch():
+        while os.getppid() == supervisor:
+            await asyncio.sleep(1)
+        logger.warning('Supervisor is gone, shutting down')
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    app['supervisor_watch'] = asyncio.ensure_future(watch())
+
+
+async def _stop_watching(app: web.Application):
+    app['supervisor_watch'].cancel()
+
+
+class Worker:
+
+    def __init__(self, pid: int, generation: int):
+        self.pid = pid
+        self.generation = generation
+        self.started_at = time.monotonic()
+
+    @property
+    def uptime(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+class Supervisor:
+
+    SIGNALS = [signal.SIGHUP, signal.SIGINT, signal.SIGTERM]
+    POLL_INTERVAL = 0.2
+    RESTART_DELAY = 1.0
+    MAX_RESTART_DELAY = 30.0
+    MIN_UPTIME = 5.0
+    KILL_DELAY = 5.0
+
+    def __init__(self, sock: socket.socket, workers: int, graceful_timeout: float,
+                 overlap: bool = True):
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.overlap = overlap
+        self.children = dict()  # type: Dict[int, Worker]
+        self.generation = 0
+        self.restarts = 0
+        self._signals = []  # type: List[int]
+        self._stop_deadline = None  # type: Optional[float]
+        self._restart_delay = self.RESTART_DELAY
+        self._next_restart = 0.0
+
+    def _signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _run_worker(self):
+        for signum in self.SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        app = init_func([])
+        app.on_startup.append(_watch_supervisor)
+        app.on_cleanup.append(_stop_watching)
+        web.run_app(app, sock=self.sock, shutdown_timeout=self.graceful_timeout, print=None)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker()
+            except BaseException:
+                logger.exception('Worker %d failed', os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = Worker(pid, self.generation)
+        logger.info('Started worker %d', pid)
+
+    def _missing(self) -> int:
+        current = [w for w in self.children.values() if w.generation == self.generation]
+        if not self.overlap and len(current) < len(self.children):
+            # old workers must exit first
+            return 0
+        return self.workers - len(current)
+
+    def _kill(self, sig: int, generation: Optional[int] = None):
+        for worker in list(self.children.values()):
+            if generation is None or worker.generation == generation:
+                try:
+                    os.kill(worker.pid, sig)
+                except ProcessLookupError:
+                    pass
+
+    def _reap(self):
+        while len(self.children) > 0:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            worker = self.children.pop(pid, None)
+            if worker is None or self._stop_deadline is not None \
+                    or worker.generation != self.generation:
+                continue
+            logger.warning('Worker %d exited unexpectedly (status %d)', pid, status)
+            self.restarts += 1
+            # back off when workers keep crashing right after start
+            if worker.uptime < self.MIN_UPTIME:
+                self._restart_delay = min(self._restart_delay * 2, self.MAX_RESTART_DELAY)
+            else:
+                self._restart_delay = self.RESTART_DELAY
+            self._next_restart = time.monotonic() + self._restart_delay
+
+    def reload(self):
+        # new workers start accepting before the old ones drain, unless they
+        # cannot share the cache and are started once the old ones exit
+        old = self.generation
+        self.generation += 1
+        logger.info('Reloading workers')
+        while self._missing() > 0:
+            self._spawn()
+        self._kill(signal.SIGTERM, generation=old)
+
+    def stop(self):
+        if self._stop_deadline is None:
+            logger.info('Stopping workers')
+            self._stop_deadline = time.monotonic() + self.graceful_timeout + self.KILL_DELAY
+            self._kill(signal.SIGTERM)
+
+    def run(self):
+        for signum in self.SIGNALS:
+            signal.signal(signum, self._signal)
+        for _ in range(self.workers):
+            self._spawn()
+        while self._stop_deadline is None or len(self.children) > 0:
+            while len(self._signals) > 0:
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP and self._stop_deadline is None:
+                    self.reload()
+                elif signum in (signal.SIGINT, signal.SIGTERM):
+                    self.stop()
+            self._reap()
+            if self._stop_deadline is None:
+                if self._missing() > 0 and time.monotonic() >= self._next_restart:
+                    self._spawn()
+            elif time.monotonic() > self._stop_deadline:
+                logger.warning('Killing workers that did not stop in time')
+                self._kill(signal.SIGKILL)
+                self._stop_deadline = time.monotonic() + self.KILL_DELAY
+            time.sleep(self.POLL_INTERVAL)
+        logger.info('Stopped')
+
+
+def serve(args: argparse.Namespace) -> int:
+    if args.config is not None:
+        os.environ[ENV_CONFIG] = args.config
+    if os.getenv(ENV_CONFIG) is None:
+        print('Missing configuration file!', file=sys.stderr)
+        return 1
+    with open(os.environ[ENV_CONFIG]) as f:
+        config = ZoteroxyConfigParser().parse_file(f)
+    # file cache directory can be used by several processes only with a shared backend
+    shared = config.settings.cache_backend != 'memory'
+    if args.workers > 1 and not shared:
+        print('Multiple workers require the sqlite cache backend!', file=sys.stderr)
+        return 1
+    sock = create_socket(args.host, args.port)
+    logger.info('%s %s listening on %s:%d with %d workers',
+                APPNAME, VERSION, args.host, args.port, args.workers)
+    Supervisor(sock, workers=args.workers, graceful_timeout=args.graceful_timeout,
+               overlap=shared).run()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog=APPNAME.lower(), description=DESCRIPTION)
+    parser.add_argument('--version', action='version', version=f'{APPNAME} {VERSION}')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='run the proxy in pre-forked worker processes')
+    serve_parser.add_argument('-c', '--config', default=None,
+                              help=f'configuration file (default: ${ENV_CONFIG})')
+    serve_parser.add_argument('-H', '--host', default='0.0.0.0')
+    serve_parser.add_argument('-P', '--port', type=int, default=8080)
+    serve_parser.add_argument('-w', '--workers', type=int, default=1)
+    serve_parser.add_argument('--graceful-timeout', type=float, default=30,
+                              help='seconds for workers to finish requests when stopping')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s')
+    if args.command == 'serve':
+        sys.exit(serve(args))
@@ -0,0 +1,287 @@
+import asyncio
+import contextvars
+import datetime
+import hashlib
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from zoteroxy.bibliography import Bibliography, STYLES
+from zoteroxy.compression import Compressor, IDENTITY, SUFFIXES
+from zoteroxy.consts import VERSION
+from zoteroxy.encoders import dumps, iter_bibtex, iter_json
+from zoteroxy.index import CollectionIndex, CollectionQuery, SearchIndex
+from zoteroxy.metrics import ENCODE_DURATION, ITEMS_SERIALIZED
+from zoteroxy.model import Collection, LibraryItem
+from zoteroxy.profiling import phase
+from zoteroxy.serializers import BibJSONSerializer, BibTexSerializer, ZoteroxySerializer
+
+
+class ItemSnapshot:
+
+    ZOTEROXY = 'zoteroxy'
+    BIBJSON = 'bibjson'
+    BIBTEX = 'bibtex'
+
+    def __init__(self, item: LibraryItem, collection_id: str):
+        self.item = item
+        pairs = BibTexSerializer.build_pairs(item)
+        self.bibjson = BibJSONSerializer.serialize_item(item, pairs=pairs)
+        self.bib = self.bibjson['_bib']
+        self.record = dict(self.bibjson, collection=collection_id)
+        self.zoteroxy = ZoteroxySerializer.serialize_item(item, bibjson=self.bibjson)
+        self._bodies = None  # type: Optional[Dict[str, bytes]]
+
+    def serialize(self, fmt: str) -> dict:
+        if fmt == self.ZOTEROXY:
+            return self.zoteroxy
+        elif fmt == self.BIBJSON:
+            return self.record
+        elif fmt == self.BIBTEX:
+            return {'bib': self.bib}
+        raise ValueError(f'Unknown format: {fmt}')
+
+    def body(self, fmt: str) -> bytes:
+        # only items requested individually keep their encoded bodies
+        if self._bodies is None:
+            self._bodies = dict()
+        if fmt not in self._bodies.keys():
+            if fmt == self.BIBTEX:
+                # BibTeX text as in collections
+                self._bodies[fmt] = f'{self.bib}\n'.encode('utf-8')
+            else:
+                self._bodies[fmt] = dumps(self.serialize(fmt))
+        return self._bodies[fmt]
+
+    def etag(self, fmt: str) -> str:
+        return f'{fmt}-{hashlib.md5(self.body(fmt)).hexdigest()}'
+
+    @property
+    def last_modified(self) -> datetime.datetime:
+        # attachments are part of the item
+        return max([self.item.updated_at] + [a.updated_at for a in self.item.attachments])
+
+
+class CollectionSnapshot:
+
+    ZOTEROXY = ItemSnapshot.ZOTEROXY
+    BIBJSON = ItemSnapshot.BIBJSON
+    BIBTEX = ItemSnapshot.BIBTEX
+
+    CONTENT_TYPES = {
+        ZOTEROXY: 'application/json',
+        BIBJSON: 'application/json',
+        BIBTEX: 'application/x-bibtex',
+    }
+
+    def __init__(self, version: Optional[int], collection: Collection, compressor: Compressor,
+                 search: Optional[SearchIndex] = None, stream_min_items: Optional[int] = None,
+                 previous: Optional['CollectionSnapshot'] = None,
+                 modified_at: Optional[datetime.datetime] = None):
+        self.version = version
+        self.modified_at = modified_at or datetime.datetime.now(datetime.timezone.utc)
+        self.collection = collection
+        self.compressor = compressor
+        self.search = search
+        self.stream_min_items = stream_min_items
+        self.items = dict()  # type: Dict[str, ItemSnapshot]
+        for item in collection.items:
+            # serializations of unchanged items are kept from the previous version
+            reused = previous.items.get(item.key, None) if previous is not None else None
+            if reused is None or reused.item is not item:
+                reused = ItemSnapshot(item, collection.identifier)
+                ITEMS_SERIALIZED.inc()
+            self.items[item.key] = reused
+        self._ordered = [self.items[item.key] for item in collection.items]  # type: List[ItemSnapshot]
+        self.positions = {item.key: i for i, item in enumerate(collection.items)}  # type: Dict[str, int]
+        self._bodies = dict()  # type: Dict[Tuple[str, str], bytes]
+        self._encoding = dict()  # type: Dict[Tuple[str, str], asyncio.Future]
+        self._etags = dict()  # type: Dict[str, str]
+        self._index = None  # type: Optional[CollectionIndex]
+        self._bibliographies = dict()  # type: Dict[str, Bibliography]
+        self._fingerprint = None  # type: Optional[str]
+
+    @property
+    def index(self) -> CollectionIndex:
+        if self._index is None:
+            self._index = CollectionIndex(item.item for item in self._ordered)
+        return self._index
+
+    def serialize(self, fmt: str) -> dict:
+        if fmt == self.ZOTEROXY:
+            return ZoteroxySerializer.serialize_collection(
+                self.collection, items=[i.zoteroxy for i in self._ordered]
+            )
+        elif fmt == self.BIBJSON:
+            return BibJSONSerializer.serialize_collection(
+                self.collection, records=[i.record for i in self._ordered]
+            )
+        raise ValueError(f'Unknown format: {fmt}')
+
+    def _select(self, query: CollectionQuery) -> List[int]:
+        if query.search is None:
+            return self.index.select(query)
+        if self.search is None:
+            raise ValueError('Search is not available')
+        selected = self.index.filter(query)
+        ranked = sorted(
+            (-score, self.positions[key])
+            for key, score in self.search.search(query.search)
+            if key in self.positions.keys()
+        )
+        return [p for _, p in ranked if selected is None or p in selected]
+
+    def _page(self, fmt: str, query: CollectionQuery) -> Tuple[int, List[ItemSnapshot]]:
+        if query.fields is not None:
+            if fmt != self.ZOTEROXY:
+                raise ValueError('Fields can be selected only for Zoteroxy format')
+            unknown = set(query.fields) - ZoteroxySerializer.FIELDS
+            if len(unknown) > 0:
+                raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        positions = self._select(query)
+        return len(positions), [self._ordered[position] for position in query.page(positions)]
+
+    def query(self, fmt: str, query: CollectionQuery) -> dict:
+        total, page = self._page(fmt, query)
+        result = self._serialize_items(fmt, page, query.fields)
+        result['total_items'] = total
+        result['offset'] = query.offset
+        result['limit'] = query.limit
+        return result
+
+    def streams(self, query: Optional[CollectionQuery] = None) -> bool:
+        if self.stream_min_items is None or len(self._ordered) < self.stream_min_items:
+            return False
+        return query is None or query.limit is None or query.limit >= self.stream_min_items
+
+    def chunks(self, fmt: str, query: Optional[CollectionQuery] = None) -> Iterator[bytes]:
+        # the query is evaluated now, only encoding of the items is deferred
+        if fmt == self.BIBTEX:
+            items = self._ordered if query is None else self._page(fmt, query)[1]
+            return iter_bibtex(i.bib for i in items)
+        if query is None:
+            return iter_json(self.serialize(fmt))
+        return iter_json(self.query(fmt, query))
+
+    def encode(self, fmt: str, query: Optional[CollectionQuery] = None) -> bytes:
+        with ENCODE_DURATION.time(format=fmt), phase('encode'):
+            if fmt == self.BIBTEX:
+                return b''.join(self.chunks(fmt, query))
+            if query is None:
+                return dumps(self.serialize(fmt))
+            return dumps(self.query(fmt, query))
+
+    def _serialize_items(self, fmt: str, items: List[ItemSnapshot],
+                         fields: Optional[List[str]] = None) -> dict:
+        if fmt == self.ZOTEROXY:
+            serialized = [i.zoteroxy for i in items]
+            if fields is not None:
+                serialized = [{field: item[field] for field in fields} for item in serialized]
+            return ZoteroxySerializer.serialize_collection(self.collection, items=serialized)
+        elif fmt == self.BIBJSON:
+            return BibJSONSerializer.serialize_collection(
+                self.collection, records=[i.record for i in items]
+            )
+        elif fmt == self.BIBTEX:
+            return BibTexSerializer.serialize_collection(
+                self.collection, bibs=[i.bib for i in items]
+            )
+        raise ValueError(f'Unknown format: {fmt}')
+
+    def lookup(self, fmt: str, keys: List[str]) -> dict:
+        keys = list(dict.fromkeys(keys))
+        found = [self.items[k] for k in keys if k in self.items.keys()]
+        result = self._serialize_items(fmt, found)
+        result['total_items'] = len(found)
+        result['missing'] = [k for k in keys if k not in self.items.keys()]
+        return result
+
+    def bibliography(self, style: str, query: CollectionQuery) -> dict:
+        if style not in STYLES.keys():
+            raise ValueError(f'Unknown style: {style}')
+        if query.fields is not None:
+            raise ValueError('Fields cannot be selected for bibliography')
+        if style not in self._bibliographies.keys():
+            self._bibliographies[style] = Bibliography(STYLES[style], [i.item for i in self._ordered])
+        bibliography = self._bibliographies[style]
+        positions = bibliography.order
+        if query.is_filtered:
+            selected = set(self._select(query))
+            positions = [p for p in positions if p in selected]
+        page = query.page(positions)
+        return {
+            'style': style,
+            'total_items': len(positions),
+            'offset': query.offset,
+            'limit': query.limit,
+            'keys': [self._ordered[p].item.key for p in page],
+            'html': bibliography.render(page),
+        }
+
+    def query_etag(self, fmt: str, query: CollectionQuery) -> str:
+        # known without evaluating the query
+        digest = hashlib.md5(f'{self.fingerprint}?{query.canonical}'.encode('utf-8')).hexdigest()
+        return f'{fmt}-{digest}'
+
+    def bibliography_etag(self, style: str, query: CollectionQuery) -> str:
+        digest = hashlib.md5(f'{self.fingerprint}|{style}?{query.canonical}'.encode('utf-8')).hexdigest()
+        return f'{style}-{digest}'
+
+    def encoding(self, fmt: str, accept_encoding: str) -> str:
+        if self.streams():
+            return self.compressor.negotiate(accept_encoding)
+        if not self.compressor.should_compress(self.body(fmt)):
+            return IDENTITY
+        return self.compressor.negotiate(accept_encoding)
+
+    def body(self, fmt: str, encoding: str = IDENTITY) -> bytes:
+        if (fmt, encoding) not in self._bodies.keys():
+            if encoding == IDENTITY:
+                body = self.encode(fmt)
+            else:
+                body = self.compressor.compress(self.body(fmt), encoding)
+            self._bodies[(fmt, encoding)] = body
+        return self._bodies[(fmt, encoding)]
+
+    async def encoded(self, fmt: str, encoding: str = IDENTITY) -> bytes:
+        # encoded and compressed in a thread once, concurrent requests wait for it
+        key = (fmt, encoding)
+        if key in self._bodies.keys():
+            return self._bodies[key]
+        if key not in self._encoding.keys():
+            loop = asyncio.get_running_loop()
+            self._encoding[key] = loop.run_in_executor(
+                None, contextvars.copy_context().run, self.body, fmt, encoding
+            )
+            self._encoding[key].add_done_callback(lambda _: self._encoding.pop(key, None))
+        return await asyncio.shield(self._encoding[key])
+
+    @property
+    def fingerprint(self) -> str:
+        # items do not change within a library version, so streamed content
+        # is identified without being encoded
+        if self._fingerprint is None:
+            c = self.collection
+            digest = hashlib.md5(
+                f'{VERSION}|{self.version}|{c.identifier}|{c.name}|{c.owner}|{c.description}|{c.base_url}'
+                .encode('utf-8')
+            )
+            for item in self._ordered:
+                digest.update(f'|{item.item.key}'.encode('utf-8'))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def etag(self, fmt: str, encoding: str = IDENTITY) -> str:
+        if fmt not in self._etags.keys():
+            if self.streams():
+                digest = self.fingerprint
+            else:
+                digest = hashlib.md5(self.body(fmt)).hexdigest()
+            self._etags[fmt] = f'{fmt}-{digest}'
+        if encoding == IDENTITY:
+            return self._etags[fmt]
+        return f'{self._etags[fmt]}-{SUFFIXES[encoding]}'
+
+    @property
+    def last_modified(self) -> datetime.datetime:
+        # dates of items do not change when items are deleted or untagged
+        return self.modified_at
@@ -1,30 +1,30 @@
-const Cite = require('citation-js');
+const PAGE_SIZE = 100;
 
-function showCollection(endpoint, $elem) {
+function showBibliography(endpoint, style, offset) {
     jQuery.ajax({
-        url: `${endpoint}/collection`,
+        url: `${endpoint}/bibliography`,
         method: 'GET',
         dataType: 'json',
-        headers : {
-            Accept: 'application/json'
+        data: {
+            style: style,
+            offset: offset,
+            limit: PAGE_SIZE,
         },
         success: (data) => {
-            console.log(data);
-            const cites = data.items.map((item) => new Cite(item.bibjson));
-            jQuery("#refs").empty();
-            cites.forEach((c) => {
-                const html = c.format('bibliography', {
-                      format: 'html',
-                      template: 'apa',
-                });
-                jQuery("#refs").append(
-                    jQuery.parseHTML(html)
-                );
-            });
+            jQuery("#loader").remove();
+            jQuery("#refs").append(
+                jQuery.parseHTML(data.html)
+            );
+            const next = data.offset + data.keys.length;
+            jQuery("#more")
+                .toggleClass("d-none", next >= data.total_items)
+                .off("click")
+                .on("click", () => showBibliography(endpoint, style, next));
         },
         error: () => {
             console.log("Error");
             jQuery("#refs").empty();
+            jQuery("#more").addClass("d-none");
             jQuery("#refs").append(
                 jQuery("<div>").addClass("alert alert-danger").text("Failed to retrieve collection items...")
             );
@@ -34,5 +34,6 @@ function showCollection(endpoint, $elem) {
 
 jQuery(document).ready(() => {
     const endpoint = jQuery("#refs").data('endpoint');
-    showCollection(endpoint, this);
+    const style = jQuery("#refs").data('style');
+    showBibliography(endpoint, style, 0);
 });
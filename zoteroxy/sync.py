@@ -0,0 +1,137 @@
+import datetime
+
+from typing import Callable, Dict, Iterable, List, Optional
+
+from zoteroxy.client import ZoteroClient
+from zoteroxy.model import compact
+
+
+class LibrarySync:
+
+    def __init__(self, client: ZoteroClient, tags: Iterable[str],
+                 tags_allowed: Callable[[Iterable[str]], bool]):
+        self.client = client
+        self.tags = list(tags)
+        self.tags_allowed = tags_allowed
+        self.items = dict()  # type: Dict[str, dict]
+        self.version = None  # type: Optional[int]
+        # when a new library version was first synchronized (deletions have no date)
+        self.modified_at = None  # type: Optional[datetime.datetime]
+        self._shared = dict()  # type: Dict[tuple, dict]
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    @staticmethod
+    def _is_valid(item: dict) -> bool:
+        data = item.get('data', dict())
+        return item.get('key', None) is not None and data.get('itemType', None) is not None
+
+    def _is_published(self, item: dict) -> bool:
+        data = item['data']
+        if data.get('deleted', False):
+            return False
+        return self.tags_allowed(tag['tag'] for tag in data.get('tags', []))
+
+    def _link(self, item: dict):
+        parent_key = item['data'].get('parentItem', None)
+        if parent_key is not None and parent_key in self.items.keys():
+            self.items[parent_key]['children'].append(item)
+
+    def _unlink(self, item: dict):
+        parent_key = item['data'].get('parentItem', None)
+        if parent_key is not None and parent_key in self.items.keys():
+            parent = self.items[parent_key]
+            parent['children'] = [c for c in parent['children'] if c['key'] != item['key']]
+
+    def _remove(self, key: str):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self._unlink(item)
+
+    def _full(self, items_list: List[dict]):
+        self.items = dict()
+        self._shared = dict()
+        for item in items_list:
+            if not self._is_valid(item):
+                continue
+            item = compact(item, self._shared)
+            self.items[item['key']] = item
+            item['children'] = list()
+        for item in self.items.values():
+            self._link(item)
+
+    def _patch(self, changed: List[dict], deleted: List[str]):
+        for key in deleted:
+            self._remove(key)
+        updated = dict()  # type: Dict[str, dict]
+        added = set()
+        for item in changed:
+            if not self._is_valid(item):
+                continue
+            item = compact(item, self._shared)
+            key = item['key']
+            previous = self.items.get(key, None)
+            if previous is not None:
+                self._unlink(previous)
+            if not self._is_published(item):
+                self.items.pop(key, None)
+                continue
+            if previous is not None:
+                item['children'] = previous['children']
+            else:
+                item['children'] = list()
+                added.add(key)
+            self.items[key] = item
+            updated[key] = item
+        for item in updated.values():
+            self._link(item)
+        if len(added) > 0:
+            # adopt already known children of newly published parents
+            for key, item in self.items.items():
+                if key not in updated and item['data'].get('parentItem', None) in added:
+                    self._link(item)
+
+    async def sync(self) -> Dict[str, dict]:
+        if self.version is None:
+            items_list, version = await self.client.items(tags=self.tags)
+            self._full(items_list)
+            self.version = version
+            self.modified_at = self._now()
+            return self.items
+        changed, version = await self.client.items(since=self.version)
+        if changed is None:
+            return self.items
+        deleted, _ = await self.client.deleted(since=self.version)
+        self._patch(changed, deleted)
+        if version != self.version:
+            self.modified_at = self._now()
+        self.version = version
+        return self.items
+
+    def dump(self) -> dict:
+        # children are restored from parentItem links
+        return {
+            'version': self.version,
+            'modified_at': self.modified_at.timestamp() if self.modified_at is not None else None,
+            'items': [
+                {k: v for k, v in item.items() if k != 'children'}
+                for item in self.items.values()
+            ],
+        }
+
+    def restore(self, state: dict):
+        self._full(state['items'])
+        self.version = state['version']
+        modified_at = state.get('modified_at', None)
+        if modified_at is None:
+            self.modified_at = self._now()
+        else:
+            self.modified_at = datetime.datetime.fromtimestamp(modified_at, datetime.timezone.utc)
+
+    def reset(self):
+        self.items = dict()
+        self.version = None
+        self.modified_at = None
+        self._shared = dict()
@@ -0,0 +1,88 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from zoteroxy.config import UpstreamConfig, UpstreamOperationConfig
+from zoteroxy.metrics import UPSTREAM_TIMEOUTS
+
+
+class UpstreamError(Exception):
+
+    def __init__(self, operation: str, message: str):
+        super().__init__(f'Upstream {operation} operation failed: {message}')
+        self.operation = operation
+
+
+class UpstreamTimeoutError(UpstreamError):
+
+    def __init__(self, operation: str, timeout: float):
+        super().__init__(operation, f'timed out after {timeout} seconds')
+        self.timeout = timeout
+
+
+class UpstreamOperation:
+
+    def __init__(self, name: str, config: UpstreamOperationConfig):
+        self.name = name
+        self.concurrency = config.concurrency
+        self.timeout = config.timeout
+        self._semaphore = None  # type: Optional[asyncio.Semaphore]
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily to bind to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+
+class Upstream:
+
+    METADATA = 'metadata'
+    SYNC = 'sync'
+    FILE = 'file'
+
+    def __init__(self, config: UpstreamConfig):
+        self._operations = {
+            name: UpstreamOperation(name, op_config)
+            for name, op_config in config.operations.items()
+        }  # type: Dict[str, UpstreamOperation]
+
+    async def _limited(self, operation: str, factory: Callable[[], Awaitable]) -> Any:
+        op = self._operations[operation]
+        async with op.semaphore:
+            try:
+                return await asyncio.wait_for(factory(), timeout=op.timeout)
+            except asyncio.TimeoutError:
+                UPSTREAM_TIMEOUTS.inc(operation=operation)
+                raise UpstreamTimeoutError(operation, op.timeout)
+
+    async def call(self, operation: str, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        return await self._limited(operation, lambda: func(*args, **kwargs))
+
+    async def transfer(self, operation: str, func: Callable[[Callable[[bytes], None]], Awaitable],
+                       write: Callable[[bytes], None]) -> Any:
+        # the timeout applies to waiting for the response and for each chunk, not to the whole transfer
+        op = self._operations[operation]
+        loop = asyncio.get_running_loop()
+        active = loop.time()
+
+        def progress(chunk: bytes):
+            nonlocal active
+            active = loop.time()
+            write(chunk)
+
+        async with op.semaphore:
+            task = asyncio.ensure_future(func(progress))
+            try:
+                while True:
+                    done, _ = await asyncio.wait([task], timeout=active + op.timeout - loop.time())
+                    if done:
+                        return task.result()
+                    if loop.time() >= active + op.timeout:
+                        task.cancel()
+                        await asyncio.wait([task])
+                        UPSTREAM_TIMEOUTS.inc(operation=operation)
+                        raise UpstreamTimeoutError(operation, op.timeout)
+            finally:
+                task.cancel()
@@ -1,20 +1,73 @@
-from pyzotero import zotero
+import asyncio
+import contextvars
+import datetime
+import gzip
+import json
+import logging
+import pathlib
+import time
 
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
-from zoteroxy.cache import Cache, FileCache
+from zoteroxy.cache import Cache, Download, FileCache, create_backend, write_atomic
+from zoteroxy.client import ZoteroAPIError, ZoteroClient
+from zoteroxy.compression import Compressor, IDENTITY
 from zoteroxy.config import ZoteroxyConfig
+from zoteroxy.governor import UpstreamGovernor
+from zoteroxy.index import SearchIndex
+from zoteroxy.metrics import LIBRARY_ITEMS, LIBRARY_VERSION, SNAPSHOT_DURATION, SYNC_DURATION
 from zoteroxy.model import LibraryItem, Collection, Attachment
+from zoteroxy.prefetch import AttachmentPrefetcher, limit_size
+from zoteroxy.profiling import phase
+from zoteroxy.snapshot import CollectionSnapshot
+from zoteroxy.sync import LibrarySync
+from zoteroxy.upstream import Upstream
+
+
+logger = logging.getLogger(__name__)
+
+STATE_FORMAT = 1
 
 
 class Zotero:
 
     def __init__(self, config: ZoteroxyConfig):
         self.config = config
-        self._metadata_cache = Cache(duration=config.settings.cache_duration)
+        self.compressor = Compressor(config.settings.compression)
+        self._backend = create_backend(config.settings.cache_backend,
+                                       config.settings.cache_backend_path)
+        self._metadata_cache = Cache(duration=config.settings.cache_duration,
+                                     max_stale=config.settings.cache_max_stale,
+                                     background_refresh=config.settings.cache_background_refresh,
+                                     backend=self._backend,
+                                     lease_ttl=config.settings.cache_lease_ttl)
         self._file_cache = FileCache(duration=config.settings.cache_file_duration,
-                                     directory=config.settings.cache_directory)
-        self.library = zotero.Zotero(config.library.id, config.library.type, config.zotero.api_key)
+                                     directory=config.settings.cache_directory,
+                                     compressor=self.compressor,
+                                     max_size=config.settings.cache_file_max_size,
+                                     max_entries=config.settings.cache_file_max_entries,
+                                     backend=self._backend,
+                                     lease_ttl=config.settings.cache_lease_ttl,
+                                     prefetch_share=config.settings.prefetch.cache_share)
+        self.library = ZoteroClient(config)
+        self.upstream = Upstream(config.settings.upstream)
+        self._sync = self._library_sync()
+        self._snapshot = None  # type: Optional[CollectionSnapshot]
+        self._building = None  # type: Optional[asyncio.Future]
+        self._search = SearchIndex()
+        self._models = dict()  # type: Dict[str, Tuple[tuple, LibraryItem]]
+        self._prefetcher = AttachmentPrefetcher(config.settings.prefetch,
+                                                is_cached=self.attachment_cached,
+                                                has_room=self._prefetch_room,
+                                                download=self._prefetch_download)
+        self._prefetched = None  # type: Optional[Tuple[Optional[int], float]]
+        self._state = None  # type: Optional[dict]
+        self._generation = 0
+        self._tasks = []  # type: List[asyncio.Task]
+
+    def _library_sync(self) -> LibrarySync:
+        return LibrarySync(self.library, tags=self.config.settings.tags,
+                           tags_allowed=self._tags_allowed)
 
     def _tags_allowed(self, tags) -> bool:
         tags = set(tags)
@@ -24,8 +77,19 @@ class Zotero:
                 return False
         return True
 
-    def attachment_metadata(self, key) -> Attachment:
-        item = self._metadata_cache.get(key=f'item_{key}', callback=lambda k: self.library.item(key))
+    async def attachment_metadata(self, key) -> Attachment:
+        # attachments of the synchronized library are known without asking Zotero
+        item = self._sync.items.get(key, None)
+        try:
+            if item is None:
+                item = await self._metadata_cache.get(
+                    key=f'item_{key}',
+                    callback=lambda k: self.upstream.call(Upstream.METADATA, self.library.item, key)
+                )
+        except ZoteroAPIError as e:
+            if e.status == 404:
+                raise RuntimeError('Unknown item')
+            raise
         if item['data']['itemType'] != 'attachment':
             raise RuntimeError('Not an attachment')
         metadata = Attachment(item)
@@ -33,43 +97,250 @@ class Zotero:
             raise RuntimeError('Not allowed attachment')
         return metadata
 
-    def attachment_data(self, metadata: Attachment) -> bytes:
-        file_key = f'{metadata.key}_{metadata.file_hash}'
-        data = self._file_cache.get(file_key, callback=lambda k: self.library.file(metadata.key))
+    @staticmethod
+    def _file_key(metadata: Attachment) -> str:
+        return f'{metadata.key}_{metadata.file_hash}'
+
+    def _download_file(self, metadata: Attachment, priority: int = UpstreamGovernor.INTERACTIVE,
+                       max_size: int = 0):
+        def callback(key, write):
+            if max_size > 0:
+                write = limit_size(write, max_size)
+            return self.upstream.transfer(
+                Upstream.FILE, lambda progress: self.library.file(metadata.key, progress, priority), write)
+        return callback
+
+    async def attachment_data(self, metadata: Attachment) -> bytes:
+        data = await self._file_cache.get(
+            self._file_key(metadata),
+            callback=self._download_file(metadata),
+            content_type=metadata.content_type,
+        )
         return data
 
-    def _items(self) -> dict:
-        items_dict = dict()
-        items_list = self.library.everything(
-            self.library.items(tag=self.config.settings.tags)
-        )  # type: List[dict]
-        for item in items_list:
-            key = item.get('key', None)
-            data = item.get('data', dict())
-            item_type = data.get('itemType', None)
-            if key is None or item_type is None:
-                continue
-            items_dict[key] = item
-            items_dict[key]['children'] = list()
-        for key, item in items_dict.items():
-            parent_key = item['data'].get('parentItem', None)
-            if parent_key is not None and parent_key in items_dict.keys():
-                items_dict[parent_key]['children'].append(item)
-        return items_dict
+    async def attachment_encodings(self, metadata: Attachment) -> List[str]:
+        return await self._file_cache.variants(self._file_key(metadata))
+
+    async def attachment_path(self, metadata: Attachment, encoding: str = IDENTITY) -> Optional[pathlib.Path]:
+        return await self._file_cache.path(self._file_key(metadata), encoding)
+
+    def attachment_download(self, metadata: Attachment) -> Download:
+        return self._file_cache.download(
+            self._file_key(metadata),
+            callback=self._download_file(metadata),
+            content_type=metadata.content_type,
+        )
+
+    async def attachment_cached(self, metadata: Attachment) -> bool:
+        return await self._file_cache.has(self._file_key(metadata))
+
+    def _prefetch_room(self, metadata: Attachment) -> bool:
+        return self._file_cache.can_prefetch(metadata.size)
+
+    def _prefetch_download(self, metadata: Attachment, max_size: int) -> Download:
+        return self._file_cache.download(
+            self._file_key(metadata),
+            callback=self._download_file(metadata, UpstreamGovernor.PREFETCH, max_size),
+            content_type=metadata.content_type,
+            prefetch=True,
+        )
+
+    def _prefetch(self):
+        if not self._prefetcher.enabled:
+            return
+        # expired files are prefetched again even if the library did not change
+        now = time.monotonic()
+        if self._prefetched is not None and self._prefetched[0] == self.version \
+                and now - self._prefetched[1] < self.config.settings.cache_file_duration:
+            return
+        self._prefetched = (self.version, now)
+        attachments = (Attachment(item) for item in self._sync.items.values()
+                       if item['data']['itemType'] == 'attachment')
+        self._prefetcher.schedule(a for a in attachments if self._tags_allowed(a.tags))
+
+    async def _items(self) -> dict:
+        # the cache may be purged meanwhile, the sync then finishes only for its waiters
+        sync = self._sync
+        version = sync.version
+        with SYNC_DURATION.time(), phase('sync'):
+            await self.upstream.call(Upstream.SYNC, sync.sync)
+        if sync is not self._sync:
+            return sync.dump()
+        if self._state is None or sync.version is None or self._state['version'] != sync.version:
+            # unchanged state is neither copied nor written to the shared cache again
+            self._state = sync.dump()
+        if sync.version != version:
+            await self._save_state(self._state)
+        self._prefetch()
+        return self._state
 
     @property
-    def items(self) -> List[LibraryItem]:
-        result = self._metadata_cache.get(key='items', callback=lambda k: self._items())  # type: dict
-        items = (LibraryItem(item) for item in result.values())
-        return [i for i in items if i.type != 'attachment']
+    def _state_key(self) -> dict:
+        return {
+            'format': STATE_FORMAT,
+            'library': f'{self.config.library.type}/{self.config.library.id}',
+            'tags': sorted(self.config.settings.tags),
+        }
+
+    def _load_state(self) -> bool:
+        path = self.config.settings.cache_state_file
+        if path is None or not path.exists():
+            return False
+        try:
+            with gzip.open(path, mode='rt', encoding='utf-8') as f:
+                state = json.load(f)
+            if any(state.get(k, None) != v for k, v in self._state_key.items()):
+                logger.info('Ignoring library state of different configuration')
+                return False
+            self._sync.restore(state)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning('Ignoring corrupted library state: %s', e)
+            self._sync.reset()
+            return False
+        return True
+
+    @staticmethod
+    def _write_state(path: pathlib.Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, gzip.compress(data))
+
+    async def _save_state(self, state: dict):
+        path = self.config.settings.cache_state_file
+        if path is None:
+            return
+        # serialized on the loop so a concurrent sync cannot change it meanwhile
+        data = json.dumps(dict(state, **self._state_key)).encode('utf-8')
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_state, path, data)
+        except OSError as e:
+            logger.warning('Saving library state failed: %s', e)
 
     @property
-    def collection(self):
-        return Collection(
-            items=self.items,
-            config=self.config
-        )
+    def version(self) -> Optional[int]:
+        return self._sync.version
+
+    @staticmethod
+    def _revision(item: dict) -> tuple:
+        children = tuple((c['key'], c.get('version', None)) for c in item['children'])
+        return item.get('version', None), children
+
+    def _library_items(self, items: List[Tuple[str, dict]]) -> Dict[str, Tuple[tuple, LibraryItem]]:
+        # items (and their attachments) of the same version are reused
+        models = dict()  # type: Dict[str, Tuple[tuple, LibraryItem]]
+        for key, item in items:
+            if item['data']['itemType'] == 'attachment':
+                continue
+            revision = self._revision(item)
+            model = self._models.get(key, None)
+            if model is None or model[0] != revision or revision[0] is None:
+                model = (revision, LibraryItem(item))
+            models[key] = model
+        return models
+
+    def _build_snapshot(self, version: Optional[int], modified_at: Optional[datetime.datetime],
+                        items: List[Tuple[str, dict]], previous: Optional[CollectionSnapshot]):
+        with SNAPSHOT_DURATION.time():
+            with phase('items'):
+                models = self._library_items(items)
+            with phase('collection'):
+                collection = Collection(items=[item for _, item in models.values()], config=self.config)
+            with phase('index'):
+                self._search.update(collection.items)
+            with phase('serialize'):
+                snapshot = CollectionSnapshot(
+                    version=version,
+                    collection=collection,
+                    compressor=self.compressor,
+                    search=self._search,
+                    stream_min_items=self.config.settings.streaming_min_items,
+                    previous=previous,
+                    modified_at=modified_at,
+                )
+        return models, snapshot
+
+    async def _build(self) -> CollectionSnapshot:
+        # built in a thread so other requests are served meanwhile
+        try:
+            sync = self._sync
+            items = list(sync.items.items())
+            loop = asyncio.get_running_loop()
+            models, snapshot = await loop.run_in_executor(
+                None, contextvars.copy_context().run,
+                self._build_snapshot, sync.version, sync.modified_at, items, self._snapshot,
+            )
+            if sync is self._sync:
+                self._models = models
+                self._snapshot = snapshot
+            LIBRARY_ITEMS.set(len(snapshot.collection.items))
+            LIBRARY_VERSION.set(snapshot.version or 0)
+            return snapshot
+        finally:
+            self._building = None
+
+    async def snapshot(self) -> CollectionSnapshot:
+        generation = self._generation
+        state = await self._metadata_cache.get(key='items', callback=lambda k: self._items())  # type: dict
+        if generation != self._generation:
+            # loaded before the cache was purged, not restored to the fresh sync
+            return await self.snapshot()
+        if self.version is None or (state['version'] or 0) > self.version:
+            # synchronized by another process
+            self._sync.restore(state)
+            self._state = state
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version is None or snapshot.version != self.version:
+            if self._building is None:
+                self._building = asyncio.ensure_future(self._build())
+            snapshot = await asyncio.shield(self._building)
+        return snapshot
+
+    async def items(self) -> List[LibraryItem]:
+        return (await self.snapshot()).collection.items
+
+    async def collection(self) -> Collection:
+        return (await self.snapshot()).collection
+
+    @property
+    def cache_stats(self) -> dict:
+        return {
+            'metadata': self._metadata_cache.stats,
+            'file': self._file_cache.stats,
+        }
 
     def clear_cache(self):
+        path = self.config.settings.cache_state_file
+        if path is not None and path.exists():
+            path.unlink()
+        self._snapshot = None
+        self._models = dict()
+        self._prefetcher.cancel()
+        self._prefetched = None
+        self._state = None
+        self._generation += 1
+        self._sync = self._library_sync()
         self._metadata_cache.clear()
         self._file_cache.clear()
+
+    async def start(self):
+        if not await self._metadata_cache.has('items') and self._load_state():
+            logger.info('Loaded library state (version %s, %d items)',
+                        self.version, len(self._sync.items))
+            # served right away, refreshed from Zotero in the background
+            self._state = self._sync.dump()
+            self._metadata_cache.set('items', self._state)
+            self._metadata_cache.refresh('items', lambda k: self._items())
+        if self.config.settings.cache_file_sweep_interval > 0:
+            self._tasks.append(asyncio.ensure_future(
+                self._file_cache.sweep(self.config.settings.cache_file_sweep_interval)
+            ))
+
+    async def close(self):
+        self._prefetcher.cancel()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        await self.library.close()
+        await self._file_cache.close()
+        if self._backend is not None:
+            self._backend.close()